@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+
+class SteeringMap:
+    """Vectorized conversion between wheel angle and steering wheel position
+
+    By default the conversion is linear, ``delta = (qc - zero_ref) * qc_to_delta``.
+    If a lookup table is given, both directions are interpolated linearly
+    in the table instead, so non linear steering linkages can be modelled.
+    A table can be fitted from measured pairs with :func:`fit`.
+
+    All methods accept scalars or arrays and convert every element in a
+    single call. Values outside the limits are clamped to them and, if
+    requested, a mask with the elements that were inside the limits is
+    returned as well.
+
+    Args:
+        zero_ref: position of steering wheel for a null angle [qc].
+        qc_to_delta: linear gain [degrees/qc].
+        min_qc: minimum position of steering wheel [qc].
+        max_qc: maximum position of steering wheel [qc].
+        min_angle: minimum angle of wheels [degrees].
+        max_angle: maximum angle of wheels [degrees].
+        table (optional): tuple (qc, delta) of arrays with a monotonic lookup table.
+    """
+
+    def __init__(self, zero_ref, qc_to_delta, min_qc, max_qc, min_angle, max_angle,
+                 table=None):
+        self.zero_ref = zero_ref
+        self.qc_to_delta = float(qc_to_delta)
+        self.min_qc = min_qc
+        self.max_qc = max_qc
+        self.min_angle = min_angle
+        self.max_angle = max_angle
+        self.table = None
+        if table is not None:
+            qc = np.asarray(table[0], dtype='float64')
+            delta = np.asarray(table[1], dtype='float64')
+            if len(qc) < 2 or len(qc) != len(delta):
+                raise ValueError('Lookup table needs at least two pairs of values')
+            order = np.argsort(qc)
+            qc, delta = qc[order], delta[order]
+            step = np.diff(delta)
+            if not (np.all(step > 0) or np.all(step < 0)):
+                raise ValueError('Lookup table must be strictly monotonic')
+            self.table = (qc, delta)
+            # np.interp needs increasing x values for the inverse
+            order = np.argsort(delta)
+            self._inverse = (delta[order], qc[order])
+
+    @classmethod
+    def fit(cls, qc, delta, zero_ref, qc_to_delta, min_qc, max_qc, min_angle, max_angle,
+            degree=3, n_points=256):
+        """Build a map with a lookup table fitted to measurements
+
+        A polynomial is fitted to the measured pairs and sampled in
+        ``n_points`` between the position limits, so using the map costs a
+        table interpolation instead of evaluating the polynomial.
+
+        Args:
+            qc: array of measured positions of steering wheel [qc].
+            delta: array of measured angles of wheels [degrees].
+            zero_ref, qc_to_delta, min_qc, max_qc, min_angle, max_angle: see :class:`SteeringMap`.
+            degree (optional): degree of polynomial. Default 3.
+            n_points (optional): number of points of table. Default 256.
+        Returns:
+            SteeringMap: the fitted map.
+        """
+        coefficients = np.polyfit(np.asarray(qc, dtype='float64'),
+                                  np.asarray(delta, dtype='float64'), degree)
+        table_qc = np.linspace(min_qc, max_qc, n_points)
+        return cls(zero_ref, qc_to_delta, min_qc, max_qc, min_angle, max_angle,
+                   table=(table_qc, np.polyval(coefficients, table_qc)))
+
+    def to_qc(self, delta, return_mask=False):
+        """Convert angles of wheels to positions of steering wheel
+
+        Args:
+            delta: scalar or array of angles [degrees].
+            return_mask (optional): also return mask of values inside limits.
+        Returns:
+            numpy.ndarray: rounded positions [qc] as int64 or, if return_mask
+            is set, a tuple with positions and the boolean mask.
+        """
+        delta = np.asarray(delta, dtype='float64')
+        clamped = np.clip(delta, self.min_angle, self.max_angle)
+        if self.table is None:
+            qc = clamped / self.qc_to_delta + self.zero_ref
+        else:
+            qc = np.interp(clamped, *self._inverse)
+        qc = np.rint(qc)
+        result = np.clip(qc, self.min_qc, self.max_qc).astype('int64')
+        if return_mask:
+            return result, (delta == clamped) & (qc == result)
+        return result
+
+    def to_delta(self, qc, return_mask=False):
+        """Convert positions of steering wheel to angles of wheels
+
+        Args:
+            qc: scalar or array of positions [qc].
+            return_mask (optional): also return mask of values inside limits.
+        Returns:
+            numpy.ndarray: angles [degrees] or, if return_mask is set, a
+            tuple with angles and the boolean mask.
+        """
+        qc = np.asarray(qc, dtype='float64')
+        clamped = np.clip(qc, self.min_qc, self.max_qc)
+        if self.table is None:
+            delta = (clamped - self.zero_ref) * self.qc_to_delta
+        else:
+            delta = np.interp(clamped, *self.table)
+        if return_mask:
+            return delta, qc == clamped
+        return delta
+
+    def as_dict(self):
+        """Lookup table as a dictionary to be saved
+
+        Returns:
+            dict: lists 'qc' and 'delta' or None if map is linear.
+        """
+        if self.table is None:
+            return None
+        return {'qc': self.table[0].tolist(), 'delta': self.table[1].tolist()}
@@ -21,15 +21,35 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
 import logging
+import os
 import sys
 import threading
 import time
-import queue
 import numpy as np
 
 sys.path.append('../')
 from epos import Epos
+import parameters
+from motion_profile import JerkReducedProfile, max_speed_from_period
+from steering_map import SteeringMap
+from telemetry import TelemetryBuffer
+
+
+def median_filter(values, window=5):
+    """Remove isolated outliers with a running median
+
+    Args:
+        values: array of samples.
+        window (optional): odd number of samples of the median. Default 5.
+    Returns:
+        numpy.ndarray: filtered samples, shorter by window - 1 samples.
+    """
+    values = np.asarray(values)
+    if len(values) < window:
+        return values
+    return np.median(np.lib.stride_tricks.sliding_window_view(values, window), axis=1)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -46,6 +66,25 @@ class EposController(Epos):
     maxAngle = 29  # type: int
     minAngle = -maxAngle
     dataDir = "./data/"  # type: str
+    # t_max = 1.7 seems to be the limit before oscillations.
+    maxSpeed = max_speed_from_period(0.2)  # [qc]/s
+    # max acceleration must be experimental obtained.
+    maxAcceleration = 6000.0  # [qc]/s^2
+    setpoints = None  # type: TelemetryBuffer
+    feedback = None  # type: TelemetryBuffer
+    # optional TelemetryRecorder to keep every sample of all movements
+    recorder = None  # type: TelemetryRecorder
+    # velocity, current and statusword are recorded every N cycles of movements
+    recordDecimation = 10  # type: int
+    # optional FollowingErrorWatchdog, started by user, quick stopping movements
+    watchdog = None  # type: FollowingErrorWatchdog
+    calibrationFile = "calibration.json"  # type: str
+    calibrationVersion = 2  # type: int
+    # conversion between angle and qc, built after calibration
+    steeringMap = None  # type: SteeringMap
+    # TPDO used to stream position during calibration and its inhibit time [100us]
+    calibrationTPDO = 1  # type: int
+    calibrationInhibitTime = 10  # type: int
 
     def get_qc_position(self, delta):
         """ Converts angle of wheels to qc
@@ -72,10 +111,10 @@ class EposController(Epos):
                 self.minAngle,
                 delta))
             return None
-        # perform calculations y = mx + b
-        val = delta * self.DELTA_TO_QC + self.zeroRef
-        val = round(val)
-        return int(val)
+        if self.steeringMap.table is None:
+            # perform calculations y = mx + b
+            return int(round(delta * self.DELTA_TO_QC + self.zeroRef))
+        return int(self.steeringMap.to_qc(delta))
 
     def get_delta_angle(self, qc):
         """ Converts qc of steering wheel to angle of wheel
@@ -90,20 +129,93 @@ class EposController(Epos):
         if not self.calibrated:
             self.log_info('Device is not yet calibrated')
             return None
+        if self.steeringMap.table is None:
+            # perform calculations y = mx + b and solve to x
+            return float((qc - self.zeroRef) * self.QC_TO_DELTA)
+        return float(self.steeringMap.to_delta(qc))
+
+    def get_qc_positions(self, delta, return_mask=False):
+        """Convert an array of angles of wheels to qc in a single call
+
+        Angles and positions outside the limits are clamped. See
+        :func:`steering_map.SteeringMap.to_qc`.
+
+        Args:
+            delta: array of angles of wheels in degrees.
+            return_mask (optional): also return mask of values inside limits.
+        Returns:
+            numpy.ndarray: positions in qc, with the mask if requested, or
+            None if device is not calibrated.
+        """
+        if not self.calibrated:
+            self.log_info('Device is not yet calibrated')
+            return None
+        return self.steeringMap.to_qc(delta, return_mask)
+
+    def get_delta_angles(self, qc, return_mask=False):
+        """Convert an array of qc positions to angles of wheels in a single call
+
+        Positions outside the limits are clamped. See
+        :func:`steering_map.SteeringMap.to_delta`.
+
+        Args:
+            qc: array of positions of steering wheel.
+            return_mask (optional): also return mask of values inside limits.
+        Returns:
+            numpy.ndarray: angles in degrees, with the mask if requested, or
+            None if device is not calibrated.
+        """
+        if not self.calibrated:
+            self.log_info('Device is not yet calibrated')
+            return None
+        return self.steeringMap.to_delta(qc, return_mask)
+
+    def _update_steering_map(self, table=None):
+        """Build the conversion map from the calibration values
+        """
+        self.steeringMap = SteeringMap(self.zeroRef, self.QC_TO_DELTA, self.minValue,
+                                       self.maxValue, self.minAngle, self.maxAngle, table)
+
+    def fit_steering_table(self, qc, delta, degree=3):
+        """Replace the linear conversion with a table fitted to measurements
+
+        The result is saved with the calibration.
 
-        # perform calculations y = mx + b and solve to x
-        delta = (qc - self.zeroRef) * self.QC_TO_DELTA
-        return float(delta)
+        Args:
+            qc: array of measured positions of steering wheel.
+            delta: array of angles of wheels measured at those positions in degrees.
+            degree (optional): degree of fitted polynomial. Default 3.
+        Returns:
+            bool: True if table was fitted and saved.
+        """
+        if not self.calibrated:
+            self.log_info('Device is not yet calibrated')
+            return False
+        try:
+            self.steeringMap = SteeringMap.fit(qc, delta, self.zeroRef, self.QC_TO_DELTA,
+                                               self.minValue, self.maxValue,
+                                               self.minAngle, self.maxAngle, degree)
+        except ValueError as e:
+            self.log_info('Failed to fit steering table: {0}'.format(e))
+            return False
+        return self.save_calibration()
 
-    def start_calibration(self, exit_flag=None):
+    def start_calibration(self, exit_flag=None, use_pdo=True):
         """Perform steering wheel calibration
 
         This function is expected to be run on a thread in order to find the limits
         of the steering wheel position and find the expected value of the zero angle
         of wheels.
 
+        Positions are streamed by a TPDO, sent whenever the position changes,
+        so every sample is captured while the wheel is moved. If the TPDO can
+        not be configured, positions are polled over SDO instead. Outliers are
+        rejected with a running median before finding the limits and the
+        result is saved with :func:`save_calibration`.
+
         Args:
             exit_flag: threading.Event() to signal the finish of acquisition
+            use_pdo (optional): stream positions by TPDO. Default True.
 
         """
         # check if inputs were supplied
@@ -115,7 +227,7 @@ class EposController(Epos):
         # Confirm epos is in a suitable state for free movement
         # -----------------------------------------------------------------------
         # failed to get state?
-        if state_id is -1:
+        if state_id == -1:
             self.log_info('Error: Unknown state')
             return
         # If epos is not in disable operation at least, motor is expected to be blocked
@@ -128,35 +240,182 @@ class EposController(Epos):
                 return
             self.log_info('Successfully changed state to shutdown')
 
-        max_value = 0
-        min_value = 0
+        positions = None
+        if use_pdo:
+            positions = self._sweep_pdo(exit_flag)
+        if positions is None:
+            positions = self._sweep_sdo(exit_flag)
+        filtered = median_filter(positions)
+        if not len(filtered):
+            self.log_info('No positions acquired')
+            return
+        self.log_info('Finished calibration routine with {0} samples, {1} outliers removed'.format(
+            len(positions), int(np.count_nonzero(
+                (positions < filtered.min()) | (positions > filtered.max())))))
+        self.minValue = int(filtered.min())
+        self.maxValue = int(filtered.max())
+        self.zeroRef = round((self.maxValue - self.minValue) / 2.0 + self.minValue)
+        self.calibrated = 1
+        self._update_steering_map()
+        self.log_info('MinValue: {0}, MaxValue: {1}, ZeroRef: {2}'.format(
+            self.minValue, self.maxValue, self.zeroRef
+        ))
+        self.save_calibration()
+        return
+
+    def _sweep_pdo(self, exit_flag):
+        """Acquire positions streamed by TPDO until exit_flag is set
+
+        The previous configuration of the TPDO and NMT state of device are
+        restored afterwards.
+
+        Returns:
+            numpy.ndarray: positions received or None if TPDO could not be used.
+        """
+        position, ok = self.read_position_value()
+        if not ok:
+            return None
+        state, ok = self.read_nmt_state()
+        if not ok:
+            state = 'OPERATIONAL'
+        name = 'tpdo{0}'.format(self.calibrationTPDO)
+        previous, ok = parameters.dump_parameters(self, {'pdo': {name: None}})
+        if not ok:
+            self.log_info('Failed to read TPDO, using SDO')
+            return None
+        if not self.change_nmt_state('PRE-OPERATIONAL'):
+            return None
+        samples = TelemetryBuffer([('t', 'float64'), ('position', 'int32')], capacity=65536)
+        samples.append(time.monotonic(), position)
+
+        def on_position(can_id, data, timestamp):
+            samples.append(timestamp, int.from_bytes(data[:4], 'little', signed=True))
+
+        cob_id = self.tpdo_cob_id(self.calibrationTPDO)
+        subscribed = False
+        try:
+            if not self.configure_tpdo(self.calibrationTPDO,
+                                       [(self.objectIndex['Position Actual Value'], 0, 32)],
+                                       inhibit_time=self.calibrationInhibitTime):
+                self.log_info('Failed to configure TPDO, using SDO')
+                return None
+            self.network.subscribe(cob_id, on_position)
+            subscribed = True
+            self.change_nmt_state('OPERATIONAL')
+            exit_flag.wait()
+        finally:
+            if subscribed:
+                self.network.unsubscribe(cob_id, on_position)
+            _, ok = parameters.apply_parameters(self, previous, store=False,
+                                                restore_state='PRE-OPERATIONAL')
+            if not ok:
+                self.log_info('Failed to restore {0}'.format(name))
+            self.change_nmt_state(state)
+        return samples['position'].copy()
+
+    def _sweep_sdo(self, exit_flag):
+        """Poll positions over SDO until exit_flag is set
+
+        Returns:
+            numpy.ndarray: positions read.
+        """
+        samples = TelemetryBuffer([('t', 'float64'), ('position', 'int32')])
         num_fails = 0
-        # -----------------------------------------------------------------------
-        # start requesting for positions of sensor
-        # -----------------------------------------------------------------------
-        while not exit_flag.isSet():
+        while not exit_flag.is_set():
             current_value, ok = self.read_position_value()
             if not ok:
                 self.log_debug('Failed to request current position')
                 num_fails = num_fails + 1
             else:
-                if current_value > max_value:
-                    max_value = current_value
-                if current_value < min_value:
-                    min_value = current_value
+                samples.append(time.monotonic(), current_value)
             # sleep?
             time.sleep(0.01)
+        if num_fails:
+            self.log_info('Failed to read position {0} times'.format(num_fails))
+        return samples['position'].copy()
+
+    def calibration_filename(self):
+        """Path of calibration file
+
+        Returns:
+            str: path of calibration file inside dataDir.
+        """
+        return os.path.join(self.dataDir, self.calibrationFile)
+
+    def save_calibration(self, filename=None):
+        """Save calibration to a json file
+
+        The file is written to a temporary file first and then renamed, so a
+        valid calibration is never partially overwritten.
+
+        Args:
+            filename (optional): path of file. Default is :func:`calibration_filename`.
+        Returns:
+            bool: True if saved.
+        """
+        if not self.calibrated:
+            self.log_info('Device is not yet calibrated')
+            return False
+        if filename is None:
+            filename = self.calibration_filename()
+        data = {'version': self.calibrationVersion,
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'minValue': int(self.minValue),
+                'maxValue': int(self.maxValue),
+                'zeroRef': int(self.zeroRef),
+                'QC_TO_DELTA': self.QC_TO_DELTA,
+                'table': self.steeringMap.as_dict() if self.steeringMap else None}
+        try:
+            directory = os.path.dirname(filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(filename + '.tmp', 'w') as f:
+                json.dump(data, f, indent=4)
+            os.replace(filename + '.tmp', filename)
+        except OSError as e:
+            self.log_info('Failed to save calibration: {0}'.format(e))
+            return False
+        self.log_info('Calibration saved to {0}'.format(filename))
+        return True
+
+    def load_calibration(self, filename=None):
+        """Load calibration saved by :func:`save_calibration`
 
-        self.log_info(
-            'Finished calibration routine with {0} fail readings'.format(num_fails))
-        self.minValue = min_value
-        self.maxValue = max_value
-        self.zeroRef = round((max_value - min_value) / 2.0 + min_value)
+        Args:
+            filename (optional): path of file. Default is :func:`calibration_filename`.
+        Returns:
+            bool: True if a valid calibration was loaded.
+        """
+        if filename is None:
+            filename = self.calibration_filename()
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log_info('Failed to load calibration: {0}'.format(e))
+            return False
+        version = data.get('version', 0)
+        if version < 1 or version > self.calibrationVersion:
+            self.log_info('Unsupported calibration version: {0}'.format(version))
+            return False
+        try:
+            self.minValue = int(data['minValue'])
+            self.maxValue = int(data['maxValue'])
+            self.zeroRef = int(data['zeroRef'])
+            self.QC_TO_DELTA = float(data['QC_TO_DELTA'])
+            # lookup table was added in version 2
+            table = data.get('table')
+            if table is not None:
+                table = (table['qc'], table['delta'])
+            self._update_steering_map(table)
+        except (KeyError, TypeError, ValueError) as e:
+            self.log_info('Invalid calibration file: {0}'.format(e))
+            return False
+        self.DELTA_TO_QC = 1.0 / self.QC_TO_DELTA
         self.calibrated = 1
-        self.log_info('MinValue: {0}, MaxValue: {1}, ZeroRef: {2}'.format(
-            self.minValue, self.maxValue, self.zeroRef
-        ))
-        return
+        self.log_info('Calibration loaded from {0}: MinValue: {1}, MaxValue: {2}, ZeroRef: {3}'.format(
+            filename, self.minValue, self.maxValue, self.zeroRef))
+        return True
 
     def move_to_position(self, pos_final, is_angle=False):
         """Move to desired position.
@@ -174,35 +433,8 @@ class EposController(Epos):
         .. [1] Li, Huaizhong & M Gong, Z & Lin, Wei & Lippa, T. (2007). Motion profile planning for reduced jerk and vibration residuals. 10.13140/2.1.4211.2647.
         """
         # constants
-        # t_max = 1.7 seems to be the limit before oscillations.
-        t_max = 0.2  # max period for 1 rotation;
-        # 1 rev = 3600*4 [qc]
-        countsPerRev = 3600 * 4
-        #
-        # 1Hz = 60rpm = 360degrees/s
-        #
-        # 360 degrees = sensor resolution * 4
-        #
-        # this yields: 1Hz = (sensor resolution * 4)/s
-        #
-        # Fmax = 1 / t_max;
-        #
-        # max_speed = 60 rpm/t_max [rpm]=
-        #          = 360degrees/t_max [degrees/s]=
-        #          = (sensor resolution *4)/t_max [qc/s]
-
-        max_speed = countsPerRev / t_max  # degrees per sec
-
-        # max acceleration must be experimental obtained.
-        # reduced and fixed.
-        max_acceleration = 6000.0  # [qc]/s^2
-
-        # maximum interval for both the acceleration  and deceleration phase are:
-        t1_max = 2.0 * max_speed / max_acceleration  # type: float
-
-        # the max distance covered by these two phase (assuming acceleration equal
-        # deceleration) is 2* 1/4 * Amax * t1_max^2 = 1/2 * Amax * t1_max^2 = 2Vmax^2/Amax
-        max_l13 = 2.0 * max_speed ** 2 / max_acceleration  # type: float
+        max_speed = self.maxSpeed  # [qc]/s
+        max_acceleration = self.maxAcceleration  # [qc]/s^2
 
         # max error in quadrature counters
         max_error = 7500
@@ -267,50 +499,37 @@ class EposController(Epos):
         # -----------------------------------------------------------------------
         # Find remaining constants
         # -----------------------------------------------------------------------
-        # absolute of displacement
-        l = abs(pos_final - p_start)
-        if l is 0:
+        if pos_final == p_start:
             # already in final point
             return True
-        # do we need  a constant velocity phase?
-        if l > max_l13:
-            t2 = 2.0 * (l - max_l13) / (max_acceleration * t1_max)
-            t1 = t1_max
-            t3 = t1_max
-        else:
-            t1 = np.sqrt(2 * l / max_acceleration)
-            t2 = 0.0
-            t3 = t1
-
-        # time constants
-        t1 = t1
-        t2 = t2 + t1
-        t3 = t3 + t2  # final time
+        profile = JerkReducedProfile(p_start, pos_final, max_speed, max_acceleration)
+        t3 = profile.t3  # final time
 
         # allocate vars
-        in_var = np.array([], dtype='int32')
-        out_var = np.array([], dtype='int32')
-        tin = np.array([], dtype='int32')
-        tout = np.array([], dtype='int32')
-        ref_error = np.array([], dtype='int32')
-
-        # determine the sign of movement
-        move_up_or_down = np.sign(pos_final - p_start)
+        self.setpoints = TelemetryBuffer([('t', 'float64'), ('position', 'int32')])
+        self.feedback = TelemetryBuffer([('t', 'float64'), ('position', 'int32'),
+                                         ('error', 'int32')])
+
         flag = True
-        pi = np.pi
-        cos = np.cos
         time.sleep(0.01)
         # choose monotonic for precision
         t0 = time.monotonic()
         num_fails = 0
+        cycle = 0
+        # last velocity, current and statusword read for recorder
+        record_values = [0, 0, 0]
         while flag and not self.errorDetected:
+            if self.watchdog is not None and self.watchdog.tripped.is_set():
+                self.log_info('Following error watchdog tripped, movement aborted')
+                return False
             # request current time
-            tin = np.append(tin, [time.monotonic() - t0])
+            t_in = time.monotonic() - t0
             # time to exit?
-            if tin[-1] > t3:
+            if t_in > t3:
                 flag = False
-                in_var = np.append(in_var, [pos_final])
-                self.set_position_mode_setting(pos_final)
+                pos_ref = pos_final
+                self.setpoints.append(t_in, pos_ref)
+                self.set_position_mode_setting(pos_ref)
                 # reading a position takes time, as so, it should be enough
                 # for it reaches end value since steps are expected to be
                 # small
@@ -319,37 +538,16 @@ class EposController(Epos):
                     self.log_info('Failed to request current position')
                     num_fails = num_fails + 1
                 else:
-                    out_var = np.append(out_var, [aux])
-                    tout = np.append(tout, [time.monotonic() - t0])
-                    ref_error = np.append(ref_error, [in_var[-1] - out_var[-1]])
+                    self.feedback.append(time.monotonic() - t0, aux, pos_ref - aux)
+                    if self.recorder:
+                        self._record_sample(cycle, record_values, pos_ref, aux)
             # not finished
             else:
                 # get reference position for that time
-                if tin[-1] <= t1:
-                    aux = p_start + \
-                          move_up_or_down * max_acceleration / 2.0 * (t1 / (2.0 * pi)) ** 2 * \
-                          (1 / 2.0 * (2.0 * pi / t1 *
-                                      tin[-1]) ** 2 - (1.0 - cos(2.0 / t1 * pi * tin[-1])))
-                else:
-                    if (t2 > 0 and tin[-1] > t1 and tin[-1] <= t2):
-                        aux = p_start + \
-                              move_up_or_down * \
-                              (1 / 4.0 * max_acceleration * t1 ** 2 + 1 /
-                               2.0 * max_acceleration * t1 * (tin[-1] - t1))
-                    else:
-                        aux = p_start + \
-                              move_up_or_down * (1 / 4.0 * max_acceleration * t1 ** 2
-                                                 + 1 / 2.0 * max_acceleration * t1 * t2 +
-                                                 max_acceleration / 2.0 *
-                                                 (t1 / (2.0 * pi)) ** 2
-                                                 * ((2.0 * pi) ** 2 * (tin[-1] - t2) / t1 - 1 / 2.0 * (2.0 * pi / t1
-                                                                                                       * (tin[
-                                                                                                              -1] - t2)) ** 2 + (
-                                                            1.0 - cos(2.0 * pi / t1 * (tin[-1] - t2)))))
-                aux = round(aux)
+                pos_ref = profile.position_at(t_in)
                 # append to array and send to device
-                in_var = np.append(in_var, [aux])
-                ok = self.set_position_mode_setting(np.int32(in_var[-1]).item())
+                self.setpoints.append(t_in, pos_ref)
+                ok = self.set_position_mode_setting(pos_ref)
                 if not ok:
                     self.log_info('Failed to set target position')
                     num_fails = num_fails + 1
@@ -358,20 +556,72 @@ class EposController(Epos):
                     self.log_info('Failed to request current position')
                     num_fails = num_fails + 1
                 else:
-                    out_var = np.append(out_var, [aux])
-                    tout = np.append(tout, [time.monotonic() - t0])
-                    ref_error = np.append(ref_error, [in_var[-1] - out_var[-1]])
-                    if abs(ref_error[-1]) > max_error:
-                        self.change_state('shutdown')
+                    ref_error = pos_ref - aux
+                    self.feedback.append(time.monotonic() - t0, aux, ref_error)
+                    if self.recorder:
+                        self._record_sample(cycle, record_values, pos_ref, aux)
+                    if abs(ref_error) > max_error:
+                        if self.watchdog is not None and self.watchdog.running:
+                            # single frame instead of two SDO requests
+                            self.watchdog.quick_stop()
+                        else:
+                            self.change_state('shutdown')
                         self.log_info(
                             'Something seems wrong, error is growing to mutch!!!')
                         return False
+            cycle = cycle + 1
             # require sleep?
             time.sleep(0.005)
         self.log_info('Finished with {0} fails'.format(num_fails))
         return True
 
+    def _record_sample(self, cycle, values, setpoint, position):
+        """Write a sample of a movement to recorder
 
+        Velocity, current and statusword cost an SDO request each, so they
+        are read every recordDecimation cycles and the last values read are
+        kept in values. The statusword of events is used when enabled.
+        """
+        if cycle % self.recordDecimation == 0:
+            velocity, ok = self.read_velocity_value()
+            if ok:
+                values[0] = velocity
+            current, ok = self.read_current_value()
+            if ok:
+                values[1] = current
+            if self.statusword is None:
+                statusword, ok = self.read_statusword()
+                if ok:
+                    values[2] = statusword
+        if self.statusword is not None:
+            values[2] = self.statusword
+        self.recorder.record(setpoint, position, values[0], values[1], values[2])
+
+
+
+
+def calibrate(epos, recalibrate=False):
+    """Load saved calibration or perform the manual sweep
+
+    Args:
+        epos: a connected :class:`EposController`.
+        recalibrate (optional): ignore saved calibration. Default False.
+    Returns:
+        bool: True if device is calibrated.
+    """
+    if not recalibrate and epos.load_calibration():
+        return True
+    exit_flag = threading.Event()
+    epos_thread = threading.Thread(name="CALIBRATION", target=epos.start_calibration,
+                                   args=(exit_flag,))
+    epos_thread.start()
+    try:
+        print("Please move steering wheel to extreme positions to calibrate...")
+        input("Press Enter when done...")
+    finally:
+        exit_flag.set()
+        epos_thread.join()
+    return bool(epos.calibrated)
 
 
 def main():
@@ -397,6 +647,8 @@ def main():
                         help='Node ID [ must be between 1- 127]', dest='nodeID')
     parser.add_argument('--objDict', action='store', default=None,
                         type=str, help='Object dictionary file', dest='objDict')
+    parser.add_argument('--recalibrate', action='store_true', default=False,
+                        help='Ignore saved calibration', dest='recalibrate')
     args = parser.parse_args()
 
     # set up logging to file - see previous section for more details
@@ -415,46 +667,28 @@ def main():
     # add the handler to the root logger
     logging.getLogger('').addHandler(console)
 
-    # event flag to exit
-    exit_flag = threading.Event()
-
     # instantiate object
-    epos = Epos()
-
-    min_value = 0
-    max_value = 0
-    results_queue = queue.Queue()
-    # declare threads
-    epos_thread = threading.Thread(name="EPOS", target=start_calibration,
-                                   args=(results_queue, epos, exit_flag))
+    epos = EposController()
 
-    if not (epos.begin(args.nodeID, object_dictionary=args.objDict)):
+    if not (epos.begin(args.nodeID, _channel=args.channel, _bustype=args.bus,
+                       object_dictionary=args.objDict)):
         logging.info('Failed to begin connection with EPOS device')
         logging.info('Exiting now')
         return
 
     try:
-        epos_thread.start()
-        print("Please move steering wheel to extreme positions to calibrate...")
-        input("Press Enter when done...")
+        if not calibrate(epos, args.recalibrate):
+            logging.info("Failed to perform calibration")
+            return
     except KeyboardInterrupt as e:
         logging.warning('Got exception {0}... exiting now'.format(e))
         return
+    finally:
+        epos.disconnect()
 
-    exit_flag.set()
-    epos_thread.join()
-    try:
-        ret_vals = results_queue.get(timeout=30)
-    except queue.Empty:
-        logging.info("Queue response timeout")
-        return
-    if ret_vals is None:
-        logging.info("Failed to perform calibration")
-        return
-    max_value = ret_vals['max_value']
-    min_value = ret_vals['min_value']
     print("---------------------------------------------")
-    print("Max Value: {0}\nMin Value: {1}".format(max_value, min_value))
+    print("Max Value: {0}\nMin Value: {1}\nZero Ref: {2}".format(
+        epos.maxValue, epos.minValue, epos.zeroRef))
     print("---------------------------------------------")
     return
 
@@ -0,0 +1,435 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+sys.path.append('../')
+from motion_profile import BlendedMotion
+from steering_server_pdo import EposController, calibrate
+
+
+class Mailbox:
+    """Thread safe mailbox holding only the latest value
+
+    Writing never blocks and replaces any value not yet taken, so a fast
+    producer can never build a queue in front of a slow consumer. Each
+    value written gets a sequence number, used by readers to know if there
+    is something new.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = None
+        self._seq = 0
+        self._taken = 0
+        # number of values replaced before being taken
+        self.coalesced = 0
+
+    def put(self, value):
+        """Store a new value, replacing the previous one
+
+        Args:
+            value: value to be stored.
+        """
+        with self._lock:
+            if self._seq != self._taken:
+                self.coalesced += 1
+            self._value = value
+            self._seq += 1
+
+    def take(self):
+        """Get the value if it was not taken before
+
+        Returns:
+            the newest value or None if there is nothing new.
+        """
+        with self._lock:
+            if self._seq == self._taken:
+                return None
+            self._taken = self._seq
+            return self._value
+
+    def peek(self):
+        """Get the newest value without consuming it
+
+        Returns:
+            tuple: A tuple containing:
+
+            :value: the newest value or None if nothing was written.
+            :seq: sequence number of value.
+        """
+        with self._lock:
+            return self._value, self._seq
+
+
+class SteeringService:
+    """Network steering service for an :class:`EposController`
+
+    Clients send steering angles over TCP or UDP as text lines::
+
+        angle <degrees>
+        status
+
+    Every angle received is written to a :class:`Mailbox`, so only the
+    latest command is kept. A fixed rate motion loop, running in its own
+    thread, takes the latest command and replans a
+    :class:`motion_profile.BlendedMotion` towards it, so a new target is
+    followed from the next cycle without waiting for the current movement
+    to finish. The setpoint is sent to the device and the actual position
+    is read on each cycle, using the limits of the controller. The
+    state of the loop is published back to clients as json lines at
+    ``publish_rate``, with the fields ``t``, ``angle``, ``position``,
+    ``target``, ``statusword`` and ``fails``. TCP clients receive it while
+    connected and UDP clients during ``udp_timeout`` seconds after their last
+    datagram. Updates to clients not reading fast enough are dropped instead
+    of buffered.
+
+    Args:
+        controller: a calibrated :class:`EposController`.
+        host (optional): address to listen on. Default '127.0.0.1'.
+        tcp_port (optional): TCP port or None to disable. Default 5001.
+        udp_port (optional): UDP port or None to disable. Default 5001.
+        rate (optional): frequency of motion loop [Hz]. Default 100.
+        publish_rate (optional): frequency of status updates [Hz]. Default 20.
+    """
+    # cycles between each read of statusword
+    status_every = 10
+    # max bytes waiting in a TCP client before updates are dropped
+    write_limit = 4096
+    udp_timeout = 5.0
+
+    def __init__(self, controller, host='127.0.0.1', tcp_port=5001, udp_port=5001,
+                 rate=100, publish_rate=20):
+        self.controller = controller
+        self.host = host
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+        self.period = 1.0 / rate
+        self.publish_period = 1.0 / publish_rate
+        self.commands = Mailbox()
+        self.state = Mailbox()
+        self.exit_flag = threading.Event()
+        self.logger = logging.getLogger('STEERING')
+        self.received = 0
+        self.rejected = 0
+        self.overruns = 0
+        self._writers = set()
+        self._udp_peers = {}
+        self._udp_transport = None
+        self._motion_thread = None
+
+    # --------------------------------------------------------------------------
+    # Motion loop
+    # --------------------------------------------------------------------------
+
+    def _enable(self):
+        """Bring device to operation enabled state
+
+        Returns:
+            bool: True if device is enabled.
+        """
+        epos = self.controller
+        state = epos.check_state()
+        if state == -1:
+            self.logger.info('Error: Unknown state')
+            return False
+        if state == 11 and not epos.change_state('fault reset'):
+            self.logger.info('Error: Failed to change state to fault reset')
+            return False
+        for new_state in ('shutdown', 'switch on', 'enable operation'):
+            if not epos.change_state(new_state):
+                self.logger.info('Failed to change Epos state to {0}'.format(new_state))
+                return False
+        return True
+
+    def _motion_loop(self):
+        """Fixed rate loop consuming the latest command
+
+        Deadlines are absolute, so the period does not drift with the time
+        spent on each cycle. If the loop falls more than one period behind,
+        the deadline is reset and the cycle is counted as an overrun.
+
+        The service is stopped when the loop finishes for any reason, so
+        clients are not left sending commands nobody follows.
+        """
+        try:
+            self._run_motion()
+        except Exception as e:
+            self.logger.info('Exception caught in motion loop: {0}'.format(e))
+        finally:
+            self.exit_flag.set()
+
+    def _run_motion(self):
+        epos = self.controller
+        position, ok = epos.read_position_value()
+        if not ok:
+            self.logger.info('Failed to request current position')
+            return
+        motion = BlendedMotion(position, epos.maxSpeed, epos.maxAcceleration)
+        target_angle = epos.get_delta_angle(position)
+        statusword = None
+        fails = 0
+        cycle = 0
+        t0 = time.monotonic()
+        deadline = t0
+        while not self.exit_flag.is_set() and not epos.errorDetected:
+            t = time.monotonic() - t0
+            angle = self.commands.take()
+            if angle is not None:
+                qc = epos.get_qc_position(angle)
+                if qc is None:
+                    self.rejected += 1
+                else:
+                    motion.set_target(qc, t)
+                    target_angle = angle
+            if not epos.set_position_mode_setting(motion.position_at(t)):
+                fails += 1
+            position, ok = epos.read_position_value()
+            if not ok:
+                fails += 1
+            if cycle % self.status_every == 0:
+                value, status_ok = epos.read_statusword()
+                if status_ok:
+                    statusword = value
+            cycle += 1
+            if ok:
+                self.state.put({'t': time.monotonic() - t0,
+                                'angle': epos.get_delta_angle(position),
+                                'position': position,
+                                'target': target_angle,
+                                'statusword': statusword,
+                                'fails': fails})
+            deadline += self.period
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            elif remaining < -self.period:
+                self.overruns += 1
+                deadline = time.monotonic()
+        self.logger.info('Motion loop finished after {0} cycles with {1} fails '
+                         'and {2} overruns'.format(cycle, fails, self.overruns))
+
+    # --------------------------------------------------------------------------
+    # Network
+    # --------------------------------------------------------------------------
+
+    def _handle_line(self, line):
+        """Parse a command line
+
+        Args:
+            line: text line received.
+        Returns:
+            bool: True if the client requested the current status.
+        """
+        fields = line.split()
+        if not fields:
+            return False
+        if fields[0] == 'angle' and len(fields) == 2:
+            try:
+                angle = float(fields[1])
+            except ValueError:
+                self.rejected += 1
+                return False
+            if not math.isfinite(angle):
+                self.rejected += 1
+                return False
+            self.received += 1
+            self.commands.put(angle)
+            return False
+        if fields[0] == 'status':
+            return True
+        self.rejected += 1
+        return False
+
+    def _status_line(self):
+        """Latest state encoded as a json line
+        """
+        value, _ = self.state.peek()
+        return (json.dumps(value) + '\n').encode('utf-8')
+
+    async def _handle_client(self, reader, writer):
+        """Serve one TCP client
+        """
+        peer = writer.get_extra_info('peername')
+        self.logger.info('Client connected: {0}'.format(peer))
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if self._handle_line(line.decode('utf-8', 'replace')):
+                    writer.write(self._status_line())
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+            self.logger.info('Client disconnected: {0}'.format(peer))
+
+    class _UdpProtocol(asyncio.DatagramProtocol):
+
+        def __init__(self, service):
+            self.service = service
+
+        def datagram_received(self, data, addr):
+            service = self.service
+            service._udp_peers[addr] = time.monotonic()
+            for line in data.decode('utf-8', 'replace').splitlines():
+                if service._handle_line(line):
+                    service._udp_transport.sendto(service._status_line(), addr)
+
+    async def _publish(self):
+        """Send the latest state to clients at a fixed rate
+        """
+        last_seq = 0
+        while not self.exit_flag.is_set():
+            await asyncio.sleep(self.publish_period)
+            _, seq = self.state.peek()
+            if seq == last_seq:
+                continue
+            last_seq = seq
+            message = self._status_line()
+            for writer in list(self._writers):
+                # drop update if client is not reading
+                if writer.transport.get_write_buffer_size() < self.write_limit:
+                    writer.write(message)
+            now = time.monotonic()
+            for addr, last_seen in list(self._udp_peers.items()):
+                if now - last_seen > self.udp_timeout:
+                    del self._udp_peers[addr]
+                else:
+                    self._udp_transport.sendto(message, addr)
+
+    async def serve(self):
+        """Start motion loop and serve clients until :func:`stop` is called
+        """
+        if not self._enable():
+            return
+        self._motion_thread = threading.Thread(name='MOTION', target=self._motion_loop)
+        self._motion_thread.start()
+        loop = asyncio.get_running_loop()
+        server = None
+        try:
+            if self.tcp_port is not None:
+                server = await asyncio.start_server(self._handle_client, self.host,
+                                                    self.tcp_port)
+                self.logger.info('Listening on tcp {0}:{1}'.format(self.host, self.tcp_port))
+            if self.udp_port is not None:
+                self._udp_transport, _ = await loop.create_datagram_endpoint(
+                    lambda: self._UdpProtocol(self), local_addr=(self.host, self.udp_port))
+                self.logger.info('Listening on udp {0}:{1}'.format(self.host, self.udp_port))
+            await self._publish()
+        finally:
+            self.exit_flag.set()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+            if self._udp_transport is not None:
+                self._udp_transport.close()
+            for writer in list(self._writers):
+                writer.close()
+            await loop.run_in_executor(None, self._motion_thread.join)
+            self.logger.info('Commands received: {0}, coalesced: {1}, rejected: {2}'.format(
+                self.received, self.commands.coalesced, self.rejected))
+
+    def stop(self):
+        """Signal the service to finish, can be called from any thread
+        """
+        self.exit_flag.set()
+
+
+def main():
+    """Steering service
+
+    Load the saved calibration, or calibrate the steering wheel if there is
+    none, and serve steering commands over the network.
+    """
+
+    import argparse
+    if (sys.version_info < (3, 7)):
+        print("Please use python version 3.7 or above")
+        return
+
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description='Steering command service')
+    parser.add_argument('--channel', '-c', action='store', default='can0',
+                        type=str, help='Channel to be used', dest='channel')
+    parser.add_argument('--bus', '-b', action='store',
+                        default='socketcan', type=str, help='Bus type', dest='bus')
+    parser.add_argument('--nodeID', action='store', default=1, type=int,
+                        help='Node ID [ must be between 1- 127]', dest='nodeID')
+    parser.add_argument('--objDict', action='store', default=None,
+                        type=str, help='Object dictionary file', dest='objDict')
+    parser.add_argument('--host', action='store', default='127.0.0.1',
+                        type=str, help='Address to listen on', dest='host')
+    parser.add_argument('--tcp', action='store', default=5001, type=int,
+                        help='TCP port', dest='tcp_port')
+    parser.add_argument('--udp', action='store', default=5001, type=int,
+                        help='UDP port', dest='udp_port')
+    parser.add_argument('--rate', action='store', default=100, type=float,
+                        help='Motion loop frequency [Hz]', dest='rate')
+    parser.add_argument('--recalibrate', action='store_true', default=False,
+                        help='Ignore saved calibration', dest='recalibrate')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s.%(msecs)03d] [%(name)-12s]: %(levelname)-8s %(message)s',
+                        datefmt='%d-%m-%Y %H:%M:%S',
+                        filename='steering_service.log',
+                        filemode='w')
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    console.setFormatter(logging.Formatter('%(name)-20s: %(levelname)-8s %(message)s'))
+    logging.getLogger('').addHandler(console)
+
+    epos = EposController()
+    if not epos.begin(args.nodeID, _channel=args.channel, _bustype=args.bus,
+                      object_dictionary=args.objDict):
+        logging.info('Failed to begin connection with EPOS device')
+        logging.info('Exiting now')
+        return
+
+    if not calibrate(epos, args.recalibrate):
+        logging.info('Failed to perform calibration')
+        epos.disconnect()
+        return
+
+    service = SteeringService(epos, host=args.host, tcp_port=args.tcp_port,
+                              udp_port=args.udp_port, rate=args.rate)
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        service.stop()
+    epos.change_state('shutdown')
+    epos.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+import time
+import can
+from pdo_planner import frame_bits
+
+# classes of COB-IDs of CANopen predefined connection set
+CLASSES = ['nmt', 'sync', 'emcy', 'time', 'tpdo', 'rpdo', 'sdo', 'heartbeat', 'other']
+
+
+def _class_table():
+    """Class index of each 11 bit COB-ID
+    """
+    table = [CLASSES.index('other')] * 0x800
+    ranges = [('nmt', 0x000, 0x001), ('sync', 0x080, 0x081), ('emcy', 0x081, 0x100),
+              ('time', 0x100, 0x101), ('tpdo', 0x181, 0x200), ('rpdo', 0x201, 0x280),
+              ('tpdo', 0x281, 0x300), ('rpdo', 0x301, 0x380), ('tpdo', 0x381, 0x400),
+              ('rpdo', 0x401, 0x480), ('tpdo', 0x481, 0x500), ('rpdo', 0x501, 0x580),
+              ('sdo', 0x581, 0x600), ('sdo', 0x601, 0x680), ('heartbeat', 0x701, 0x780)]
+    for name, start, stop in ranges:
+        for cob_id in range(start, stop):
+            table[cob_id] = CLASSES.index(name)
+    return table
+
+
+# bits of frames by number of data bytes, with 11 and 29 bit identifiers
+_BITS = [frame_bits(n) for n in range(9)]
+_BITS_EXTENDED = [frame_bits(n, extended=True) for n in range(9)]
+
+
+class _Listener(can.Listener):
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def on_message_received(self, msg):
+        self.monitor.count(msg)
+
+
+class BusMonitor:
+    """Passive monitor of frames and load of a CAN bus
+
+    Frames received by the network and sent through
+    ``network.send_message`` are counted by class of COB-ID, with the
+    number of bits they take on the bus, in a ring of time slices covering
+    a sliding window. Counting a frame costs a table lookup and a few
+    integer additions, so the monitor can be left attached in production.
+
+    Utilisation is estimated with worst case bit stuffing, so it is a
+    slight overestimate. Error frames are counted if the interface delivers
+    them. Frames sent by periodic tasks of the bus itself are only seen if
+    the interface loops them back.
+
+    :func:`snapshot` returns the counters as a dictionary and
+    :func:`prometheus` in the Prometheus text exposition format.
+
+    Args:
+        bitrate (optional): bitrate of bus [bit/s]. Default 1000000.
+        window (optional): length of sliding window [s]. Default 1.0.
+        slices (optional): number of time slices of window. Default 10.
+    """
+
+    def __init__(self, bitrate=1000000, window=1.0, slices=10):
+        self.bitrate = bitrate
+        self.window = window
+        self.slices = slices
+        self._slice = window / slices
+        self._classes = _class_table()
+        self._lock = threading.Lock()
+        self._listener = _Listener(self)
+        self._network = None
+        self._send = None
+        self.reset()
+
+    def reset(self):
+        """Clear all counters
+        """
+        n = len(CLASSES)
+        with self._lock:
+            self.started = time.time()
+            # ring of slices, each with frames and bits of each class
+            self._frames = [[0] * n for _ in range(self.slices)]
+            self._bits = [[0] * n for _ in range(self.slices)]
+            self._errors = [0] * self.slices
+            self._current = int(self.started / self._slice)
+            # counters since start
+            self.total_frames = [0] * n
+            self.total_bits = [0] * n
+            self.total_errors = 0
+
+    def _advance(self, slot):
+        """Move ring to slot, clearing slices left behind
+        """
+        n = len(CLASSES)
+        for step in range(min(slot - self._current, self.slices)):
+            index = (self._current + step + 1) % self.slices
+            self._frames[index] = [0] * n
+            self._bits[index] = [0] * n
+            self._errors[index] = 0
+        self._current = slot
+
+    def count(self, msg, timestamp=None):
+        """Count a frame
+
+        Args:
+            msg: a can.Message.
+            timestamp (optional): time of frame [s], default the message timestamp.
+        """
+        if timestamp is None:
+            timestamp = msg.timestamp or time.time()
+        slot = int(timestamp / self._slice)
+        with self._lock:
+            if slot > self._current:
+                self._advance(slot)
+            # frames delivered late are counted in current slice
+            index = self._current % self.slices
+            if msg.is_error_frame:
+                self._errors[index] += 1
+                self.total_errors += 1
+                return
+            if msg.is_extended_id:
+                cls = CLASSES.index('other')
+                bits = _BITS_EXTENDED[min(msg.dlc, 8)]
+            else:
+                cls = self._classes[msg.arbitration_id & 0x7FF]
+                bits = _BITS[min(msg.dlc, 8)]
+            self._frames[index][cls] += 1
+            self._bits[index][cls] += bits
+            self.total_frames[cls] += 1
+            self.total_bits[cls] += bits
+
+    def _send_message(self, can_id, data, remote=False):
+        self._send(can_id, data, remote)
+        if self._network is not None:
+            self.count(can.Message(arbitration_id=can_id, data=data, is_remote_frame=remote,
+                                   is_extended_id=can_id > 0x7FF), time.time())
+
+    def attach(self, network):
+        """Start counting frames of a connected canopen.Network
+        """
+        self.detach()
+        self._network = network
+        network.notifier.add_listener(self._listener)
+        # frames sent by host are not received back, count them when sent
+        self._send = network.send_message
+        network.send_message = self._send_message
+
+    def detach(self):
+        """Stop counting frames
+        """
+        if self._network is None:
+            return
+        self._network.notifier.remove_listener(self._listener)
+        if self._network.__dict__.get('send_message') == self._send_message:
+            del self._network.send_message
+            self._send = None
+        self._network = None
+
+    def snapshot(self):
+        """Counters of the sliding window and since start
+
+        Returns:
+            dict: window length [s], utilisation, frames per second, error
+            frames and, for each class, frames, bits, frames per second and
+            utilisation in the window and frames and bits since start.
+        """
+        now = time.time()
+        slot = int(now / self._slice)
+        with self._lock:
+            if slot > self._current:
+                self._advance(slot)
+            frames = [sum(column) for column in zip(*self._frames)]
+            bits = [sum(column) for column in zip(*self._bits)]
+            errors = sum(self._errors)
+            total_frames = list(self.total_frames)
+            total_bits = list(self.total_bits)
+            total_errors = self.total_errors
+        # window covers the complete slices plus the current one
+        length = min((self.slices - 1) * self._slice + now - slot * self._slice,
+                     now - self.started)
+        length = max(length, 1e-9)
+        classes = {}
+        for i, name in enumerate(CLASSES):
+            classes[name] = {'frames': frames[i],
+                             'bits': bits[i],
+                             'frames_per_second': frames[i] / length,
+                             'utilisation': bits[i] / (length * self.bitrate),
+                             'total_frames': total_frames[i],
+                             'total_bits': total_bits[i]}
+        return {'time': now,
+                'window': length,
+                'bitrate': self.bitrate,
+                'utilisation': sum(bits) / (length * self.bitrate),
+                'frames_per_second': sum(frames) / length,
+                'error_frames': errors,
+                'total_error_frames': total_errors,
+                'classes': classes}
+
+    def prometheus(self, prefix='canopen_bus'):
+        """Counters in Prometheus text exposition format
+
+        Args:
+            prefix (optional): prefix of metric names. Default 'canopen_bus'.
+        Returns:
+            str: text to be served to Prometheus.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, text, values):
+            lines.append('# HELP {0}_{1} {2}'.format(prefix, name, text))
+            lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, kind))
+            for labels, value in values:
+                lines.append('{0}_{1}{2} {3}'.format(prefix, name, labels, value))
+
+        classes = snapshot['classes']
+        metric('utilisation', 'gauge', 'Estimated fraction of bitrate used in window.',
+               [('', snapshot['utilisation'])])
+        metric('class_utilisation', 'gauge', 'Estimated fraction of bitrate used by class.',
+               [('{{class="{0}"}}'.format(name), classes[name]['utilisation'])
+                for name in CLASSES])
+        metric('frames_per_second', 'gauge', 'Frames per second in window by class.',
+               [('{{class="{0}"}}'.format(name), classes[name]['frames_per_second'])
+                for name in CLASSES])
+        metric('frames_total', 'counter', 'Frames since start by class.',
+               [('{{class="{0}"}}'.format(name), classes[name]['total_frames'])
+                for name in CLASSES])
+        metric('bits_total', 'counter', 'Bits on bus since start by class.',
+               [('{{class="{0}"}}'.format(name), classes[name]['total_bits'])
+                for name in CLASSES])
+        metric('error_frames_total', 'counter', 'Error frames since start.',
+               [('', snapshot['total_error_frames'])])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,548 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import struct
+import sys
+import threading
+import time
+import can
+import numpy as np
+from epos import Epos
+from parameters import PDOS, dump_parameters
+from pdo_planner import SIGNED
+
+# record stored for each frame
+FRAME_DTYPE = np.dtype([('t', '<f8'), ('cob_id', '<u4'), ('dlc', 'u1'), ('flags', 'u1'),
+                        ('data', 'u1', (8,))])
+
+# flags of records
+FLAG_TX = 0x01
+FLAG_ERROR = 0x02
+FLAG_REMOTE = 0x04
+
+MAGIC = b'EPOSCAP\x00'
+VERSION = 1
+_ALIGNMENT = 64
+
+_logger = logging.getLogger('CAPTURE')
+
+# object names by index, to name decoded PDO signals
+_OBJECT_NAMES = dict((index, name) for name, index in Epos.objectIndex.items())
+
+
+def _capture_table(node_ids):
+    """Whether each 11 bit COB-ID is captured
+    """
+    if node_ids is None:
+        return [True] * 0x800
+    table = [False] * 0x800
+    # NMT, SYNC and TIME concern every node
+    for cob_id in (0x000, 0x080, 0x100):
+        table[cob_id] = True
+    for node_id in node_ids:
+        for function in range(0x080, 0x800, 0x080):
+            table[function + node_id] = True
+    return table
+
+
+class _Listener(can.Listener):
+    def __init__(self, capture):
+        self.capture = capture
+
+    def on_message_received(self, msg):
+        self.capture.store(msg)
+
+
+class FrameCapture:
+    """Always-on capture of frames into a fixed size ring
+
+    Frames of the given nodes, plus NMT, SYNC and TIME frames and error
+    frames, are stored with their receive timestamps in preallocated NumPy
+    arrays, overwriting the oldest ones when the ring is full. Frames sent
+    through ``network.send_message`` are stored as well, flagged with
+    :data:`FLAG_TX`.
+
+    :func:`dump` writes the ring to a compact binary file, read back by
+    :func:`load_capture` and decoded by :func:`decode_capture`. The PDO
+    mappings of nodes added with :func:`add_node` are saved in the file,
+    so their PDOs can be decoded offline. If a file name is given for
+    dump_on_fault, the ring is dumped after an EMCY with an error code is
+    received from a captured node, once post_trigger has elapsed, so the
+    reaction to the fault is also in the file.
+
+    Args:
+        node_ids (optional): node IDs whose frames are captured. Default all frames.
+        capacity (optional): number of frames kept. Default 65536.
+        dump_on_fault (optional): file name to dump on fault, may use {node} and {time}.
+        post_trigger (optional): time to keep capturing after a fault before dump [s]. Default 0.1.
+    """
+
+    def __init__(self, node_ids=None, capacity=65536, dump_on_fault=None, post_trigger=0.1):
+        if capacity < 1:
+            raise ValueError('Capacity must be positive: {0}'.format(capacity))
+        self.node_ids = None if node_ids is None else sorted(node_ids)
+        self.capacity = capacity
+        self.dump_on_fault = dump_on_fault
+        self.post_trigger = post_trigger
+        self.pdos = {}
+        self.last_dump = None
+        self._table = _capture_table(self.node_ids)
+        self._lock = threading.Lock()
+        self._listener = _Listener(self)
+        self._network = None
+        self._send = None
+        self._trigger = None
+        self._t = np.zeros(capacity, dtype='<f8')
+        self._cob_id = np.zeros(capacity, dtype='<u4')
+        self._dlc = np.zeros(capacity, dtype='u1')
+        self._flags = np.zeros(capacity, dtype='u1')
+        self._data = np.zeros((capacity, 8), dtype='u1')
+        self.clear()
+
+    def __len__(self):
+        return self._length
+
+    def clear(self):
+        """Discard all frames, keeping the allocated storage
+        """
+        with self._lock:
+            self._head = 0
+            self._length = 0
+            self.dropped = 0
+
+    def store(self, msg, flags=0, timestamp=None):
+        """Store a frame, if it belongs to a captured node
+
+        Args:
+            msg: a can.Message.
+            flags (optional): flags of record. Default 0.
+            timestamp (optional): time of frame [s], default the message timestamp.
+        """
+        cob_id = msg.arbitration_id
+        if msg.is_error_frame:
+            flags |= FLAG_ERROR
+        elif msg.is_extended_id:
+            if self.node_ids is not None:
+                return
+        elif not self._table[cob_id & 0x7FF]:
+            return
+        if msg.is_remote_frame:
+            flags |= FLAG_REMOTE
+        data = msg.data
+        dlc = min(len(data), 8)
+        with self._lock:
+            i = self._head
+            self._t[i] = timestamp if timestamp is not None else msg.timestamp or time.time()
+            self._cob_id[i] = cob_id
+            self._dlc[i] = msg.dlc
+            self._flags[i] = flags
+            row = self._data[i]
+            row[:dlc] = data[:dlc]
+            row[dlc:] = 0
+            self._head = (i + 1) % self.capacity
+            if self._length < self.capacity:
+                self._length += 1
+            else:
+                self.dropped += 1
+        # EMCY with an error code
+        if self.dump_on_fault is not None and 0x080 < cob_id < 0x100 and dlc >= 2 \
+                and (data[0] or data[1]) and not flags & FLAG_TX:
+            self._on_fault(cob_id - 0x080)
+
+    def _on_fault(self, node_id):
+        if self._trigger is not None:
+            return
+        filename = self.dump_on_fault.format(node=node_id, time=time.strftime('%Y%m%d-%H%M%S'))
+        # dump from another thread, not from the one receiving frames
+        self._trigger = threading.Timer(self.post_trigger, self._fault_dump,
+                                        args=(filename, node_id))
+        self._trigger.daemon = True
+        self._trigger.start()
+
+    def _fault_dump(self, filename, node_id):
+        try:
+            count = self.dump(filename, reason='EMCY from node {0}'.format(node_id))
+            _logger.info('Fault of node {0}, {1} frames dumped to {2}'.format(
+                node_id, count, filename))
+        except OSError as e:
+            _logger.info('Failed to dump frames to {0}: {1}'.format(filename, e))
+        self._trigger = None
+
+    def _send_message(self, can_id, data, remote=False):
+        self._send(can_id, data, remote)
+        if self._network is not None:
+            self.store(can.Message(arbitration_id=can_id, data=data, is_remote_frame=remote,
+                                   is_extended_id=can_id > 0x7FF), FLAG_TX, time.time())
+
+    def attach(self, network):
+        """Start capturing frames of a connected canopen.Network
+        """
+        self.detach()
+        self._network = network
+        network.notifier.add_listener(self._listener)
+        # frames sent by host are not received back, store them when sent
+        self._send = network.send_message
+        network.send_message = self._send_message
+
+    def detach(self):
+        """Stop capturing frames
+        """
+        if self._network is None:
+            return
+        self._network.notifier.remove_listener(self._listener)
+        if self._network.__dict__.get('send_message') == self._send_message:
+            del self._network.send_message
+            self._send = None
+        self._network = None
+
+    def add_node(self, epos):
+        """Read the PDO mappings of a node, to decode its PDOs offline
+
+        Args:
+            epos: a connected :class:`epos.Epos`.
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        profile, ok = dump_parameters(epos, {'pdo': dict.fromkeys(PDOS)})
+        if not ok:
+            return False
+        for name, pdo in profile['pdo'].items():
+            self.set_pdo_mapping(epos.node.id, name, pdo['mapping'])
+        return True
+
+    def set_pdo_mapping(self, node_id, name, mapping):
+        """Set the mapping of a PDO of a node, to decode it offline
+
+        Args:
+            node_id: node ID of device.
+            name: one of 'rpdo1' to 'rpdo4' or 'tpdo1' to 'tpdo4'.
+            mapping: list of mapped objects as 'index:subindex:bits' or tuples.
+        """
+        if name not in PDOS:
+            raise ValueError('Unknown PDO: {0}'.format(name))
+        entries = []
+        for entry in mapping:
+            if not isinstance(entry, str):
+                entry = '0x{0:04X}:{1}:{2}'.format(*entry)
+            entries.append(entry)
+        self.pdos.setdefault(node_id, {})[name] = entries
+
+    def frames(self):
+        """Get the stored frames
+
+        Returns:
+            numpy.ndarray: a structured array of :data:`FRAME_DTYPE`, from oldest to newest.
+        """
+        with self._lock:
+            order = (np.arange(self._length) + self._head - self._length) % self.capacity
+            records = np.zeros(self._length, dtype=FRAME_DTYPE)
+            records['t'] = self._t[order]
+            records['cob_id'] = self._cob_id[order]
+            records['dlc'] = self._dlc[order]
+            records['flags'] = self._flags[order]
+            records['data'] = self._data[order]
+        return records
+
+    def dump(self, filename, reason='request'):
+        """Write the stored frames to a file
+
+        The file is made of a header followed by the records, with the same
+        layout as :class:`telemetry.TelemetryRecorder` and magic 'EPOSCAP'.
+        The json description holds the record dtype, time of dump, reason,
+        captured node IDs and PDO mappings.
+
+        Args:
+            filename: path of file to be created.
+            reason (optional): why the frames were dumped. Default 'request'.
+        Returns:
+            int: number of frames written.
+        """
+        records = self.frames()
+        description = json.dumps({'descr': FRAME_DTYPE.descr,
+                                  'dump_time': time.time(),
+                                  'reason': reason,
+                                  'node_ids': self.node_ids,
+                                  'dropped': self.dropped,
+                                  'pdos': {str(node_id): pdos
+                                           for node_id, pdos in self.pdos.items()}}).encode('utf-8')
+        header_size = 28 + len(description)
+        header_size = header_size + (-header_size % _ALIGNMENT)
+        with open(filename, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<HHIQI', VERSION, 0, header_size, len(records),
+                                len(description)))
+            f.write(description)
+            f.write(bytes(header_size - 28 - len(description)))
+            f.write(records.tobytes())
+        self.last_dump = filename
+        return len(records)
+
+
+def load_capture(filename):
+    """Read a file written by :func:`FrameCapture.dump`
+
+    Args:
+        filename: path of capture file.
+    Returns:
+        tuple: A tuple containing:
+
+        :records: a structured array of :data:`FRAME_DTYPE`.
+        :info: a dictionary with the json description of file.
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(28)
+        if len(header) < 28 or header[:8] != MAGIC:
+            raise ValueError('Not a frame capture: {0}'.format(filename))
+        version, _, header_size, count, size = struct.unpack('<HHIQI', header[8:])
+        if version > VERSION:
+            raise ValueError('Unsupported version: {0}'.format(version))
+        info = json.loads(f.read(size).decode('utf-8'))
+    dtype = np.dtype([tuple(field) for field in info['descr']])
+    records = np.fromfile(filename, dtype=dtype, count=count, offset=header_size)
+    return records, info
+
+
+def describe_emcy(code):
+    """Description of an EMCY error code, from :attr:`epos.Epos.emcy_descriptions`
+    """
+    for emcy_code, description in Epos.emcy_descriptions:
+        if emcy_code == code:
+            return description
+    return 'Unknown error 0x{0:04X}'.format(code)
+
+
+def describe_abort(code):
+    """Description of an SDO abort code, from :attr:`epos.Epos.errorIndex`
+    """
+    return Epos.errorIndex.get(code, 'Error code: unknown 0x{0:08X}'.format(code))
+
+
+def decode_states(statusword):
+    """States of EPOS for an array of statuswords, see :func:`epos.Epos.decode_state`
+    """
+    statusword = np.asarray(statusword)
+    state = np.full(statusword.shape, -1, dtype='i1')
+    # test in reverse order, so the first matching state wins
+    for ID, bitmask, value in reversed(Epos.stateBits):
+        state[statusword & bitmask == value] = ID
+    return state
+
+
+def _little_endian(data, offset, size, signed):
+    value = np.zeros(len(data), dtype='<i8')
+    for k in range(size):
+        value |= data[:, offset + k].astype('<i8') << (8 * k)
+    if signed:
+        sign = 1 << (8 * size - 1)
+        value = (value ^ sign) - sign
+    return value
+
+
+def _signal_name(index, subindex):
+    name = _OBJECT_NAMES.get(index, '0x{0:04X}'.format(index))
+    return name if subindex == 0 else '{0} sub {1}'.format(name, subindex)
+
+
+def _decode_pdo(records, mapping, signals):
+    """Add values of objects mapped in a PDO to signals
+    """
+    objects = [tuple(int(field, 0) for field in entry.split(':')) for entry in mapping]
+    length = sum(bits for _, _, bits in objects) // 8
+    records = records[records['dlc'] >= length]
+    offset = 0
+    for index, subindex, bits in objects:
+        size = bits // 8
+        signed = (_OBJECT_NAMES.get(index), subindex) in SIGNED
+        values = _little_endian(records['data'], offset, size, signed)
+        offset += size
+        signals.setdefault(_signal_name(index, subindex), []).append((records['t'], values))
+
+
+def _join(parts):
+    """Join (t, value) arrays of several sources into one array sorted by time
+    """
+    t = np.concatenate([part[0] for part in parts])
+    values = np.concatenate([part[1] for part in parts])
+    order = np.argsort(t, kind='stable')
+    signal = np.zeros(len(t), dtype=[('t', '<f8'), ('value', '<i8')])
+    signal['t'] = t[order]
+    signal['value'] = values[order]
+    return signal
+
+
+def _decode_node(records, node_id, pdos):
+    cob_id = records['cob_id']
+
+    emcy = records[(cob_id == 0x080 + node_id) & (records['dlc'] >= 3)]
+    emcy_array = np.zeros(len(emcy), dtype=[('t', '<f8'), ('code', '<u2'), ('register', 'u1')])
+    emcy_array['t'] = emcy['t']
+    emcy_array['code'] = _little_endian(emcy['data'], 0, 2, False)
+    emcy_array['register'] = emcy['data'][:, 2]
+
+    heartbeat = records[(cob_id == 0x700 + node_id) & (records['dlc'] >= 1)]
+    heartbeat_array = np.zeros(len(heartbeat), dtype=[('t', '<f8'), ('state', 'u1')])
+    heartbeat_array['t'] = heartbeat['t']
+    heartbeat_array['state'] = heartbeat['data'][:, 0] & 0x7F
+
+    sdo_mask = ((cob_id == 0x580 + node_id) | (cob_id == 0x600 + node_id)) & (records['dlc'] == 8)
+    sdo = records[sdo_mask]
+    sdo_array = np.zeros(len(sdo), dtype=[('t', '<f8'), ('request', '?'), ('command', 'u1'),
+                                          ('index', '<u2'), ('subindex', 'u1'),
+                                          ('value', '<u4'), ('abort', '<u4')])
+    sdo_array['t'] = sdo['t']
+    sdo_array['request'] = sdo['cob_id'] == 0x600 + node_id
+    sdo_array['command'] = sdo['data'][:, 0]
+    sdo_array['index'] = _little_endian(sdo['data'], 1, 2, False)
+    sdo_array['subindex'] = sdo['data'][:, 3]
+    value = _little_endian(sdo['data'], 4, 4, False)
+    aborted = sdo_array['command'] == 0x80
+    sdo_array['value'] = np.where(aborted, 0, value)
+    sdo_array['abort'] = np.where(aborted, value, 0)
+
+    signals = {}
+    for name, mapping in pdos.items():
+        if not mapping:
+            continue
+        number = int(name[-1])
+        base = 0x180 if name.startswith('t') else 0x200
+        pdo_cob_id = base + 0x100 * (number - 1) + node_id
+        _decode_pdo(records[cob_id == pdo_cob_id], mapping, signals)
+    # statuswords read by SDO, expedited upload responses
+    uploads = sdo_array[~sdo_array['request'] & (sdo_array['command'] & 0xE2 == 0x42) &
+                        (sdo_array['index'] == Epos.objectIndex['StatusWord'])]
+    if len(uploads):
+        signals.setdefault('StatusWord', []).append((uploads['t'], uploads['value'] & 0xFFFF))
+    signals = {name: _join(parts) for name, parts in signals.items()}
+
+    statusword = signals.get('StatusWord', np.zeros(0, dtype=[('t', '<f8'), ('value', '<i8')]))
+    states = np.zeros(len(statusword), dtype=[('t', '<f8'), ('statusword', '<u2'), ('state', 'i1')])
+    states['t'] = statusword['t']
+    states['statusword'] = statusword['value']
+    states['state'] = decode_states(states['statusword'])
+    return {'emcy': emcy_array,
+            'heartbeat': heartbeat_array,
+            'sdo': sdo_array,
+            'signals': signals,
+            'states': states}
+
+
+def decode_capture(records, info=None):
+    """Decode captured frames into NumPy arrays
+
+    EMCY codes, statusword states and SDO abort codes are decoded with the
+    tables of :class:`epos.Epos`, see :func:`describe_emcy`,
+    :func:`decode_states` and :func:`describe_abort`. PDOs are decoded with
+    the mappings saved in the file, signed as in the EDS.
+
+    Args:
+        records: frames, as returned by :func:`load_capture` or :func:`FrameCapture.frames`.
+        info (optional): description of file, as returned by :func:`load_capture`.
+    Returns:
+        dict: with keys
+
+        * 'sync': times of SYNC frames.
+        * 'nmt': structured array (t, command, node) of NMT commands.
+        * 'error_frames': times of error frames.
+        * 'nodes': a dict for each node ID, holding structured arrays 'emcy'
+          (t, code, register), 'heartbeat' (t, state), 'sdo' (t, request,
+          command, index, subindex, value, abort) and 'states'
+          (t, statusword, state), from statusword PDOs and SDO reads, and
+          'signals', a dict with a (t, value) array for each object in PDOs.
+    """
+    info = info or {}
+    pdos = {int(node_id): mapping for node_id, mapping in info.get('pdos', {}).items()}
+    errors = records['flags'] & FLAG_ERROR != 0
+    t_errors = records['t'][errors]
+    records = records[~errors & (records['flags'] & FLAG_REMOTE == 0) &
+                      (records['cob_id'] < 0x800)]
+    cob_id = records['cob_id']
+
+    nmt = records[(cob_id == 0x000) & (records['dlc'] >= 2)]
+    nmt_array = np.zeros(len(nmt), dtype=[('t', '<f8'), ('command', 'u1'), ('node', 'u1')])
+    nmt_array['t'] = nmt['t']
+    nmt_array['command'] = nmt['data'][:, 0]
+    nmt_array['node'] = nmt['data'][:, 1]
+
+    node_ids = info.get('node_ids')
+    if node_ids is None:
+        function = cob_id & 0x780
+        present = (function >= 0x080) & (cob_id & 0x7F != 0) & (cob_id != 0x100)
+        node_ids = np.unique(cob_id[present] & 0x7F).tolist()
+    nodes = {node_id: _decode_node(records, node_id, pdos.get(node_id, {}))
+             for node_id in node_ids}
+    return {'sync': records['t'][cob_id == 0x080],
+            'nmt': nmt_array,
+            'error_frames': t_errors,
+            'nodes': nodes}
+
+
+def print_capture(decoded, info=None):
+    """Print a summary of frames decoded by :func:`decode_capture`
+
+    Times are printed relative to the time of dump, if info is given.
+    """
+    info = info or {}
+    t_ref = info.get('dump_time', 0.0)
+    print('--------------------------------------------------------------')
+    if 'reason' in info:
+        print('Dumped at {0} on {1}'.format(
+            time.strftime('%d-%m-%Y %H:%M:%S', time.localtime(info['dump_time'])),
+            info['reason']))
+    print('SYNC frames: {0}, NMT commands: {1}, error frames: {2}'.format(
+        len(decoded['sync']), len(decoded['nmt']), len(decoded['error_frames'])))
+    for node_id, node in sorted(decoded['nodes'].items()):
+        print('--------------------------------------------------------------')
+        print('Node {0}'.format(node_id))
+        for emcy in node['emcy']:
+            print('  {0:+.6f} EMCY 0x{1:04X} {2}'.format(emcy['t'] - t_ref, emcy['code'],
+                                                      describe_emcy(emcy['code'])))
+        for sdo in node['sdo'][node['sdo']['command'] == 0x80]:
+            print('  {0:+.6f} SDO abort 0x{1:04X}:{2} {3}'.format(
+                sdo['t'] - t_ref, sdo['index'], sdo['subindex'], describe_abort(sdo['abort'])))
+        changes = node['states'][np.r_[True, np.diff(node['states']['state']) != 0]] \
+            if len(node['states']) else node['states']
+        for change in changes:
+            print('  {0:+.6f} state {1}'.format(change['t'] - t_ref, Epos.state[change['state']]))
+        for name, signal in sorted(node['signals'].items()):
+            print('  {0:<36}{1} samples'.format(name, len(signal)))
+    print('--------------------------------------------------------------')
+
+
+def main():
+    """Print summary of a capture file
+    """
+    import argparse
+    if (sys.version_info < (3, 0)):
+        print("Please use python version 3")
+        return
+    parser = argparse.ArgumentParser(add_help=True, description='Decode a frame capture file')
+    parser.add_argument('filename', type=str, help='Capture file')
+    args = parser.parse_args()
+    records, info = load_capture(args.filename)
+    print_capture(decode_capture(records, info), info)
+
+
+if __name__ == '__main__':
+    main()
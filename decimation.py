@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+
+def lttb(x, y, n_out):
+    """Downsample a series with Largest-Triangle-Three-Buckets
+
+    Keeps the first and last points and, for each of the remaining buckets,
+    the point forming the largest triangle with the point selected in the
+    previous bucket and the average of the next bucket. The shape of the
+    series is preserved with much fewer points.
+
+    Args:
+        x: array with x values, sorted.
+        y: array with y values.
+        n_out: number of points wanted.
+    Returns:
+        tuple: A tuple containing:
+
+        :x: downsampled x values.
+        :y: downsampled y values.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    # bucket limits, excluding first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    index = np.zeros(n_out, dtype=int)
+    index[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of next bucket
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # area of triangles formed with previous selected point
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return x[index], y[index]
+
+
+def minmax(x, y, n_buckets):
+    """Downsample a series with a min/max envelope
+
+    The series is split in buckets with the same number of samples and the
+    minimum and maximum of each bucket are kept, in their original order.
+    Unlike :func:`lttb`, isolated spikes are never removed.
+
+    Args:
+        x: array with x values, sorted.
+        y: array with y values.
+        n_buckets: number of buckets, output has at most twice this size.
+    Returns:
+        tuple: A tuple containing:
+
+        :x: downsampled x values.
+        :y: downsampled y values.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= 2 * n_buckets:
+        return x, y
+    size = n // n_buckets
+    used = size * n_buckets
+    x_out, y_out = _envelope(x[:used].reshape(n_buckets, size),
+                             y[:used].reshape(n_buckets, size))
+    # samples left out of the buckets are kept as they are
+    return np.concatenate((x_out, x[used:])), np.concatenate((y_out, y[used:]))
+
+
+def _envelope(x, y):
+    """Min and max of each row, ordered by position inside the row
+    """
+    rows = np.arange(x.shape[0])
+    i_min = np.argmin(y, axis=1)
+    i_max = np.argmax(y, axis=1)
+    first = np.minimum(i_min, i_max)
+    second = np.maximum(i_min, i_max)
+    x_out = np.empty((x.shape[0], 2), dtype=x.dtype)
+    y_out = np.empty((x.shape[0], 2), dtype=y.dtype)
+    x_out[:, 0] = x[rows, first]
+    x_out[:, 1] = x[rows, second]
+    y_out[:, 0] = y[rows, first]
+    y_out[:, 1] = y[rows, second]
+    return x_out.ravel(), y_out.ravel()
+
+
+class MinMaxDecimator:
+    """Incremental min/max envelope of a growing series
+
+    Samples are added as they arrive and reduced to buckets, each one
+    represented by its minimum and maximum. When the number of points
+    reaches ``max_points``, pairs of buckets are merged and the bucket size
+    is doubled, so the number of points to be drawn is bounded no matter
+    how long the run is, and spikes are never hidden. The minimum and
+    maximum of the whole series are kept as running values.
+
+    Args:
+        max_points (optional): maximum number of points kept. Default 4000.
+    """
+
+    def __init__(self, max_points=4000):
+        # keep an even number of buckets to merge
+        self.max_points = max(4, max_points - max_points % 4)
+        self.bucket = 2
+        self.count = 0
+        self.y_min = None
+        self.y_max = None
+        self._x = np.zeros(self.max_points)
+        self._y = np.zeros(self.max_points)
+        self._n = 0
+        self._pending_x = np.zeros(0)
+        self._pending_y = np.zeros(0)
+
+    def extend(self, x, y):
+        """Add new samples
+
+        Args:
+            x: array with new x values, after the ones already added.
+            y: array with new y values.
+        """
+        x = np.asarray(x, dtype='float64')
+        y = np.asarray(y, dtype='float64')
+        if not len(x):
+            return
+        self.count += len(x)
+        low, high = y.min(), y.max()
+        if self.y_min is None:
+            self.y_min, self.y_max = low, high
+        else:
+            self.y_min = min(self.y_min, low)
+            self.y_max = max(self.y_max, high)
+        x = np.concatenate((self._pending_x, x))
+        y = np.concatenate((self._pending_y, y))
+        while True:
+            n_buckets = min(len(x) // self.bucket, (self.max_points - self._n) // 2)
+            if n_buckets:
+                used = n_buckets * self.bucket
+                x_out, y_out = _envelope(x[:used].reshape(n_buckets, self.bucket),
+                                         y[:used].reshape(n_buckets, self.bucket))
+                self._x[self._n:self._n + len(x_out)] = x_out
+                self._y[self._n:self._n + len(y_out)] = y_out
+                self._n += len(x_out)
+                x, y = x[used:], y[used:]
+            if len(x) < self.bucket:
+                break
+            # no space left, merge pairs of buckets
+            self._merge()
+        self._pending_x, self._pending_y = x, y
+
+    def _merge(self):
+        """Merge pairs of buckets, doubling the bucket size
+        """
+        n = self._n - self._n % 4
+        x_out, y_out = _envelope(self._x[:n].reshape(-1, 4), self._y[:n].reshape(-1, 4))
+        # a bucket left without pair is kept as it is
+        rest = self._n - n
+        self._x[len(x_out):len(x_out) + rest] = self._x[n:self._n]
+        self._y[len(y_out):len(y_out) + rest] = self._y[n:self._n]
+        self._x[:len(x_out)] = x_out
+        self._y[:len(y_out)] = y_out
+        self._n = len(x_out) + rest
+        self.bucket *= 2
+
+    def data(self):
+        """Points to be drawn
+
+        Returns:
+            tuple: A tuple containing:
+
+            :x: x values of envelope, followed by samples not yet in a bucket.
+            :y: y values of envelope, followed by samples not yet in a bucket.
+        """
+        if not len(self._pending_x):
+            return self._x[:self._n], self._y[:self._n]
+        return (np.concatenate((self._x[:self._n], self._pending_x)),
+                np.concatenate((self._y[:self._n], self._pending_y)))
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import can
+import canopen
+
+# SDO upload request of 'Device Type' (0x1000), answered by every CANopen node
+_DEVICE_TYPE_REQUEST = bytes([0x40, 0x00, 0x10, 0x00, 0, 0, 0, 0])
+
+# (key, index, subindex) of objects read from each node found
+_IDENTITY = [('device_type', 0x1000, 0),
+             ('vendor_id', 0x1018, 1),
+             ('product_code', 0x1018, 2),
+             ('revision_number', 0x1018, 3),
+             ('identity_serial', 0x1018, 4),
+             ('software_version', 0x2003, 1),
+             ('hardware_version', 0x2003, 2),
+             ('application_number', 0x2003, 3),
+             ('application_version', 0x2003, 4),
+             ('serial_number', 0x2004, 0)]
+
+# heartbeat state codes
+_NMT_STATES = {0x00: 'INITIALISING', 0x04: 'STOPPED', 0x05: 'OPERATIONAL',
+               0x7F: 'PRE-OPERATIONAL'}
+
+# attempts to send a frame while the transmit queue is full and delay between them [s]
+_SEND_RETRIES = 50
+_SEND_DELAY = 1e-3
+
+
+def _send_paced(network, can_id, data):
+    """Send a frame, waiting while the transmit queue of the interface is full
+    """
+    for _ in range(_SEND_RETRIES - 1):
+        try:
+            network.send_message(can_id, data)
+            return
+        except can.CanOperationError:
+            time.sleep(_SEND_DELAY)
+    network.send_message(can_id, data)
+
+
+def find_nodes(network, node_ids=range(1, 128), timeout=0.1):
+    """Find the nodes present on the bus
+
+    An SDO request of 'Device Type' (0x1000) is sent to every node ID at
+    once, without waiting for replies, and every node answering, even with
+    an abort, or sending a heartbeat or boot-up message during the timeout
+    is taken as present. The whole range is covered in a single round trip.
+
+    A burst of requests may fill the transmit queue of the interface, for
+    example the default txqueuelen of 10 frames of socketcan, in which case
+    a request is sent again after a short delay. Raising txqueuelen, e.g.
+    ``ip link set can0 txqueuelen 128``, avoids the delays.
+
+    Args:
+        network: a connected canopen.Network.
+        node_ids (optional): node IDs to scan. Default 1 to 127.
+        timeout (optional): time to wait for replies [s]. Default 0.1.
+    Returns:
+        dict: NMT state of each node ID found, None if only the SDO reply was seen.
+    """
+    found = {}
+    lock = threading.Lock()
+
+    def on_sdo(can_id, data, timestamp):
+        with lock:
+            found.setdefault(can_id - 0x580, None)
+
+    def on_heartbeat(can_id, data, timestamp):
+        with lock:
+            found[can_id - 0x700] = _NMT_STATES.get(data[0] & 0x7F) if data else None
+
+    node_ids = list(node_ids)
+    for node_id in node_ids:
+        network.subscribe(0x580 + node_id, on_sdo)
+        network.subscribe(0x700 + node_id, on_heartbeat)
+    try:
+        for node_id in node_ids:
+            _send_paced(network, 0x600 + node_id, _DEVICE_TYPE_REQUEST)
+        threading.Event().wait(timeout)
+    finally:
+        for node_id in node_ids:
+            network.unsubscribe(0x580 + node_id, on_sdo)
+            network.unsubscribe(0x700 + node_id, on_heartbeat)
+    with lock:
+        return dict(found)
+
+
+def read_identity(network, node_id, timeout=0.1):
+    """Read identification objects of a node
+
+    Objects not present in the node are left as None, so other CANopen
+    devices on the bus are reported as well.
+
+    Args:
+        network: a connected canopen.Network.
+        node_id: node ID of device.
+        timeout (optional): timeout of each SDO request [s]. Default 0.1.
+    Returns:
+        dict: node_id and the values of 'Device Type' (0x1000), 'Identity
+        Object' (0x1018), 'Version Numbers' (0x2003) and 'Serial Number' (0x2004).
+    """
+    if node_id in network:
+        node = network[node_id]
+        temporary = False
+    else:
+        node = canopen.RemoteNode(node_id, None)
+        node.associate_network(network)
+        temporary = True
+    old_timeout = node.sdo.RESPONSE_TIMEOUT
+    node.sdo.RESPONSE_TIMEOUT = timeout
+    identity = {'node_id': node_id}
+    try:
+        for key, index, subindex in _IDENTITY:
+            try:
+                identity[key] = int.from_bytes(node.sdo.upload(index, subindex), 'little')
+            except (canopen.SdoAbortedError, canopen.SdoCommunicationError):
+                identity[key] = None
+    finally:
+        node.sdo.RESPONSE_TIMEOUT = old_timeout
+        if temporary:
+            node.remove_network()
+    return identity
+
+
+def scan_bus(network, node_ids=range(1, 128), timeout=0.1):
+    """Find every node on the bus and read its identification
+
+    Nodes are found with :func:`find_nodes` and then identified in
+    parallel with :func:`read_identity`.
+
+    Args:
+        network: a connected canopen.Network.
+        node_ids (optional): node IDs to scan. Default 1 to 127.
+        timeout (optional): time to wait for replies [s]. Default 0.1.
+    Returns:
+        list: a dict for each node found, sorted by node ID, see
+        :func:`read_identity`, with the NMT state, if heartbeat was seen.
+    """
+    found = find_nodes(network, node_ids, timeout)
+    if not found:
+        return []
+    with ThreadPoolExecutor(max_workers=len(found)) as executor:
+        nodes = list(executor.map(lambda node_id: read_identity(network, node_id, timeout),
+                                  sorted(found)))
+    for node in nodes:
+        node['nmt_state'] = found[node['node_id']]
+    return nodes
+
+
+def print_nodes(nodes):
+    """Print nodes found by :func:`scan_bus`
+    """
+    print('--------------------------------------------------------------')
+    print('Found {0} node(s)'.format(len(nodes)))
+    for node in nodes:
+        print('--------------------------------------------------------------')
+        print('Node ID:              {0}'.format(node['node_id']))
+        for key, _, _ in _IDENTITY:
+            value = node[key]
+            print('{0:<22}{1}'.format(key.replace('_', ' ').capitalize() + ':',
+                                      '-' if value is None else '0x{0:X}'.format(value)))
+        if node.get('nmt_state'):
+            print('NMT state:            {0}'.format(node['nmt_state']))
+    print('--------------------------------------------------------------')
+
+
+def main():
+    """Scan CAN bus for nodes and print their identification
+    """
+    import argparse
+    if (sys.version_info < (3, 0)):
+        print("Please use python version 3")
+        return
+    parser = argparse.ArgumentParser(add_help=True, description='Find EPOS devices on CAN bus')
+    parser.add_argument('--channel', '-c', action='store', default='can0',
+                        type=str, help='Channel to be used', dest='channel')
+    parser.add_argument('--bus', '-b', action='store',
+                        default='socketcan', type=str, help='Bus type', dest='bus')
+    parser.add_argument('--rate', '-r', action='store', default=None,
+                        type=int, help='bitrate, if applicable', dest='bitrate')
+    parser.add_argument('--timeout', '-t', action='store', default=0.1,
+                        type=float, help='Time to wait for replies [s]', dest='timeout')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s.%(msecs)03d] [%(name)-20s]: %(levelname)-8s %(message)s',
+                        datefmt='%d-%m-%Y %H:%M:%S',
+                        level=logging.INFO)
+    network = canopen.Network()
+    if args.bitrate:
+        network.connect(channel=args.channel, bustype=args.bus, bitrate=args.bitrate)
+    else:
+        network.connect(channel=args.channel, bustype=args.bus)
+    try:
+        print_nodes(scan_bus(network, timeout=args.timeout))
+    finally:
+        network.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,9 @@
 import canopen
 import logging
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
 
 
 class Epos:
@@ -33,6 +36,11 @@ class Epos:
     network = None
     _connected = False
     errorDetected = False
+    # last operation mode set, None if unknown
+    _op_mode = None
+    # polling period of statusword [s] and timeout for set-point acknowledge [s]
+    statuswordPeriod = 0.005
+    setpointTimeout = 0.5
 
     # List of motor types
     motorType = {'DC motor': 1, 'Sinusoidal PM BL motor': 10,
@@ -211,6 +219,19 @@ class Epos:
              6: 'measure init', 7: 'operation enable', 8: 'quick stop active',
              9: 'fault reaction active (disabled)', 10: 'fault reaction active (enable)', 11: 'fault',
              -1: 'Unknown'}
+    # (ID, bitmask, value) of statusword for each state, in order of test
+    stateBits = [(0, 0b0100000101111111, 0),
+                 (1, 0b0100000101111111, 256),
+                 (2, 0b0100000101111111, 320),
+                 (3, 0b0100000101111111, 289),
+                 (4, 0b0000000101111111, 291),
+                 (5, 0b0100000101111111, 16675),
+                 (6, 0b0100000101111111, 16691),
+                 (7, 0b0100000101111111, 311),
+                 (8, 0b0100000101111111, 279),
+                 (9, 0b0100000101111111, 271),
+                 (10, 0b0100000101111111, 287),
+                 (11, 0b0100000101111111, 264)]
 
     # dictionary describing emcy codes received on CANBus
     emcy_descriptions = [
@@ -251,12 +272,25 @@ class Epos:
     def __init__(self, _network=None, debug=False):
 
         # check if network is passed over or create a new one
-        if not _network:
+        # an empty network evaluates as False, so compare with None
+        if _network is None:
             self.network = canopen.Network()
         else:
             self.network = _network
 
         self.logger = logging.getLogger('EPOS')
+        # canopen SDO client is not thread safe, serialise transfers
+        self._sdo_lock = threading.Lock()
+        # last parameters written for Profile Position Mode
+        self._profile_parameters = {}
+        # statusword events, see enable_statusword_events
+        self.statusword = None
+        self._status_cob_id = None
+        self._status_lock = threading.Lock()
+        self._status_waiters = []
+        self._status_callbacks = []
+        # last parameters written for Homing Mode
+        self._homing_parameters = {}
         if debug:
             self.logger.setLevel(logging.DEBUG)
         else:
@@ -280,10 +314,14 @@ class Epos:
                 nodeID, object_dictionary=object_dictionary)
             # emcy messages handles
             self.node.emcy.add_callback(self.emcy_error_print)
+            # device lost values written before if it boots again
+            self.node.nmt.add_heartbeat_callback(self._on_nmt_state)
+            self.clear_cache()
             # in not connected?
             if not self.network.bus:
                 # so try to connect
                 self.network.connect(channel=_channel, bustype=_bustype)
+            self._connected = True
             val, _ = self.read_statusword()  # test if we really have response or is only connected to CAN bus
             if val is None:
                 self._connected = False
@@ -297,6 +335,22 @@ class Epos:
         self.network.disconnect()
         return
 
+    def clear_cache(self):
+        """Forget operation mode and parameters last written to device
+
+        Called when the device may have lost them, after a fault reset,
+        an NMT reset or a boot-up message, so they are written again.
+        """
+        self._op_mode = None
+        self._profile_parameters = {}
+        self._homing_parameters = {}
+
+    def _on_nmt_state(self, state):
+        """Clear cache when device sends its boot-up message
+        """
+        if state == 0:
+            self.clear_cache()
+
     def emcy_error_print(self, emcy_error):
         """Print any EMCY Error Received on CAN BUS
         """
@@ -363,6 +417,7 @@ class Epos:
         """Reads an object
 
          Request a read from dictionary object referenced by index and subindex.
+         SDO transfers are serialised, so it can be called from several threads.
 
          Args:
              index:     reference of dictionary object index
@@ -372,7 +427,8 @@ class Epos:
         """
         if self._connected:
             try:
-                return self.node.sdo.upload(index, subindex)
+                with self._sdo_lock:
+                    return self.node.sdo.upload(index, subindex)
             except Exception as e:
                 self.log_info('Exception caught:{0}'.format(str(e)))
                 return None
@@ -385,6 +441,7 @@ class Epos:
         """Write an object
 
          Request a write to dictionary object referenced by index and subindex.
+         SDO transfers are serialised, so it can be called from several threads.
 
          Args:
              index:     reference of dictionary object index
@@ -395,7 +452,8 @@ class Epos:
         """
         if self._connected:
             try:
-                self.node.sdo.download(index, subindex, data)
+                with self._sdo_lock:
+                    self.node.sdo.download(index, subindex, data)
                 return True
             except canopen.SdoAbortedError as e:
                 text = "Code 0x{:08X}".format(e.code)
@@ -520,84 +578,25 @@ class Epos:
         if not ok:
             self.log_info('Failed to request StatusWord')
             return -1
-        else:
+        ID = self.decode_state(statusword)
+        if ID == -1:
+            self.log_info('Error: Unknown state. Statusword is Bin={0:#018b}'.format(statusword))
+        return ID
+
+    @classmethod
+    def decode_state(cls, statusword):
+        """State of EPOS described by a statusword
 
-            # state 'start' (0)
-            # statusWord == x0xx xxx0  x000 0000
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 0:
-                return 0
-
-            # state 'not ready to switch on' (1)
-            # statusWord == x0xx xxx1  x000 0000
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 256:
-                return 1
-
-            # state 'switch on disabled' (2)
-            # statusWord == x0xx xxx1  x100 0000
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 320:
-                return 2
-
-            # state 'ready to switch on' (3)
-            # statusWord == x0xx xxx1  x010 0001
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 289:
-                return 3
-
-            # state 'switched on' (4)
-            # statusWord == x0xx xxx1  x010 0011
-            bitmask = 0b0000000101111111
-            if bitmask & statusword == 291:
-                return 4
-
-            # state 'refresh' (5)
-            # statusWord == x1xx xxx1  x010 0011
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 16675:
-                return 5
-
-            # state 'measure init' (6)
-            # statusWord == x1xx xxx1  x011 0011
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 16691:
-                return 6
-            # state 'operation enable' (7)
-            # statusWord == x0xx xxx1  x011 0111
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 311:
-                return 7
-
-            # state 'Quick Stop Active' (8)
-            # statusWord == x0xx xxx1  x001 0111
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 279:
-                return 8
-
-            # state 'fault reaction active (disabled)' (9)
-            # statusWord == x0xx xxx1  x000 1111
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 271:
-                return 9
-
-            # state 'fault reaction active (enabled)' (10)
-            # statusWord == x0xx xxx1  x001 1111
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 287:
-                return 10
-
-            # state 'fault' (11)
-            # statusWord == x0xx xxx1  x000 1000
-            bitmask = 0b0100000101111111
-            if bitmask & statusword == 264:
-                return 11
-
-        # in case of unknown state or fail
-        # in case of unknown state or fail
-        self.log_info('Error: Unknown state. Statusword is Bin={0:#018b}'.format(
-            int.from_bytes(statusword, 'little'))
-        )
+        Uses the bits of :attr:`stateBits`, see :func:`check_state`.
+
+        Args:
+            statusword: value of statusword.
+        Returns:
+            int: numeric identification of the state or -1 if unknown.
+        """
+        for ID, bitmask, value in cls.stateBits:
+            if bitmask & statusword == value:
+                return ID
         return -1
 
     def print_state(self):
@@ -882,8 +881,11 @@ class Epos:
         if not op_mode in self.opModes:
             self.log_info("Unknown Operation Mode: {0}".format(op_mode))
             return False
-        op_mode = op_mode.to_bytes(1, 'little', signed=True)
-        return self.write_object(index, subindex, op_mode)
+        if not self.write_object(index, subindex, op_mode.to_bytes(1, 'little', signed=True)):
+            self._op_mode = None
+            return False
+        self._op_mode = op_mode
+        return True
 
     def print_op_mode(self):
         """Print current operation mode
@@ -998,6 +1000,7 @@ class Epos:
                 return self.write_controlword(controlword)
             # fault reset 1xxx xxxx
             if new_state == 'fault reset':
+                self.clear_cache()
                 # set bits
                 mask = (1 << 7)
                 controlword = controlword | mask
@@ -1869,10 +1872,11 @@ class Epos:
             :ok: A boolean if all requests went ok or not.
         """
         index = self.objectIndex['Position Window']
-        position_window, ok = self.read_object(index, 0x0)
-        if not ok:
+        position_window = self.read_object(index, 0x0)
+        if position_window is None:
             self.log_info("Failed to read current position window")
             return None, False
+        position_window = int.from_bytes(position_window, 'little')
         return position_window, True
 
     def set_position_window(self, position_window):
@@ -1914,10 +1918,11 @@ class Epos:
             :ok: A boolean if all requests went ok or not.
         """
         index = self.objectIndex['Position Window Time']
-        position_window_time, ok = self.read_object(index, 0x0)
-        if not ok:
+        position_window_time = self.read_object(index, 0x0)
+        if position_window_time is None:
             self.log_info("Failed to read current position window time")
             return None, False
+        position_window_time = int.from_bytes(position_window_time, 'little')
         return position_window_time, True
 
     def set_position_window_time(self, position_window_time):
@@ -1957,10 +1962,11 @@ class Epos:
             :ok: A boolean if all requests went ok or not.
         """
         index = self.objectIndex['Velocity Actual Value']
-        velocity, ok = self.read_object(index, 0x0)
-        if not ok:
+        velocity = self.read_object(index, 0x0)
+        if velocity is None:
             self.log_info("Failed to read current velocity value")
             return None, False
+        velocity = int.from_bytes(velocity, 'little', signed=True)
         return velocity, True
 
     def read_velocity_value_averaged(self):
@@ -1973,10 +1979,11 @@ class Epos:
             :ok: A boolean if all requests went ok or not.
         """
         index = self.objectIndex['Velocity Actual Value Averaged']
-        velocity, ok = self.read_object(index, 0x0)
-        if not ok:
+        velocity = self.read_object(index, 0x0)
+        if velocity is None:
             self.log_info("Failed to read current velocity averaged value")
             return None, False
+        velocity = int.from_bytes(velocity, 'little', signed=True)
         return velocity, True
 
     def read_current_value(self):
@@ -1989,10 +1996,11 @@ class Epos:
             :ok: A boolean if all requests went ok or not.
         """
         index = self.objectIndex['Current Actual Value']
-        current, ok = self.read_object(index, 0x0)
-        if not ok:
+        current = self.read_object(index, 0x0)
+        if current is None:
             self.log_info("Failed to read current value")
             return None, False
+        current = int.from_bytes(current, 'little', signed=True)
         return current, True
 
     def read_current_value_averaged(self):
@@ -2005,12 +2013,829 @@ class Epos:
             :ok: A boolean if all requests went ok or not.
         """
         index = self.objectIndex['Current Actual Value Averaged']
-        current, ok = self.read_object(index, 0x0)
-        if not ok:
+        current = self.read_object(index, 0x0)
+        if current is None:
             self.log_info("Failed to read current averaged value")
             return None, False
+        current = int.from_bytes(current, 'little', signed=True)
         return current, True
 
+    # --------------------------------------------------------------------------
+    # Profile Position Mode
+    # --------------------------------------------------------------------------
+
+    def set_profile_parameters(self, velocity=None, acceleration=None, deceleration=None,
+                               profile_type=None):
+        """Set parameters of Profile Position Mode
+
+        Only parameters different from the ones last written by this object
+        are sent, so consecutive moves with the same profile cost no
+        additional requests.
+
+        Args:
+            velocity (optional): profile velocity [rpm].
+            acceleration (optional): profile acceleration [rpm/s].
+            deceleration (optional): profile deceleration [rpm/s].
+            profile_type (optional): 0 for linear ramp, 1 for sin² ramp.
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        values = [('Profile Velocity', velocity, 4, False),
+                  ('Profile Acceleration', acceleration, 4, False),
+                  ('Profile Deceleration', deceleration, 4, False),
+                  ('Motion ProfileType', profile_type, 2, True)]
+        for name, value, size, signed in values:
+            if value is None or self._profile_parameters.get(name) == value:
+                continue
+            index = self.objectIndex[name]
+            if not self.write_object(index, 0, int(value).to_bytes(size, 'little', signed=signed)):
+                self.log_info('Failed to set {0}'.format(name))
+                self._profile_parameters.pop(name, None)
+                return False
+            self._profile_parameters[name] = value
+        return True
+
+    def move_profile(self, target, velocity=None, acceleration=None, deceleration=None,
+                     relative=False, immediate=True, timeout=None):
+        """Move to a position in Profile Position Mode
+
+        The trajectory is generated by the device, so the whole movement
+        costs only the requests to set the parameters, the target and the
+        new set-point handshake of controlword:
+
+        1. Profile parameters (see :func:`set_profile_parameters`) and
+           target position are written.
+        2. Controlword bit 4 (new set-point) is set, with bit 5 (change set
+           immediately) and bit 6 (relative) as requested.
+        3. When statusword bit 12 (set-point acknowledge) is set, bit 4 is
+           cleared.
+
+        Device must be in operation enabled state. Operation mode is changed
+        to Profile Position Mode if needed.
+
+        Without statusword events (see :func:`enable_statusword_events`) the
+        future polls statusword over SDO in a background thread. Other
+        requests can be issued meanwhile, since SDO transfers are serialised.
+
+        Args:
+            target: target position [qc].
+            velocity (optional): profile velocity [rpm].
+            acceleration (optional): profile acceleration [rpm/s].
+            deceleration (optional): profile deceleration [rpm/s].
+            relative (optional): target is relative to current target. Default False.
+            immediate (optional): abort current movement. Default True.
+            timeout (optional): maximum time to reach target [s], None to wait forever.
+        Returns:
+            concurrent.futures.Future: future with result True when target is
+            reached or False if the movement failed, timed out or could not be started.
+        """
+        future = Future()
+        if target < -2 ** 31 or target > 2 ** 31 - 1:
+            self.log_info('Position out of range')
+            future.set_result(False)
+            return future
+        if self._op_mode != 1 and not self.set_op_mode(1):
+            self.log_info('Failed to change to Profile Position Mode')
+            future.set_result(False)
+            return future
+        if not self.set_profile_parameters(velocity, acceleration, deceleration):
+            future.set_result(False)
+            return future
+        index = self.objectIndex['Target Position']
+        if not self.write_object(index, 0, int(target).to_bytes(4, 'little', signed=True)):
+            self.log_info('Failed to set target position')
+            future.set_result(False)
+            return future
+        # operation enabled with relative and change immediately flags
+        controlword = 0x000F
+        if immediate:
+            controlword |= 1 << 5
+        if relative:
+            controlword |= 1 << 6
+        acknowledge = self.setpoint_ack_future()
+        if not self.write_controlword(controlword | 1 << 4):
+            self._remove_waiter(acknowledge)
+            future.set_result(False)
+            return future
+        try:
+            ack_status = acknowledge.result(self.setpointTimeout)
+        except TimeoutError:
+            self._remove_waiter(acknowledge)
+            self.log_info('Set-point was not acknowledged')
+            future.set_result(False)
+            return future
+        if not self.write_controlword(controlword):
+            future.set_result(False)
+            return future
+        # target reached of previous movement may still be set when the new
+        # set-point is acknowledged, so wait for it to clear first
+        previous = bool(ack_status & (1 << 10))
+        if self._status_cob_id is None:
+            watcher = threading.Thread(name='EPOS move', target=self._watch_move,
+                                       args=(future, timeout, previous), daemon=True)
+            watcher.start()
+            return future
+        # waiter currently pending, to be removed on timeout
+        waiting = [None]
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._expire_move, args=(future, waiting))
+            timer.daemon = True
+        if previous:
+            cleared = self.statusword_future(1 << 10, 0, abort_mask=1 << 13)
+            waiting[0] = cleared
+            cleared.add_done_callback(
+                lambda done: self._wait_reached(future, waiting, timer, done))
+        else:
+            self._wait_reached(future, waiting, timer)
+        if timer is not None:
+            timer.start()
+        return future
+
+    def _wait_reached(self, future, waiting, timer, cleared=None):
+        """Wait for target reached, once the previous one was cleared
+        """
+        if cleared is not None:
+            if cleared.cancelled():
+                return
+            if cleared.result() & (1 << 13):
+                self._finish_move(future, cleared, timer)
+                return
+        reached = self.statusword_future(1 << 10, 1 << 10, abort_mask=1 << 13)
+        waiting[0] = reached
+        reached.add_done_callback(lambda done: self._finish_move(future, done, timer))
+
+    def _finish_move(self, future, reached, timer):
+        """Resolve the future of a movement from the target reached event
+        """
+        if timer is not None:
+            timer.cancel()
+        if future.done() or reached.cancelled():
+            return
+        if reached.result() & (1 << 13):
+            self.log_info('Following error during movement')
+            future.set_result(False)
+        else:
+            future.set_result(True)
+
+    def _expire_move(self, future, waiting):
+        """Fail a movement whose target was not reached within timeout
+        """
+        if self._remove_waiter(waiting[0]) and not future.done():
+            self.log_info('Target not reached within timeout')
+            future.set_result(False)
+
+    def _wait_statusword(self, mask, value, timeout, abort_mask=0):
+        """Wait until masked statusword has a given value
+
+        Statusword events are used if enabled, otherwise statusword is polled.
+
+        Returns:
+            int: statusword, which may have abort bits set, or None if timeout expired.
+        """
+        if self._status_cob_id is not None:
+            future = self.statusword_future(mask, value, abort_mask)
+            try:
+                return future.result(timeout)
+            except TimeoutError:
+                self._remove_waiter(future)
+                return None
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            statusword, ok = self.read_statusword()
+            if ok and (statusword & mask == value or statusword & abort_mask):
+                return statusword
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(self.statuswordPeriod)
+
+    def _watch_move(self, future, timeout, previous=False):
+        """Resolve the future of a movement when target is reached
+
+        Statusword bit 10 (target reached) finishes the movement and bit 13
+        (following error) aborts it. If previous is set, bit 10 must be
+        cleared first, as it still belongs to the previous movement.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        statusword = 0
+        if previous:
+            statusword = self._wait_statusword(1 << 10, 0, timeout, abort_mask=1 << 13)
+        if statusword is not None and not statusword & (1 << 13):
+            remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            statusword = self._wait_statusword(1 << 10, 1 << 10, remaining,
+                                               abort_mask=1 << 13)
+        if statusword is None:
+            self.log_info('Target not reached within timeout')
+            future.set_result(False)
+            return
+        if statusword & (1 << 13):
+            self.log_info('Following error during movement')
+            future.set_result(False)
+            return
+        future.set_result(True)
+
+    # --------------------------------------------------------------------------
+    # Homing Mode
+    # --------------------------------------------------------------------------
+
+    def set_homing_parameters(self, method=None, switch_speed=None, zero_speed=None,
+                              acceleration=None, current_threshold=None, home_position=None):
+        """Set parameters of Homing Mode
+
+        Only parameters different from the ones last written by this object
+        are sent.
+
+        Args:
+            method (optional): homing method, see firmware specification.
+            switch_speed (optional): speed for switch search [rpm].
+            zero_speed (optional): speed for zero search [rpm].
+            acceleration (optional): homing acceleration [rpm/s].
+            current_threshold (optional): current threshold for homing on block [mA].
+            home_position (optional): position assigned to home [qc].
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        values = [('Homing Method', 0, method, 1, True),
+                  ('Homing Speeds', 1, switch_speed, 4, False),
+                  ('Homing Speeds', 2, zero_speed, 4, False),
+                  ('Homing Acceleration', 0, acceleration, 4, False),
+                  ('Current Threshold for Homing Mode', 0, current_threshold, 2, False),
+                  ('Home Position', 0, home_position, 4, True)]
+        for name, subindex, value, size, signed in values:
+            key = (name, subindex)
+            if value is None or self._homing_parameters.get(key) == value:
+                continue
+            index = self.objectIndex[name]
+            if not self.write_object(index, subindex,
+                                     int(value).to_bytes(size, 'little', signed=signed)):
+                self.log_info('Failed to set {0}'.format(name))
+                self._homing_parameters.pop(key, None)
+                return False
+            self._homing_parameters[key] = value
+        return True
+
+    def start_homing(self, timeout=None, progress=None, **parameters):
+        """Start homing without waiting for it to finish
+
+        Parameters are written with :func:`set_homing_parameters`, operation
+        mode is changed to Homing Mode and homing is started with bit 4 of
+        controlword. Device must be in operation enabled state. Attained and
+        error bits left set by a previous homing are ignored until they clear.
+
+        The optional progress function is called as ``progress(event, statusword)``
+        with the events 'started', 'status' (every statusword event, see
+        :func:`enable_statusword_events`), 'attained', 'error' and 'timeout'.
+        Except for 'started', it is called from the thread receiving CAN
+        messages, so it must not block nor make SDO requests.
+
+        Args:
+            timeout (optional): maximum duration of homing [s], None to wait forever.
+            progress (optional): function called with progress events.
+            parameters: homing parameters, see :func:`set_homing_parameters`.
+        Returns:
+            concurrent.futures.Future: future with result True when homing is
+            attained or False on homing error, timeout or failure to start.
+        """
+        future = Future()
+        if not self.set_homing_parameters(**parameters):
+            future.set_result(False)
+            return future
+        if self._op_mode != 6 and not self.set_op_mode(6):
+            self.log_info('Failed to change to Homing Mode')
+            future.set_result(False)
+            return future
+        # bit 4 must have a rising edge to start homing
+        if not self.write_controlword(0x000F):
+            future.set_result(False)
+            return future
+        # homing attained or error of a previous homing may still be set,
+        # so wait for them to clear first
+        if self._status_cob_id is None:
+            statusword, ok = self.read_statusword()
+            previous = ok and bool(statusword & (1 << 13 | 1 << 12))
+        else:
+            previous = bool(self.statusword and self.statusword & (1 << 13 | 1 << 12))
+        # waiter currently pending, to be removed on timeout
+        waiting = [None]
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, lambda: self._remove_waiter(waiting[0]))
+            timer.daemon = True
+
+        def status(statusword):
+            progress('status', statusword)
+        if progress is not None:
+            self.add_statusword_callback(status)
+
+        def finish(done):
+            if timer is not None:
+                timer.cancel()
+            if progress is not None:
+                self.remove_statusword_callback(status)
+            if future.done():
+                return
+            if done.cancelled():
+                if progress is not None:
+                    progress('timeout', self.statusword)
+                self.log_info('Homing not attained within timeout')
+                future.set_result(False)
+            elif done.result() & (1 << 13):
+                if progress is not None:
+                    progress('error', done.result())
+                self.log_info('Homing error')
+                future.set_result(False)
+            else:
+                if progress is not None:
+                    progress('attained', done.result())
+                future.set_result(True)
+
+        def wait_attained(cleared=None):
+            if cleared is not None and cleared.cancelled():
+                finish(cleared)
+                return
+            # homing attained and target reached, or homing error
+            attained = self.statusword_future(1 << 12 | 1 << 10, 1 << 12 | 1 << 10,
+                                              abort_mask=1 << 13, check_current=False)
+            waiting[0] = attained
+            attained.add_done_callback(finish)
+
+        # waiters are created before starting, not to miss a fast homing
+        if previous:
+            cleared = self.statusword_future(1 << 13 | 1 << 12, 0, check_current=False)
+            waiting[0] = cleared
+            cleared.add_done_callback(wait_attained)
+        else:
+            wait_attained()
+        if not self.write_controlword(0x001F):
+            future.set_result(False)
+            self._remove_waiter(waiting[0])
+            return future
+        if progress is not None:
+            progress('started', self.statusword)
+        if timer is not None:
+            timer.start()
+        return future
+
+    # --------------------------------------------------------------------------
+    # Statusword events
+    # --------------------------------------------------------------------------
+
+    def enable_statusword_events(self, pdo_number=1):
+        """Receive statusword changes by an event triggered TPDO
+
+        The statusword is mapped to a TPDO sent by the device whenever it
+        changes. Each one received updates :attr:`statusword` and resolves
+        the futures created by :func:`statusword_future`, so waits finish
+        as soon as the frame arrives, without any polling. The device is
+        left in operational NMT state.
+
+        Args:
+            pdo_number (optional): number of TPDO to be used. Default 1.
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        self.disable_statusword_events()
+        if not self.change_nmt_state('PRE-OPERATIONAL'):
+            return False
+        if not self.configure_tpdo(pdo_number, [(self.objectIndex['StatusWord'], 0, 16)]):
+            self.log_info('Failed to configure statusword TPDO')
+            return False
+        statusword, ok = self.read_statusword()
+        if not ok:
+            return False
+        self.statusword = statusword
+        self._status_cob_id = self.tpdo_cob_id(pdo_number)
+        self.network.subscribe(self._status_cob_id, self._on_statusword)
+        return self.change_nmt_state('OPERATIONAL')
+
+    def disable_statusword_events(self):
+        """Stop using statusword events, going back to polling
+        """
+        if self._status_cob_id is None:
+            return
+        self.network.unsubscribe(self._status_cob_id, self._on_statusword)
+        self._status_cob_id = None
+
+    def _on_statusword(self, can_id, data, timestamp):
+        """Handle a statusword TPDO, resolving the matching futures
+        """
+        statusword = int.from_bytes(data[:2], 'little')
+        for callback in self._status_callbacks:
+            callback(statusword)
+        with self._status_lock:
+            self.statusword = statusword
+            done = [waiter for waiter in self._status_waiters
+                    if statusword & waiter[0] == waiter[1] or statusword & waiter[2]]
+            if not done:
+                return
+            self._status_waiters = [waiter for waiter in self._status_waiters
+                                    if waiter not in done]
+        for waiter in done:
+            waiter[3].set_result(statusword)
+
+    def add_statusword_callback(self, callback):
+        """Call a function on each statusword event
+
+        The function is called from the thread receiving CAN messages, so
+        it must not block nor make SDO requests.
+
+        Args:
+            callback: function receiving the statusword as argument.
+        """
+        self._status_callbacks.append(callback)
+
+    def remove_statusword_callback(self, callback):
+        """Stop calling a function added with :func:`add_statusword_callback`
+
+        Args:
+            callback: function to be removed.
+        """
+        if callback in self._status_callbacks:
+            self._status_callbacks.remove(callback)
+
+    def _remove_waiter(self, future):
+        """Cancel a future not resolved yet
+
+        Returns:
+            bool: True if the future was still waiting.
+        """
+        with self._status_lock:
+            for waiter in self._status_waiters:
+                if waiter[3] is future:
+                    self._status_waiters.remove(waiter)
+                    break
+            return future.cancel()
+
+    def _poll_statusword(self, future, mask, value, abort_mask):
+        """Resolve a statusword future by polling, until it is cancelled
+        """
+        while not future.cancelled():
+            statusword, ok = self.read_statusword()
+            if ok and (statusword & mask == value or statusword & abort_mask):
+                with self._status_lock:
+                    if not future.cancelled():
+                        future.set_result(statusword)
+                return
+            time.sleep(self.statuswordPeriod)
+
+    def statusword_future(self, mask, value, abort_mask=0, check_current=True):
+        """Future resolved when masked statusword has a given value
+
+        With statusword events enabled the future is resolved by the
+        reception of the TPDO, otherwise statusword is polled in a thread.
+
+        Args:
+            mask: bits of statusword to be compared.
+            value: expected value of masked bits.
+            abort_mask (optional): bits that also resolve the future if set.
+            check_current (optional): resolve immediately if last statusword
+                already matches. Default True. Only used with statusword
+                events, polling always compares the statusword read.
+        Returns:
+            concurrent.futures.Future: future with the statusword that resolved it.
+        """
+        future = Future()
+        if self._status_cob_id is None:
+            threading.Thread(name='EPOS statusword', target=self._poll_statusword,
+                             args=(future, mask, value, abort_mask), daemon=True).start()
+            return future
+        with self._status_lock:
+            statusword = self.statusword
+            if check_current and statusword is not None and \
+                    (statusword & mask == value or statusword & abort_mask):
+                future.set_result(statusword)
+            else:
+                self._status_waiters.append((mask, value, abort_mask, future))
+        return future
+
+    def setpoint_ack_future(self):
+        """Future resolved on the next set-point acknowledge
+
+        Should be created before setting the new set-point bit of
+        controlword. See :func:`statusword_future`.
+
+        Returns:
+            concurrent.futures.Future: future with the statusword that resolved it.
+        """
+        return self.statusword_future(1 << 12, 1 << 12, check_current=False)
+
+    def wait_target_reached(self, timeout=None):
+        """Wait until target reached bit of statusword is set
+
+        Args:
+            timeout (optional): maximum time to wait [s], None to wait forever.
+        Returns:
+            bool: True if target was reached, False on following error or timeout.
+        """
+        statusword = self._wait_statusword(1 << 10, 1 << 10, timeout, abort_mask=1 << 13)
+        if statusword is None:
+            self.log_info('Target not reached within timeout')
+            return False
+        if statusword & (1 << 13):
+            self.log_info('Following error detected')
+            return False
+        return True
+
+    # --------------------------------------------------------------------------
+    # PDO configuration
+    # --------------------------------------------------------------------------
+
+    def tpdo_cob_id(self, pdo_number):
+        """Default COB-ID of a transmit PDO
+
+        Args:
+            pdo_number: number of PDO, from 1 to 4.
+        Returns:
+            int: COB-ID used by device to send the PDO.
+        """
+        return 0x180 + 0x100 * (pdo_number - 1) + self.node.id
+
+    def rpdo_cob_id(self, pdo_number):
+        """Default COB-ID of a receive PDO
+
+        Args:
+            pdo_number: number of PDO, from 1 to 4.
+        Returns:
+            int: COB-ID used by device to receive the PDO.
+        """
+        return 0x200 + 0x100 * (pdo_number - 1) + self.node.id
+
+    def _configure_pdo(self, parameter_index, mapping_index, cob_id, objects,
+                       transmission_type, inhibit_time=None, event_timer=None):
+        """Configure a PDO through SDO
+
+        The PDO is disabled, mapped and enabled again, following CiA 301.
+        Device should be in pre-operational state.
+
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        if len(objects) > 8 or sum(bits for _, _, bits in objects) > 64:
+            self.log_info('Objects exceed PDO length')
+            return False
+        # disable PDO while changing it
+        if not self.write_object(parameter_index, 1, (cob_id | 0x80000000).to_bytes(4, 'little')):
+            return False
+        if not self.write_object(parameter_index, 2, transmission_type.to_bytes(1, 'little')):
+            return False
+        if inhibit_time is not None:
+            if not self.write_object(parameter_index, 3, inhibit_time.to_bytes(2, 'little')):
+                return False
+        if event_timer is not None:
+            if not self.write_object(parameter_index, 5, event_timer.to_bytes(2, 'little')):
+                return False
+        if not self.write_object(mapping_index, 0, bytes([0])):
+            return False
+        for subindex, (index, obj_subindex, bits) in enumerate(objects, start=1):
+            entry = (index << 16) | (obj_subindex << 8) | bits
+            if not self.write_object(mapping_index, subindex, entry.to_bytes(4, 'little')):
+                return False
+        if not self.write_object(mapping_index, 0, bytes([len(objects)])):
+            return False
+        if objects:
+            return self.write_object(parameter_index, 1, cob_id.to_bytes(4, 'little'))
+        return True
+
+    def configure_tpdo(self, pdo_number, objects, transmission_type=255, inhibit_time=0,
+                       event_timer=None):
+        """Configure a transmit PDO
+
+        Map the objects to be sent by device. Transmission types 1 to 240
+        send the PDO after that number of SYNC messages and 255 sends it
+        asynchronously, whenever a mapped value changes, limited by the
+        inhibit time. An empty list of objects leaves the PDO disabled.
+
+        Args:
+            pdo_number: number of PDO, from 1 to 4.
+            objects: list of tuples (index, subindex, bit length) to be mapped.
+            transmission_type (optional): transmission type. Default 255.
+            inhibit_time (optional): minimum time between PDOs [100us].
+            event_timer (optional): period to send PDO even without changes [ms], if supported.
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        if pdo_number < 1 or pdo_number > 4:
+            self.log_info('Invalid TPDO number: {0}'.format(pdo_number))
+            return False
+        parameter_index = self.objectIndex['Transmit PDO {0} Parameter'.format(pdo_number)]
+        mapping_index = self.objectIndex['Transmit PDO {0} Mapping'.format(pdo_number)]
+        return self._configure_pdo(parameter_index, mapping_index,
+                                   self.tpdo_cob_id(pdo_number), objects,
+                                   transmission_type, inhibit_time, event_timer)
+
+    def configure_rpdo(self, pdo_number, objects, transmission_type=255):
+        """Configure a receive PDO
+
+        Map the objects written by the host. With transmission type 255 the
+        values are applied as soon as the PDO is received and with types 0
+        to 240 on the next SYNC message. An empty list of objects leaves
+        the PDO disabled.
+
+        Args:
+            pdo_number: number of PDO, from 1 to 4.
+            objects: list of tuples (index, subindex, bit length) to be mapped.
+            transmission_type (optional): transmission type. Default 255.
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        if pdo_number < 1 or pdo_number > 4:
+            self.log_info('Invalid RPDO number: {0}'.format(pdo_number))
+            return False
+        parameter_index = self.objectIndex['Receive PDO {0} Parameter'.format(pdo_number)]
+        mapping_index = self.objectIndex['Receive PDO {0} Mapping'.format(pdo_number)]
+        return self._configure_pdo(parameter_index, mapping_index,
+                                   self.rpdo_cob_id(pdo_number), objects, transmission_type)
+
+    def change_nmt_state(self, new_state):
+        """Change NMT state of device
+
+        Args:
+            new_state: one of 'OPERATIONAL', 'PRE-OPERATIONAL', 'STOPPED',
+                'RESET' or 'RESET COMMUNICATION'.
+        Returns:
+            bool: A boolean if all went ok.
+        """
+        if new_state in ('RESET', 'RESET COMMUNICATION'):
+            self.clear_cache()
+        try:
+            self.node.nmt.state = new_state
+        except Exception as e:
+            self.log_info('Exception caught:{0}'.format(str(e)))
+            return False
+        return True
+
+    def read_nmt_state(self, timeout=None):
+        """Read NMT state reported by the heartbeat of device
+
+        The state kept by canopen only follows the commands sent by this
+        host, so the next heartbeat of device is waited for instead.
+
+        Args:
+            timeout (optional): time to wait for heartbeat [s]. Default
+                twice the producer heartbeat time of device.
+        Returns:
+            tuple: A tuple containing:
+
+            :state: NMT state, like 'OPERATIONAL', or None if no heartbeat was received.
+            :ok: A boolean if all went as expected or not.
+        """
+        if timeout is None:
+            period, ok = self.read_producer_heartbeat()
+            if not ok:
+                return None, False
+            if period == 0:
+                self.log_info('Device does not send heartbeats')
+                return None, False
+            timeout = 2e-3 * period
+        try:
+            state = self.node.nmt.wait_for_heartbeat(timeout)
+        except Exception as e:
+            self.log_info('Exception caught:{0}'.format(str(e)))
+            return None, False
+        return state, True
+
+    # --------------------------------------------------------------------------
+    # Error control
+    # --------------------------------------------------------------------------
+
+    def set_producer_heartbeat(self, period):
+        """Set period of heartbeats sent by device
+
+        Args:
+            period: time between heartbeats [ms], 0 to disable.
+        Returns:
+            bool: A boolean if all went as expected or not.
+        """
+        if period < 0 or period > 2 ** 16 - 1:
+            self.log_info("Producer heartbeat time out of range")
+            return False
+        index = self.objectIndex['Producer Heartbeat Time']
+        return self.write_object(index, 0, period.to_bytes(2, 'little'))
+
+    def read_producer_heartbeat(self):
+        """Read period of heartbeats sent by device
+
+        Returns:
+            tuple: A tuple containing:
+
+            :period: time between heartbeats [ms] or None if request fails.
+            :ok: A boolean if all went as expected or not.
+        """
+        index = self.objectIndex['Producer Heartbeat Time']
+        period = self.read_object(index, 0)
+        if period is None:
+            self.log_info("Failed to read producer heartbeat time")
+            return None, False
+        return int.from_bytes(period, 'little'), True
+
+    def set_consumer_heartbeat(self, node_id, period, subindex=1):
+        """Monitor heartbeats of another node
+
+        The device signals a heartbeat error and goes to fault state if no
+        heartbeat of node_id is received within period.
+
+        Args:
+            node_id: node ID of the monitored node, from 1 to 127.
+            period: maximum time between heartbeats [ms], 0 to disable.
+            subindex (optional): entry of consumer heartbeat time used. Default 1.
+        Returns:
+            bool: A boolean if all went as expected or not.
+        """
+        if node_id < 1 or node_id > 127:
+            self.log_info("Invalid node ID for consumer heartbeat: {0}".format(node_id))
+            return False
+        if period < 0 or period > 2 ** 16 - 1:
+            self.log_info("Consumer heartbeat time out of range")
+            return False
+        index = self.objectIndex['Consumer Heartbeat Time']
+        value = (node_id << 16) | period
+        return self.write_object(index, subindex, value.to_bytes(4, 'little'))
+
+    def read_consumer_heartbeat(self, subindex=1):
+        """Read monitoring of heartbeats of another node
+
+        Args:
+            subindex (optional): entry of consumer heartbeat time. Default 1.
+        Returns:
+            tuple: A tuple containing:
+
+            :consumer: a tuple (node_id, period [ms]) or None if request fails.
+            :ok: A boolean if all went as expected or not.
+        """
+        index = self.objectIndex['Consumer Heartbeat Time']
+        value = self.read_object(index, subindex)
+        if value is None:
+            self.log_info("Failed to read consumer heartbeat time")
+            return None, False
+        value = int.from_bytes(value, 'little')
+        return ((value >> 16) & 0x7F, value & 0xFFFF), True
+
+    def set_node_guarding(self, guard_time, life_time_factor):
+        """Set node guarding parameters
+
+        The node life time is the guard time multiplied by the life time
+        factor. Heartbeat and node guarding should not be used together,
+        null values disable node guarding.
+
+        Args:
+            guard_time: time between guarding requests of master [ms].
+            life_time_factor: number of guard times without request before error.
+        Returns:
+            bool: A boolean if all went as expected or not.
+        """
+        if guard_time < 0 or guard_time > 2 ** 16 - 1:
+            self.log_info("Guard time out of range")
+            return False
+        if life_time_factor < 0 or life_time_factor > 255:
+            self.log_info("Life time factor out of range")
+            return False
+        if not self.write_object(self.objectIndex['Guard Time'], 0,
+                                 guard_time.to_bytes(2, 'little')):
+            self.log_info("Failed to set guard time")
+            return False
+        if not self.write_object(self.objectIndex['Life Time Factor'], 0,
+                                 life_time_factor.to_bytes(1, 'little')):
+            self.log_info("Failed to set life time factor")
+            return False
+        return True
+
+    # --------------------------------------------------------------------------
+    # Synchronisation
+    # --------------------------------------------------------------------------
+
+    def set_sync_cob_id(self, cob_id=0x80):
+        """Set COB-ID of SYNC messages consumed by device
+
+        Synchronous PDOs are sent or applied on the SYNC messages with this
+        COB-ID. The device only consumes SYNC, it cannot produce it.
+
+        Args:
+            cob_id (optional): 11 bit COB-ID of SYNC messages. Default 0x80.
+        Returns:
+            bool: A boolean if all went as expected or not.
+        """
+        if cob_id < 1 or cob_id > 0x7FF:
+            self.log_info("Invalid SYNC COB-ID: {0:#x}".format(cob_id))
+            return False
+        index = self.objectIndex['COB-ID SYNC Message']
+        return self.write_object(index, 0, cob_id.to_bytes(4, 'little'))
+
+    def read_sync_cob_id(self):
+        """Read COB-ID of SYNC messages consumed by device
+
+        Returns:
+            tuple: A tuple containing:
+
+            :cob_id: COB-ID of SYNC messages or None if request fails.
+            :ok: A boolean if all went as expected or not.
+        """
+        index = self.objectIndex['COB-ID SYNC Message']
+        cob_id = self.read_object(index, 0)
+        if cob_id is None:
+            self.log_info("Failed to read SYNC COB-ID")
+            return None, False
+        return int.from_bytes(cob_id, 'little') & 0x7FF, True
+
     def save_config(self):
         """Save all configurations
         """
@@ -2024,6 +2849,24 @@ class Epos:
         return
 
 
+def home_axes(axes, timeout=None, **parameters):
+    """Home several devices at the same time
+
+    Homing is started on every device concurrently and the devices home in
+    parallel, since each one only waits for its own statusword.
+
+    Args:
+        axes: list of :class:`Epos` devices.
+        timeout (optional): maximum duration of homing [s].
+        parameters: homing parameters, see :func:`Epos.set_homing_parameters`.
+    Returns:
+        list: a concurrent.futures.Future for each device, see :func:`Epos.start_homing`.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(axes), 1)) as executor:
+        starts = [executor.submit(axis.start_homing, timeout, **parameters) for axis in axes]
+        return [start.result() for start in starts]
+
+
 def main():
     """Test EPOS CANopen communication with some examples.
 
@@ -2047,7 +2890,7 @@ def main():
     parser.add_argument('--rate', '-r', action='store', default=None,
                         type=int, help='bitrate, if applicable', dest='bitrate')
     parser.add_argument('--nodeID', action='store', default=1, type=int,
-                        help='Node ID [ must be between 1- 127]', dest='nodeID')
+                        help='Node ID [ must be between 1- 127], see discovery.py to find it', dest='nodeID')
     parser.add_argument('--objDict', action='store', default=None,
                         type=str, help='Object dictionary file', dest='objDict')
     args = parser.parse_args()
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+
+
+class PositionEstimator:
+    """Base of estimators of motion from timestamped position samples
+
+    Estimators keep position, velocity and acceleration as a constant
+    acceleration model, corrected by each sample with :func:`update`. The
+    state is a fixed set of floats updated in place, so samples can be fed
+    from the CAN notifier thread with no allocation and read concurrently
+    from a control loop with :func:`state_at`.
+
+    Samples are delayed by the transmission from the device. The latency
+    is subtracted from the time of each sample and :func:`state_at`
+    extrapolates the model up to the time asked, so the estimate refers to
+    the present and not to the time the sample was taken.
+
+    Times may use any clock, as long as samples and requests use the same.
+    Timestamps of CAN messages, as given by :func:`attach`, use ``time.time()``.
+
+    Args:
+        latency (optional): delay between sampling and reception [s]. Default 0.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.t = None
+        self.position = 0.0
+        self.velocity = 0.0
+        self.acceleration = 0.0
+        self._epos = None
+        self._cob_id = None
+
+    def reset(self):
+        """Forget the state, the next sample starts a new estimate
+        """
+        with self._lock:
+            self.samples = 0
+            self.t = None
+            self.position = 0.0
+            self.velocity = 0.0
+            self.acceleration = 0.0
+            self._reset()
+
+    def _reset(self):
+        pass
+
+    def update(self, position, t):
+        """Correct the estimate with a new sample
+
+        Samples older than the last one are ignored.
+
+        Args:
+            position: measured position [qc].
+            t: time the sample was received [s].
+        """
+        t = t - self.latency
+        with self._lock:
+            if self.t is None:
+                self.t = t
+                self.position = float(position)
+                self.samples = 1
+                return
+            dt = t - self.t
+            if dt <= 0:
+                return
+            # prediction by the constant acceleration model
+            half = 0.5 * dt * dt
+            self.position += self.velocity * dt + self.acceleration * half
+            self.velocity += self.acceleration * dt
+            self._correct(position - self.position, dt)
+            self.t = t
+            self.samples += 1
+
+    def _correct(self, residual, dt):
+        raise NotImplementedError
+
+    def state_at(self, t):
+        """Estimate for a single instant
+
+        Args:
+            t: current time [s], same clock as samples.
+        Returns:
+            tuple: A tuple containing:
+
+            :position: estimated position [qc] or None if no sample received.
+            :velocity: estimated velocity [qc/s].
+            :acceleration: estimated acceleration [qc/s^2].
+        """
+        with self._lock:
+            if self.t is None:
+                return None, 0.0, 0.0
+            tau = t - self.t
+            return (self.position + self.velocity * tau + 0.5 * self.acceleration * tau * tau,
+                    self.velocity + self.acceleration * tau,
+                    self.acceleration)
+
+    def _on_position(self, can_id, data, timestamp):
+        self.update(int.from_bytes(data[:4], 'little', signed=True), timestamp)
+
+    def attach(self, epos, pdo_number=3, inhibit_time=10):
+        """Feed the estimator with positions streamed by a TPDO
+
+        The TPDO is mapped with 'Position Actual Value' (0x6064). Device is
+        left in operational NMT state.
+
+        Args:
+            epos: a connected :class:`epos.Epos`.
+            pdo_number (optional): number of TPDO used. Default 3.
+            inhibit_time (optional): minimum time between TPDOs [100us]. Default 10.
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        if not epos.change_nmt_state('PRE-OPERATIONAL'):
+            return False
+        if not epos.configure_tpdo(pdo_number, [(epos.objectIndex['Position Actual Value'], 0, 32)],
+                                   inhibit_time=inhibit_time):
+            epos.log_info('Failed to configure position TPDO')
+            return False
+        self.detach()
+        self._epos = epos
+        self._cob_id = epos.tpdo_cob_id(pdo_number)
+        epos.network.subscribe(self._cob_id, self._on_position)
+        return epos.change_nmt_state('OPERATIONAL')
+
+    def detach(self):
+        """Stop receiving positions from TPDO
+        """
+        if self._epos is None:
+            return
+        self._epos.network.unsubscribe(self._cob_id, self._on_position)
+        self._epos = None
+        self._cob_id = None
+
+
+class AlphaBetaFilter(PositionEstimator):
+    """Fixed gain alpha-beta(-gamma) estimator
+
+    Each residual between sample and prediction corrects position by
+    ``alpha``, velocity by ``beta / dt`` and acceleration by
+    ``2 gamma / dt^2``. With ``gamma`` null the acceleration stays null and
+    it becomes the classic alpha-beta filter. Larger gains follow faster
+    and filter less noise.
+
+    Args:
+        alpha (optional): position gain, between 0 and 1. Default 0.5.
+        beta (optional): velocity gain, between 0 and 2. Default 0.1.
+        gamma (optional): acceleration gain. Default 0.
+        latency (optional): delay between sampling and reception [s]. Default 0.
+    """
+
+    def __init__(self, alpha=0.5, beta=0.1, gamma=0.0, latency=0.0):
+        PositionEstimator.__init__(self, latency=latency)
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+
+    def _correct(self, residual, dt):
+        self.position += self.alpha * residual
+        self.velocity += self.beta * residual / dt
+        self.acceleration += 2.0 * self.gamma * residual / (dt * dt)
+
+
+class KalmanFilter(PositionEstimator):
+    """Constant acceleration Kalman filter
+
+    The model is driven by white jerk noise with spectral density ``q`` and
+    positions are measured with variance ``r``. Gains adapt to the time
+    between samples, so irregular TPDO timing and SDO polling are handled
+    alike. The symmetric 3x3 covariance is kept as six floats.
+
+    Args:
+        q (optional): spectral density of jerk [qc^2/s^5]. Default 1e9.
+        r (optional): variance of position measurements [qc^2]. Default 1.
+        latency (optional): delay between sampling and reception [s]. Default 0.
+    """
+
+    def __init__(self, q=1e9, r=1.0, latency=0.0):
+        PositionEstimator.__init__(self, latency=latency)
+        self.q = q
+        self.r = r
+        self._reset()
+
+    def _reset(self):
+        # initial uncertainty of velocity and acceleration is large
+        self._p00 = self.r
+        self._p01 = 0.0
+        self._p02 = 0.0
+        self._p11 = 1e8
+        self._p12 = 0.0
+        self._p22 = 1e10
+
+    def _correct(self, residual, dt):
+        p00, p01, p02 = self._p00, self._p01, self._p02
+        p11, p12, p22 = self._p11, self._p12, self._p22
+        half = 0.5 * dt * dt
+        # F P, rows of position and velocity, acceleration row is unchanged
+        a00 = p00 + dt * p01 + half * p02
+        a01 = p01 + dt * p11 + half * p12
+        a02 = p02 + dt * p12 + half * p22
+        a11 = p11 + dt * p12
+        a12 = p12 + dt * p22
+        # F P F^T plus process noise of white jerk
+        q = self.q
+        dt2 = dt * dt
+        dt3 = dt2 * dt
+        p00 = a00 + dt * a01 + half * a02 + q * dt3 * dt2 / 20.0
+        p01 = a01 + dt * a02 + q * dt2 * dt2 / 8.0
+        p02 = a02 + q * dt3 / 6.0
+        p11 = a11 + dt * a12 + q * dt3 / 3.0
+        p12 = a12 + q * dt2 / 2.0
+        p22 = p22 + q * dt
+        # correction with position measurement
+        s = p00 + self.r
+        k0 = p00 / s
+        k1 = p01 / s
+        k2 = p02 / s
+        self.position += k0 * residual
+        self.velocity += k1 * residual
+        self.acceleration += k2 * residual
+        self._p00 = p00 - k0 * p00
+        self._p01 = p01 - k0 * p01
+        self._p02 = p02 - k0 * p02
+        self._p11 = p11 - k1 * p01
+        self._p12 = p12 - k1 * p02
+        self._p22 = p22 - k2 * p02
@@ -2,7 +2,6 @@ import argparse
 import logging
 import sys
 import time
-import numpy as np
 import matplotlib
 import canopen
 
@@ -11,84 +10,12 @@ if (sys.version_info.major == 3):
 # disable toolbar
 matplotlib.rcParams['toolbar'] = 'None'
 
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-
 # load epos file from base dir
 sys.path.append('../../')
 from epos import Epos
-import csv
-
-figClosed = False
-# nSteps represent the number of points to skip before updating figure
-nSteps = 10
-# colors similar to matlab
-blueColor = (0, 0.4470, 0.7410)
-redColor = (0.8500, 0.3250, 0.0980)
-yellowColor = (0.9290, 0.6940, 0.1250)
-
-
-class Plotter():
-    def __init__(self):
-        # create new figure or use last
-        self.fig = plt.figure(1)
-        self.fig.clf()
-        # create axis
-        self.posAx = self.fig.add_subplot(2, 1, 1)
-        self.errorAx = self.fig.add_subplot(2, 1, 2)
-        # create vectors
-        self.tRef = [0]
-        self.tdata = [0]
-        self.yRef = [0]
-        self.out = [0]
-        self.diff = [0]
-        # create lines to for reference and output values
-        self.lineRef = Line2D(self.tRef, self.yRef, color=blueColor)
-        self.lineOut = Line2D(self.tdata, self.out, color=redColor,
-                              linestyle='None', marker='o', markersize=1)
-        self.lineDiff = Line2D(self.tdata, self.diff, color=yellowColor)
-        self.posAx.add_line(self.lineRef)
-        self.posAx.add_line(self.lineOut)
-        self.posAx.legend(['Ref', 'Out'], loc='upper right')
-        self.posAx.set_ylabel('Position [qc]')
-        self.errorAx.add_line(self.lineDiff)
-        self.errorAx.set_ylabel('Position [qc]')
-        self.errorAx.set_xlabel('Time [s]')
-        self.errorAx.legend(['error'], loc='upper right')
-
-    def begin(self, tRef, yRef):
-        self.tRef = tRef
-        self.yRef = yRef
-        self.lineRef.set_xdata(np.array(tRef))
-        self.lineRef.set_ydata(np.array(yRef))
-        self.posAx.set_xlim(tRef[0], tRef[-1])
-        self.errorAx.set_xlim(tRef[0], tRef[-1])
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
-
-    def update(self, tOut, yOut, ref_error, draw=False):
-        self.lineOut.set_xdata(tOut)
-        self.lineOut.set_ydata(yOut)
-        self.lineDiff.set_xdata(tOut)
-        self.lineDiff.set_ydata(ref_error)
-        # require autoscale?
-        if tOut[-1] > self.tRef[-1]:
-            self.posAx.set_xlim(self.tRef[0], tOut[-1])
-            self.errorAx.set_xlim(self.tRef[0], tOut[-1])
-        self.posAx.set_ylim(min([min(self.yRef), min(yOut)]), max(
-            [max(self.yRef), max(yOut)]))
-        self.errorAx.set_ylim(min(ref_error), max(ref_error))
-        if draw:
-            self.fig.canvas.draw()
-            plt.tight_layout()
-        self.fig.canvas.flush_events()
-
-
-def handle_close(evt):
-    global figClosed
-    print('Closed figure!')
-    figClosed = True
-    return
+from live_plot import LivePlotter
+from telemetry import TelemetryRecorder
+from trajectory_csv import load_csv, iter_csv, TrajectoryPlayer
 
 
 def gotMessage(EmcyError):
@@ -115,6 +42,11 @@ def main():
                         type=str, help='Object dictionary file', dest='objDict')
     parser.add_argument('--file', '-f', action='store', default='table1.csv',
                         type=str, help='csv file name to be used', dest='file')
+    parser.add_argument('--record', action='store', default=None,
+                        type=str, help='file to record telemetry', dest='record')
+    parser.add_argument('--reference', action='store_true', default=False,
+                        help='plot whole trajectory, parsing file before starting',
+                        dest='reference')
     args = parser.parse_args()
     # set up logging to file - see previous section for more details
     logging.basicConfig(level=logging.INFO,
@@ -172,91 +104,70 @@ def main():
         logging.info('Failed to change Epos state to enable operation')
         return
 
-    # load datafile
     fileName = args.file
-    with open(fileName) as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=',')
-        data = {}
-        for row in reader:
-            for header, value in row.items():
-                try:
-                    data[header].append(int(value))
-                except KeyError:
-                    data[header] = [value]
-                except ValueError:
-                    data[header].append(float(value))
-
-    plotter = Plotter()
-    time.sleep(0.01)
-    plotter.fig.canvas.mpl_connect('close_event', handle_close)
-    plt.show(block=False)
-    time.sleep(0.01)
+    reference = None
+    if args.reference:
+        # whole file is parsed before starting, and cached as a binary sidecar
+        data = load_csv(fileName)
+        reference = (data['time'], data['position'])
+
+    # plot setpoints and position, drawing is made by a separate process
+    plotter = LivePlotter(reference=reference)
+
+    recorder = None
+    if args.record:
+        recorder = TelemetryRecorder(args.record)
+    # rows of trajectory are streamed to a player, which finds the setpoint
+    # for current time, catching up if the loop falls behind.
+    player = TrajectoryPlayer(iter_csv(fileName))
     try:
-        data['time'][0] = int(data['time'][0])
-    except ValueError:
-        data['time'][0] = float(data['time'][0])
-    data['position'][0] = int(data['position'][0])
-    # plot loaded reference
-    plotter.begin(data['time'], data['position'])
-
-    out = np.array([], dtype='int32')
-    diff = np.array([], dtype='int32')
-    t = np.array([])
-    I = 0
-    maxI = len(data['time'])
-    updateFlag = False
-    # get current time
-    t0 = time.monotonic()
-    while(I < maxI):
+        # get current time
+        t0 = time.monotonic()
+        while not player.finished:
+            tRequest = time.monotonic()-t0
+            pRef, _ = player.setpoint(tRequest)
+            # send setpoint and read feedback in the same cycle
+            if not epos.set_position_mode_setting(pRef):
+                logging.info('({0}) Failed to set target position'.format(
+                    sys._getframe().f_code.co_name))
+            aux, OK = epos.read_position_value()
+            if not OK:
+                logging.info('({0}) Failed to request current position'.format(
+                    sys._getframe().f_code.co_name))
+                return
+            tOut = time.monotonic()-t0
+            player.mark(tOut)
+            if recorder:
+                recorder.record(pRef, aux, t=tOut)
+            plotter.update(tOut, pRef, aux, pRef-aux)
+            # use sleep?
+            time.sleep(0.005)
+
+        print('Time to process all vars was {0} seconds'.format(
+            time.monotonic()-t0))
+        report = player.report()
+        print('Playback: {0} cycles, {1} rows, {2} rows skipped'.format(
+            report['cycles'], report['rows'], report['rows_skipped']))
+        print('Lag: mean {0:.4f} s, p99 {1:.4f} s, max {2:.4f} s, overrun {3:.4f} s'.format(
+            report['mean_lag'], report['p99_lag'], report['max_lag'], report['overrun']))
+        # request one last time
+        aux, OK = epos.read_position_value()
+        if not OK:
+            logging.info('({0}) Failed to request current position'.format(
+                sys._getframe().f_code.co_name))
+            return
         tOut = time.monotonic()-t0
-        # skip to next step?
-        if tOut > data['time'][I]:
-            I += 1
-            updateFlag = True
-        else:
-            # send data only once
-            if (updateFlag):
-                updateFlag = False
-                # get new reference position.
-                epos.set_position_mode_setting(data['position'][I])
-            else:
-                # if not time to update new ref, request current position
-                aux, OK = epos.read_position_value()
-                if not OK:
-                    logging.info('({0}) Failed to request current position'.format(
-                        sys._getframe().f_code.co_name))
-                    return
-                out = np.append(out, aux)
-                diff = np.append(diff, data['position'][I]-out[-1])
-                t = np.append(t, time.monotonic()-t0)
-                # update only every n steps
-                if (I % nSteps == 0) or (I == 0):
-                    plotter.update(t, out, diff, True)
-                else:
-                    plotter.update(t, out, diff)
-                # use sleep?
-                time.sleep(0.005)
-
-    print('Time to process all vars was {0} seconds'.format(
-        time.monotonic()-t0))
-    # request one last time
-    aux, OK = epos.read_position_value()
-    if not OK:
-        logging.info('({0}) Failed to request current position'.format(
-            sys._getframe().f_code.co_name))
-        return
-    out = np.append(out, aux)
-    diff = np.append(diff, data['position'][I-1]-out[-1])
-    t = np.append(t, time.monotonic()-t0)
-    plotter.update(t, out, diff, True)
-    if not epos.change_state('shutdown'):
-        logging.info('Failed to change Epos state to shutdown')
-        return
-    print('Close figure to exit')
-    while(not figClosed):
-        time.sleep(0.01)
-        plotter.fig.canvas.flush_events()
-
+        if recorder:
+            recorder.record(pRef, aux, t=tOut)
+        plotter.update(tOut, pRef, aux, pRef-aux)
+        if not epos.change_state('shutdown'):
+            logging.info('Failed to change Epos state to shutdown')
+            return
+        print('Close figure to exit')
+    finally:
+        if recorder:
+            recorder.close()
+        plotter.stop()
 
 if __name__ == '__main__':
     main()
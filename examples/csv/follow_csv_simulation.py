@@ -13,8 +13,9 @@ from matplotlib.lines import Line2D
 
 # load epos file from base dir
 sys.path.append('../../')
-
-import csv
+from decimation import MinMaxDecimator, lttb
+from telemetry import TelemetryBuffer
+from trajectory_csv import load_csv
 
 fileName = 'table2.csv'
 figClosed = False
@@ -51,14 +52,20 @@ class Plotter():
         self.errorAx.set_ylabel('Position [qc]')
         self.errorAx.set_xlabel('Time [s]')
         self.errorAx.legend(['error'], loc='upper right')
-
+        # bounded number of points drawn and running extrema
+        self.decOut = MinMaxDecimator()
+        self.decDiff = MinMaxDecimator()
+        self.nSeen = 0
 
 
     def begin(self, tRef, yRef):
         self.tRef = tRef
         self.yRef = yRef
-        self.lineRef.set_xdata(np.array(tRef))
-        self.lineRef.set_ydata(np.array(yRef))
+        self.yRefMin = np.min(yRef)
+        self.yRefMax = np.max(yRef)
+        tRef, yRef = lttb(tRef, yRef, self.decOut.max_points)
+        self.lineRef.set_xdata(tRef)
+        self.lineRef.set_ydata(yRef)
         self.posAx.set_xlim(tRef[0], tRef[-1])
         self.errorAx.set_xlim(tRef[0], tRef[-1])
         self.fig.canvas.draw()
@@ -66,16 +73,18 @@ class Plotter():
 
 
     def update (self, tOut, yOut, ref_error, draw= False):
-        self.lineOut.set_xdata(tOut)
-        self.lineOut.set_ydata(yOut)
-        self.lineDiff.set_xdata(tOut)
-        self.lineDiff.set_ydata(ref_error)
+        # only samples not seen before are processed
+        self.decOut.extend(tOut[self.nSeen:], yOut[self.nSeen:])
+        self.decDiff.extend(tOut[self.nSeen:], ref_error[self.nSeen:])
+        self.nSeen = len(tOut)
+        self.lineOut.set_data(*self.decOut.data())
+        self.lineDiff.set_data(*self.decDiff.data())
         # require autoscale?
         if tOut[-1] > self.tRef[-1]:
             self.posAx.set_xlim(self.tRef[0], tOut[-1])
             self.errorAx.set_xlim(self.tRef[0], tOut[-1])
-        self.posAx.set_ylim(min([min(self.yRef), min(yOut)]), max([max(self.yRef), max(yOut)]))
-        self.errorAx.set_ylim(min(ref_error), max(ref_error))
+        self.posAx.set_ylim(min(self.yRefMin, self.decOut.y_min), max(self.yRefMax, self.decOut.y_max))
+        self.errorAx.set_ylim(self.decDiff.y_min, self.decDiff.y_max)
         if draw:
             self.fig.canvas.draw()
             plt.tight_layout()
@@ -87,33 +96,16 @@ def handle_close(evt):
     figClosed = True
     return
 
-with open(fileName) as csvfile:
-    reader = csv.DictReader(csvfile, delimiter=';')
-    data = {}
-    for row in reader:
-        for header, value in row.items():
-            try:
-                data[header].append(int(value))
-            except KeyError:
-                data[header] = [value]
-            except ValueError:
-                data[header].append(float(value))
+data = load_csv(fileName)
 
 plotter = Plotter()
 time.sleep(0.01)
 plotter.fig.canvas.mpl_connect('close_event', handle_close)
 plt.show(block=False)
 time.sleep(0.01)
-try:
-    data['time'][0] = int(data['time'][0])
-except ValueError:
-    data['time'][0] = float(data['time'][0])
-data['position'][0] = int(data['position'][0])
 
 plotter.begin(data['time'], data['position'])
-out = np.array([], dtype='int32')
-diff = np.array([], dtype='int32')
-t = np.array([])
+outData = TelemetryBuffer([('t', 'float64'), ('position', 'int32'), ('error', 'int32')])
 
 
 I = 0
@@ -134,21 +126,20 @@ while( I < maxI):
 
             updateFlag = False
             outi = data['position'][I]
-            out=np.append(out, outi + np.random.randint(-100, 100))
-            diff = np.append(diff,out[-1]-outi)
-            t = np.append(t, data['time'][I])
+            aux = outi + np.random.randint(-100, 100)
+            outData.append(data['time'][I], aux, aux-outi)
             # update only every n steps
             if (I % nSteps == 0) or (I == 0):
-                plotter.update(t, out, diff, True)
+                plotter.update(outData['t'], outData['position'], outData['error'], True)
             else:
-                plotter.update(t, out, diff)
+                plotter.update(outData['t'], outData['position'], outData['error'])
             # simulate variable slow process
             randSleep = 0.01*np.random.randint(0, 20)
             print('Current frame: {0}\t sleeping:{1}'.format(I, randSleep))
             time.sleep(randSleep)
 
 print(time.monotonic()-t0)
-plotter.update(t, out, diff, True)
+plotter.update(outData['t'], outData['position'], outData['error'], True)
 while( not figClosed):
     time.sleep(0.01)
     plotter.fig.canvas.flush_events()
@@ -0,0 +1,99 @@
+import argparse
+import logging
+import math
+import sys
+import numpy as np
+
+# load epos file from base dir
+sys.path.append('../../')
+from epos import Epos
+from pdo_stream import CurrentStream
+from virtual_epos import VirtualEpos
+
+
+def motor_model(device, dt):
+    """Current follows the setting value with the lag of the current loop
+    """
+    setting = device.get_value(0x2030, signed=True)
+    actual = device.get_value(0x6078, signed=True)
+    averaged = device.get_value(0x2027, signed=True)
+    if device.state == 'operation enable' and device.get_value(0x6061, signed=True) == -3:
+        target = setting
+    else:
+        target = 0
+    actual += round((target - actual) * min(dt / 0.001, 1.0))
+    averaged += round((actual - averaged) * min(dt / 0.010, 1.0))
+    device.set_value(0x6078, 0, actual, signed=True)
+    device.set_value(0x2027, 0, averaged, signed=True)
+
+
+def main():
+    if (sys.version_info < (3, 0)):
+        print("Please use python version 3")
+        return
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description='Benchmark current streaming on a simulated EPOS')
+    parser.add_argument('--rate', '-r', action='store', default=1000,
+                        type=float, help='Frequency of commands [Hz]', dest='rate')
+    parser.add_argument('--duration', '-d', action='store', default=5.0,
+                        type=float, help='Duration of benchmark [s]', dest='duration')
+    parser.add_argument('--amplitude', '-a', action='store', default=6000,
+                        type=int, help='Amplitude of current command [mA]', dest='amplitude')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s.%(msecs)03d] [%(name)-20s]: %(levelname)-8s %(message)s',
+                        datefmt='%d-%m-%Y %H:%M:%S',
+                        level=logging.INFO)
+
+    # simulated device with a 2500 mA continuous / 5000 mA peak motor
+    device = VirtualEpos(node_id=1, channel='current_stream', model=motor_model, rate=2000)
+    device.set_value(0x6402, 0, 10, size=2)
+    for subindex, value in enumerate([2500, 5000, 4, 5000, 40], start=1):
+        device.set_value(0x6410, subindex, value, size=2 if subindex != 3 else 1)
+    for index in (0x2030, 0x6078, 0x2027):
+        device.set_value(index, 0, 0, size=2, signed=True)
+    device.start()
+
+    epos = Epos()
+    if not epos.begin(1, _channel='current_stream', _bustype='virtual'):
+        logging.info('Failed to begin connection with EPOS device')
+        device.stop()
+        return
+    stream = CurrentStream(epos)
+    if not stream.start():
+        logging.info('Failed to start current stream')
+        epos.disconnect()
+        device.stop()
+        return
+    for state in ('shutdown', 'switch on', 'enable operation'):
+        epos.change_state(state)
+
+    def command(t):
+        return args.amplitude * math.sin(2 * math.pi * 5 * t)
+
+    stats = stream.run(command, rate=args.rate, duration=args.duration)
+    stream.stop()
+    epos.change_state('shutdown')
+    epos.disconnect()
+    device.stop()
+
+    data = stream.telemetry
+    t = data['t']
+    period = np.diff(t)
+    received = data['Current Actual Value']
+    print('--------------------------------------------------------------')
+    print('Cycles:              {0}'.format(stats['cycles']))
+    print('Achieved rate:       {0:.1f} Hz'.format((len(t) - 1) / (t[-1] - t[0])))
+    print('Period jitter (std): {0:.1f} us'.format(np.std(period) * 1e6))
+    print('Max period:          {0:.1f} us'.format(np.max(period) * 1e6))
+    print('Mean lateness:       {0:.1f} us'.format(stats['mean_late'] * 1e6))
+    print('Max lateness:        {0:.1f} us'.format(stats['max_late'] * 1e6))
+    print('Overruns:            {0}'.format(stats['overruns']))
+    print('Commands limited:    {0}'.format(stream.limiter.limited))
+    print('Max command:         {0:.0f} mA'.format(np.max(np.abs(data['command']))))
+    print('Max actual current:  {0:.0f} mA'.format(np.nanmax(np.abs(received))))
+    print('--------------------------------------------------------------')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+import time
+
+# controlword with quick stop bit cleared and voltage enabled
+QUICK_STOP = 0x0002
+
+
+class FollowingErrorWatchdog:
+    """Quick stop a device as soon as the following error is too large
+
+    'Following Error Actual Value' (0x20F4) is mapped to a transmit PDO and
+    checked in the CAN notifier thread as each PDO arrives. The quick stop
+    is a controlword mapped to a receive PDO and its frame is built
+    beforehand, so a violation is answered with a single
+    ``send_message`` from the callback, with no SDO transfer, within one
+    frame time of the offending PDO.
+
+    Errors above ``near_miss`` times the limit that do not reach it are
+    counted as near misses, one per excursion, together with the largest
+    error seen, to help tuning the limit and the controller.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        max_error: largest following error allowed, in modulus [qc].
+        near_miss (optional): fraction of max_error counted as near miss. Default 0.8.
+        tpdo (optional): number of TPDO used for following error. Default 4.
+        rpdo (optional): number of RPDO used for quick stop. Default 4.
+        inhibit_time (optional): minimum time between TPDOs [100us]. Default 10.
+        on_trip (optional): function on_trip(error) called after the quick stop is sent.
+    """
+
+    def __init__(self, epos, max_error, near_miss=0.8, tpdo=4, rpdo=4, inhibit_time=10,
+                 on_trip=None):
+        self.epos = epos
+        self.max_error = max_error
+        self.near_miss = near_miss
+        self.tpdo = tpdo
+        self.rpdo = rpdo
+        self.inhibit_time = inhibit_time
+        self.on_trip = on_trip
+        self.logger = logging.getLogger('WATCHDOG')
+        self.tripped = threading.Event()
+        self.running = False
+        self._cob_id = None
+        self._quick_stop_cob_id = None
+        self._quick_stop_frame = QUICK_STOP.to_bytes(2, 'little')
+        self._near_miss_error = max_error * near_miss
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        """Clear counters of samples and near misses
+        """
+        self.samples = 0
+        self.near_misses = 0
+        self.peak_error = 0
+        self.last_error = None
+        self.trip_error = None
+        self.trip_time = None
+        self.trip_latency = None
+        self._in_near_miss = False
+
+    def statistics(self):
+        """Statistics of errors received
+
+        Returns:
+            dict: number of samples and near misses, peak and last error and,
+            if tripped, error and time of trip and delay from reception of PDO to
+            quick stop [s].
+        """
+        return {'samples': self.samples,
+                'near_misses': self.near_misses,
+                'peak_error': self.peak_error,
+                'last_error': self.last_error,
+                'trip_error': self.trip_error,
+                'trip_time': self.trip_time,
+                'trip_latency': self.trip_latency}
+
+    def start(self):
+        """Configure PDOs and start watching the following error
+
+        Device is left in operational NMT state.
+
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        epos = self.epos
+        if not epos.change_nmt_state('PRE-OPERATIONAL'):
+            return False
+        if not epos.configure_tpdo(self.tpdo,
+                                   [(epos.objectIndex['Following Error Actual Value'], 0, 16)],
+                                   inhibit_time=self.inhibit_time):
+            self.logger.info('Failed to configure following error TPDO')
+            return False
+        if not epos.configure_rpdo(self.rpdo, [(epos.objectIndex['ControlWord'], 0, 16)]):
+            self.logger.info('Failed to configure quick stop RPDO')
+            return False
+        self._quick_stop_cob_id = epos.rpdo_cob_id(self.rpdo)
+        self._cob_id = epos.tpdo_cob_id(self.tpdo)
+        self.tripped.clear()
+        epos.network.subscribe(self._cob_id, self._on_error)
+        self.running = True
+        return epos.change_nmt_state('OPERATIONAL')
+
+    def stop(self):
+        """Stop watching the following error
+        """
+        if not self.running:
+            return
+        self.epos.network.unsubscribe(self._cob_id, self._on_error)
+        self.running = False
+
+    def rearm(self):
+        """Allow a new trip after the device was recovered
+        """
+        self.tripped.clear()
+
+    def quick_stop(self):
+        """Send the pre-built quick stop frame
+        """
+        self.epos.network.send_message(self._quick_stop_cob_id, self._quick_stop_frame)
+
+    def _on_error(self, can_id, data, timestamp):
+        error = int.from_bytes(data[0:2], 'little', signed=True)
+        magnitude = abs(error)
+        if magnitude > self.max_error and not self.tripped.is_set():
+            # stop first, bookkeeping afterwards
+            self.quick_stop()
+            self.tripped.set()
+            self.trip_latency = time.time() - timestamp
+            self.trip_error = error
+            self.trip_time = timestamp
+            self.logger.info('Following error {0} exceeds {1}, quick stop sent'.format(
+                error, self.max_error))
+            if self.on_trip is not None:
+                self.on_trip(error)
+        self.samples += 1
+        self.last_error = error
+        if magnitude > self.peak_error:
+            self.peak_error = magnitude
+        if self._near_miss_error <= magnitude <= self.max_error:
+            if not self._in_near_miss:
+                self.near_misses += 1
+                self._in_near_miss = True
+        else:
+            self._in_near_miss = False
@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from decimation import MinMaxDecimator, lttb
+
+# colors similar to matlab
+blueColor = (0, 0.4470, 0.7410)
+redColor = (0.8500, 0.3250, 0.0980)
+yellowColor = (0.9290, 0.6940, 0.1250)
+
+# columns of each sample sent to the plotting process
+columns = ('t', 'reference', 'position', 'error')
+
+
+class SharedRingBuffer:
+    """Ring buffer of float64 samples in shared memory
+
+    A single writer appends samples and any number of processes can read the
+    last samples without locking. The first 8 bytes hold the number of
+    samples written so far, which is only incremented after the sample is
+    complete. As in :class:`telemetry.TelemetryBuffer`, each sample is
+    written twice so the last samples are always contiguous.
+
+    Args:
+        n_columns: number of values of each sample.
+        capacity: number of samples kept.
+        name (optional): name of an existing buffer to attach to. If None,
+            a new buffer is created.
+    """
+
+    def __init__(self, n_columns, capacity, name=None):
+        self.n_columns = n_columns
+        self.capacity = capacity
+        self._owner = name is None
+        size = 8 + 8 * n_columns * 2 * capacity
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self._count = np.ndarray((1,), dtype='<u8', buffer=self._shm.buf, offset=0)
+        self._data = np.ndarray((n_columns, 2 * capacity), dtype='float64',
+                                buffer=self._shm.buf, offset=8)
+        if self._owner:
+            self._count[0] = 0
+
+    @property
+    def count(self):
+        """int: number of samples written since creation."""
+        return int(self._count[0])
+
+    def append(self, *values):
+        """Append one sample, never blocks
+
+        Args:
+            values: one value per column.
+        """
+        n = int(self._count[0])
+        i = n % self.capacity
+        self._data[:, i] = values
+        self._data[:, i + self.capacity] = values
+        self._count[0] = n + 1
+
+    def snapshot(self):
+        """Copy of the samples currently stored
+
+        Returns:
+            tuple: A tuple containing:
+
+            :data: array with shape (n_columns, n) from oldest to newest.
+            :count: number of samples written when snapshot was taken.
+        """
+        n = int(self._count[0])
+        length = min(n, self.capacity)
+        end = n % self.capacity + self.capacity
+        return self._data[:, end - length:end].copy(), n
+
+    def read_since(self, count):
+        """Copy of the samples written after a given count
+
+        Args:
+            count: value of :attr:`count` at the previous read.
+        Returns:
+            tuple: A tuple containing:
+
+            :data: array with shape (n_columns, n) with the new samples.
+            :count: number of samples written when data was read.
+            :lost: number of new samples already overwritten.
+        """
+        n = int(self._count[0])
+        length = min(n - count, self.capacity)
+        end = n % self.capacity + self.capacity
+        return self._data[:, end - length:end].copy(), n, n - count - length
+
+    def close(self):
+        """Detach from shared memory, removing it if this is the owner
+        """
+        if self._shm is None:
+            return
+        del self._count
+        del self._data
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+
+def _axis_limits(low, high, margin=0.1):
+    """Limits with a margin, avoiding a null range
+    """
+    span = high - low
+    if span <= 0:
+        span = abs(high) if high else 1.0
+    return low - margin * span, high + margin * span
+
+
+def _plot_process(name, capacity, reference, fps, hold, stop_event, max_points):
+    """Plotting process
+
+    Redraw the figure at a fixed frame rate using blitting. A complete
+    redraw is only made when data leaves the current axes limits. Only the
+    samples written since the previous frame are read and added to a
+    :class:`decimation.MinMaxDecimator` per line, so the cost of each frame
+    does not depend on the length of the run.
+    """
+    import matplotlib
+    # disable toolbar
+    matplotlib.rcParams['toolbar'] = 'None'
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
+
+    ring = SharedRingBuffer(len(columns), capacity, name=name)
+    closed = [False]
+
+    def handle_close(evt):
+        closed[0] = True
+
+    fig = plt.figure()
+    fig.canvas.mpl_connect('close_event', handle_close)
+    pos_ax = fig.add_subplot(2, 1, 1)
+    error_ax = fig.add_subplot(2, 1, 2)
+    line_ref = Line2D([], [], color=blueColor)
+    line_cmd = Line2D([], [], color=blueColor, animated=True)
+    line_out = Line2D([], [], color=redColor, linestyle='None', marker='o',
+                      markersize=1, animated=True)
+    line_diff = Line2D([], [], color=yellowColor, animated=True)
+    pos_ax.add_line(line_ref)
+    pos_ax.add_line(line_cmd)
+    pos_ax.add_line(line_out)
+    pos_ax.legend([line_ref, line_out], ['Ref', 'Out'], loc='upper right')
+    pos_ax.set_ylabel('Position [qc]')
+    error_ax.add_line(line_diff)
+    error_ax.set_ylabel('Position [qc]')
+    error_ax.set_xlabel('Time [s]')
+    error_ax.legend([line_diff], ['error'], loc='upper right')
+    x_lim = [0.0, 1.0]
+    pos_lim = [-1.0, 1.0]
+    error_lim = [-1.0, 1.0]
+    if reference is not None:
+        t_ref, y_ref = reference
+        line_ref.set_data(t_ref, y_ref)
+        if len(t_ref):
+            x_lim = [float(t_ref[0]), float(t_ref[-1])]
+            pos_lim = list(_axis_limits(float(np.min(y_ref)), float(np.max(y_ref))))
+    pos_ax.set_xlim(*x_lim)
+    error_ax.set_xlim(*x_lim)
+    pos_ax.set_ylim(*pos_lim)
+    error_ax.set_ylim(*error_lim)
+    fig.tight_layout()
+    plt.show(block=False)
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+
+    decimators = [MinMaxDecimator(max_points) for _ in range(3)]
+    dec_cmd, dec_out, dec_diff = decimators
+    period = 1.0 / fps
+    last_count = 0
+    while not closed[0]:
+        t_frame = time.monotonic()
+        stopping = stop_event.is_set()
+        data, count, _ = ring.read_since(last_count)
+        if data.shape[1]:
+            last_count = count
+            t = data[0]
+            for decimator, y in zip(decimators, data[1:]):
+                decimator.extend(t, y)
+            redraw = False
+            # grow limits only when data leaves them
+            if t[-1] > x_lim[1]:
+                x_lim[1] = x_lim[0] + 1.5 * (t[-1] - x_lim[0])
+                pos_ax.set_xlim(*x_lim)
+                error_ax.set_xlim(*x_lim)
+                redraw = True
+            low = min(dec_cmd.y_min, dec_out.y_min)
+            high = max(dec_cmd.y_max, dec_out.y_max)
+            if low < pos_lim[0] or high > pos_lim[1]:
+                pos_lim = list(_axis_limits(min(low, pos_lim[0]), max(high, pos_lim[1])))
+                pos_ax.set_ylim(*pos_lim)
+                redraw = True
+            if dec_diff.y_min < error_lim[0] or dec_diff.y_max > error_lim[1]:
+                error_lim = list(_axis_limits(min(dec_diff.y_min, error_lim[0]),
+                                              max(dec_diff.y_max, error_lim[1])))
+                error_ax.set_ylim(*error_lim)
+                redraw = True
+            if redraw:
+                fig.canvas.draw()
+                background = fig.canvas.copy_from_bbox(fig.bbox)
+            fig.canvas.restore_region(background)
+            line_cmd.set_data(*dec_cmd.data())
+            line_out.set_data(*dec_out.data())
+            line_diff.set_data(*dec_diff.data())
+            pos_ax.draw_artist(line_cmd)
+            pos_ax.draw_artist(line_out)
+            error_ax.draw_artist(line_diff)
+            fig.canvas.blit(fig.bbox)
+        fig.canvas.flush_events()
+        if stopping and not hold:
+            break
+        remaining = period - (time.monotonic() - t_frame)
+        if remaining > 0:
+            time.sleep(remaining)
+    plt.close(fig)
+    ring.close()
+
+
+class LivePlotter:
+    """Live plot of a control loop in a separate process
+
+    The control loop only writes each sample to a :class:`SharedRingBuffer`,
+    which never blocks. A separate process reads the buffer and redraws the
+    figure at its own frame rate using blitting, so the time spent drawing
+    does not affect the loop being measured.
+
+    Each sample has the columns ``('t', 'reference', 'position', 'error')``.
+
+    Every line is drawn with at most ``max_points`` points: the samples are
+    reduced to a min/max envelope (see :class:`decimation.MinMaxDecimator`)
+    and the static reference is downsampled once with
+    :func:`decimation.lttb`.
+
+    Args:
+        capacity (optional): number of samples kept in the shared buffer
+            between two frames.
+        reference (optional): tuple (t, position) with a static reference.
+        fps (optional): frame rate of the plotting process.
+        hold (optional): keep figure open after :func:`stop` until closed
+            by the user.
+        max_points (optional): maximum number of points of each line.
+    """
+
+    def __init__(self, capacity=100000, reference=None, fps=20, hold=True, max_points=4000):
+        # reference time for loops sharing the same plot
+        self.t0 = time.monotonic()
+        self.ring = SharedRingBuffer(len(columns), capacity)
+        self._stop_event = multiprocessing.Event()
+        if reference is not None:
+            reference = lttb(reference[0], reference[1], max_points)
+        self.process = multiprocessing.Process(
+            name='LivePlotter', target=_plot_process,
+            args=(self.ring.name, capacity, reference, fps, hold, self._stop_event,
+                  max_points))
+        self.process.daemon = True
+        self.process.start()
+
+    def update(self, t, reference, position, error):
+        """Send one sample to the plotting process
+
+        Args:
+            t: time [s].
+            reference: demanded position.
+            position: actual position.
+            error: difference between reference and actual position.
+        """
+        self.ring.append(t, reference, position, error)
+
+    def stop(self, wait=True):
+        """Signal the plotting process that no more samples will be sent
+
+        Args:
+            wait (optional): wait for plotting process to finish, which,
+                if hold is set, only happens when the figure is closed.
+        """
+        self._stop_event.set()
+        if wait:
+            self.process.join()
+            self.ring.close()
+
+    def is_alive(self):
+        """Check if plotting process is still running
+
+        Returns:
+            bool: True if the plotting process is running.
+        """
+        return self.process.is_alive()
@@ -0,0 +1,382 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+import numpy as np
+
+
+def max_speed_from_period(t_max, counts_per_rev=3600 * 4):
+    """Maximum speed for a given rotation period
+
+    1Hz = 60rpm = 360degrees/s and 360 degrees = sensor resolution * 4,
+    which yields 1Hz = (sensor resolution * 4)/s. So, for Fmax = 1 / t_max:
+
+    max_speed = 60 rpm/t_max [rpm] = (sensor resolution *4)/t_max [qc/s]
+
+    Args:
+        t_max: minimum period allowed for one rotation [s].
+        counts_per_rev (optional): quadrature counts per revolution.
+    Returns:
+        float: maximum speed in [qc/s].
+    """
+    return counts_per_rev / t_max
+
+
+class JerkReducedProfile:
+    """Motion profile for reduced jerk and vibration residuals.
+
+    Implements the algorithm developed in [1]_. The profile is made of
+    three phases: a cosine shaped acceleration (0 to t1), an optional
+    constant velocity phase (t1 to t2) and a cosine shaped deceleration
+    (t2 to t3). All constants are computed only once when the object is
+    created, so each evaluation is reduced to a few multiplications.
+
+    The methods :func:`position`, :func:`velocity` and :func:`acceleration`
+    accept scalars or NumPy arrays and are vectorized, while
+    :func:`position_at` is a cheap scalar lookup intended to be used inside
+    a control loop.
+
+    Args:
+        p_start: initial position [qc].
+        p_final: desired final position [qc].
+        max_speed: maximum allowed speed [qc/s].
+        max_acceleration: maximum allowed acceleration [qc/s^2].
+
+    .. [1] Li, Huaizhong & M Gong, Z & Lin, Wei & Lippa, T. (2007). Motion profile planning for reduced jerk and vibration residuals. 10.13140/2.1.4211.2647.
+    """
+
+    def __init__(self, p_start, p_final, max_speed, max_acceleration):
+        self.p_start = p_start
+        self.p_final = p_final
+        self.max_speed = float(max_speed)
+        self.max_acceleration = float(max_acceleration)
+        # absolute of displacement and direction of movement
+        self.distance = abs(p_final - p_start)
+        self.direction = float(np.sign(p_final - p_start))
+
+        # maximum interval for both the acceleration  and deceleration phase are:
+        t1_max = 2.0 * self.max_speed / self.max_acceleration
+        # the max distance covered by these two phase (assuming acceleration equal
+        # deceleration) is 2* 1/4 * Amax * t1_max^2 = 1/2 * Amax * t1_max^2 = 2Vmax^2/Amax
+        max_l13 = 2.0 * self.max_speed ** 2 / self.max_acceleration
+
+        # do we need  a constant velocity phase?
+        if self.distance > max_l13:
+            self.T1 = t1_max
+            self.T2 = 2.0 * (self.distance - max_l13) / (self.max_acceleration * t1_max)
+        else:
+            self.T1 = math.sqrt(2.0 * self.distance / self.max_acceleration)
+            self.T2 = 0.0
+        self.T3 = self.T1
+
+        # time constants
+        self.t1 = self.T1
+        self.t2 = self.T2 + self.t1
+        self.t3 = self.T3 + self.t2  # final time
+
+        # pre computed coefficients
+        amax = self.max_acceleration
+        if self.T1 > 0:
+            self._w = 2.0 * math.pi / self.T1
+            self._k = amax / (2.0 * self._w ** 2)
+            self._kv = amax / (2.0 * self._w)
+        else:
+            self._w = self._k = self._kv = 0.0
+        # position at end of phase 1 and at end of phase 2
+        self._p1 = amax * self.T1 ** 2 / 4.0
+        self._p2 = self._p1 + amax * self.T1 * self.T2 / 2.0
+        # velocity during the constant velocity phase
+        self._v_cruise = amax * self.T1 / 2.0
+
+    @property
+    def duration(self):
+        """float: total time of the movement [s]."""
+        return self.t3
+
+    def evaluate(self, t):
+        """Evaluate position, velocity and acceleration of the profile
+
+        Args:
+            t: a scalar or an array of times [s] relative to the start of movement.
+        Returns:
+            tuple: A tuple containing:
+
+            :position: reference position [qc].
+            :velocity: reference velocity [qc/s].
+            :acceleration: reference acceleration [qc/s^2].
+        """
+        t = np.asarray(t, dtype=float)
+        amax = self.max_acceleration
+        w = self._w
+        position = np.empty_like(t)
+        velocity = np.empty_like(t)
+        acceleration = np.empty_like(t)
+
+        # before start of movement
+        mask = t <= 0
+        position[mask] = 0.0
+        velocity[mask] = 0.0
+        acceleration[mask] = 0.0
+        # phase 1, acceleration
+        mask = (t > 0) & (t <= self.t1)
+        tau = t[mask]
+        position[mask] = amax * tau ** 2 / 4.0 - self._k * (1.0 - np.cos(w * tau))
+        velocity[mask] = amax * tau / 2.0 - self._kv * np.sin(w * tau)
+        acceleration[mask] = amax / 2.0 * (1.0 - np.cos(w * tau))
+        # phase 2, constant velocity
+        mask = (t > self.t1) & (t <= self.t2)
+        tau = t[mask] - self.t1
+        position[mask] = self._p1 + self._v_cruise * tau
+        velocity[mask] = self._v_cruise
+        acceleration[mask] = 0.0
+        # phase 3, deceleration
+        mask = (t > self.t2) & (t < self.t3)
+        tau = t[mask] - self.t2
+        position[mask] = self._p2 + self._v_cruise * tau - amax * tau ** 2 / 4.0 + \
+            self._k * (1.0 - np.cos(w * tau))
+        velocity[mask] = self._v_cruise - amax * tau / 2.0 + self._kv * np.sin(w * tau)
+        acceleration[mask] = -amax / 2.0 * (1.0 - np.cos(w * tau))
+        # movement finished
+        mask = t >= self.t3
+        position[mask] = self.distance
+        velocity[mask] = 0.0
+        acceleration[mask] = 0.0
+
+        position = self.p_start + self.direction * position
+        velocity = self.direction * velocity
+        acceleration = self.direction * acceleration
+        return position, velocity, acceleration
+
+    def position(self, t):
+        """Reference position for a scalar or an array of times
+
+        Args:
+            t: a scalar or an array of times [s].
+        Returns:
+            numpy.ndarray: reference position [qc].
+        """
+        return self.evaluate(t)[0]
+
+    def velocity(self, t):
+        """Reference velocity for a scalar or an array of times
+
+        Args:
+            t: a scalar or an array of times [s].
+        Returns:
+            numpy.ndarray: reference velocity [qc/s].
+        """
+        return self.evaluate(t)[1]
+
+    def acceleration(self, t):
+        """Reference acceleration for a scalar or an array of times
+
+        Args:
+            t: a scalar or an array of times [s].
+        Returns:
+            numpy.ndarray: reference acceleration [qc/s^2].
+        """
+        return self.evaluate(t)[2]
+
+    def position_at(self, t):
+        """Reference position for a single instant
+
+        Scalar version of :func:`position` using only the math module, to be
+        used inside control loops where NumPy overhead for a single sample
+        is not negligible.
+
+        Args:
+            t: time [s] relative to the start of movement.
+        Returns:
+            int: rounded reference position [qc].
+        """
+        if t >= self.t3:
+            return int(self.p_final)
+        if t <= 0:
+            return int(self.p_start)
+        if t <= self.t1:
+            aux = self.max_acceleration * t * t / 4.0 - \
+                self._k * (1.0 - math.cos(self._w * t))
+        elif t <= self.t2:
+            aux = self._p1 + self._v_cruise * (t - self.t1)
+        else:
+            tau = t - self.t2
+            aux = self._p2 + self._v_cruise * tau - \
+                self.max_acceleration * tau * tau / 4.0 + \
+                self._k * (1.0 - math.cos(self._w * tau))
+        return int(round(self.p_start + self.direction * aux))
+
+    def state_at(self, t):
+        """Position, velocity and acceleration for a single instant
+
+        Scalar version of :func:`evaluate` using only the math module.
+
+        Args:
+            t: time [s] relative to the start of movement.
+        Returns:
+            tuple: A tuple containing:
+
+            :position: reference position [qc].
+            :velocity: reference velocity [qc/s].
+            :acceleration: reference acceleration [qc/s^2].
+        """
+        if t >= self.t3:
+            return float(self.p_final), 0.0, 0.0
+        if t <= 0:
+            return float(self.p_start), 0.0, 0.0
+        amax = self.max_acceleration
+        if t <= self.t1:
+            wt = self._w * t
+            position = amax * t * t / 4.0 - self._k * (1.0 - math.cos(wt))
+            velocity = amax * t / 2.0 - self._kv * math.sin(wt)
+            acceleration = amax / 2.0 * (1.0 - math.cos(wt))
+        elif t <= self.t2:
+            position = self._p1 + self._v_cruise * (t - self.t1)
+            velocity = self._v_cruise
+            acceleration = 0.0
+        else:
+            tau = t - self.t2
+            wt = self._w * tau
+            position = self._p2 + self._v_cruise * tau - amax * tau * tau / 4.0 + \
+                self._k * (1.0 - math.cos(wt))
+            velocity = self._v_cruise - amax * tau / 2.0 + self._kv * math.sin(wt)
+            acceleration = -amax / 2.0 * (1.0 - math.cos(wt))
+        return (self.p_start + self.direction * position, self.direction * velocity,
+                self.direction * acceleration)
+
+    def setpoints(self, period):
+        """Sample the complete profile with a fixed period
+
+        Args:
+            period: sample period [s].
+        Returns:
+            tuple: A tuple containing:
+
+            :t: array of sampling times, including t3.
+            :position: array of rounded positions as int32 [qc].
+        """
+        t = np.arange(0.0, self.t3, period)
+        t = np.append(t, self.t3)
+        position = np.rint(self.position(t)).astype('int32')
+        return t, position
+
+
+class BlendedMotion:
+    """Preemptible motion generator accepting new targets during a movement
+
+    Each new target adds a :class:`JerkReducedProfile` segment covering the
+    distance between the previous target and the new one, starting at the
+    instant the target is received. The reference is the sum of all active
+    segments. Every segment starts with null velocity, acceleration and
+    jerk, so adding one keeps the reference continuous up to the jerk: the
+    movement blends into the new target from the current position,
+    velocity and acceleration, without stopping.
+
+    Segments in the same direction add their velocities, so the limits of a
+    new segment are reduced by the velocity and acceleration already present
+    in that direction, down to ``min_ratio`` of the limits. Replanning only
+    builds one segment, a few floating point operations.
+
+    Times passed to :func:`set_target` and :func:`state_at` must not
+    decrease, since finished segments are discarded.
+
+    Args:
+        position: initial position [qc].
+        max_speed: maximum allowed speed [qc/s].
+        max_acceleration: maximum allowed acceleration [qc/s^2].
+        min_ratio (optional): minimum fraction of limits used by a new segment.
+    """
+
+    def __init__(self, position, max_speed, max_acceleration, min_ratio=0.2):
+        self.max_speed = float(max_speed)
+        self.max_acceleration = float(max_acceleration)
+        self.min_ratio = min_ratio
+        self.target = position
+        # position reached by finished segments
+        self._base = float(position)
+        # list of (start time, segment)
+        self._segments = []
+
+    @property
+    def moving(self):
+        """bool: True if any segment is still active."""
+        return bool(self._segments)
+
+    def set_target(self, target, t):
+        """Replan towards a new target
+
+        Args:
+            target: new final position [qc].
+            t: current time [s].
+        """
+        distance = target - self.target
+        if distance == 0:
+            return
+        _, velocity, acceleration = self.state_at(t)
+        direction = 1.0 if distance > 0 else -1.0
+        speed = max(self.max_speed - max(direction * velocity, 0.0),
+                    self.min_ratio * self.max_speed)
+        acc = max(self.max_acceleration - abs(acceleration),
+                  self.min_ratio * self.max_acceleration)
+        self._segments.append((t, JerkReducedProfile(0, distance, speed, acc)))
+        self.target = target
+
+    def state_at(self, t):
+        """Reference for a single instant
+
+        Args:
+            t: current time [s].
+        Returns:
+            tuple: A tuple containing:
+
+            :position: reference position [qc].
+            :velocity: reference velocity [qc/s].
+            :acceleration: reference acceleration [qc/s^2].
+        """
+        position = self._base
+        velocity = 0.0
+        acceleration = 0.0
+        active = []
+        for t_start, segment in self._segments:
+            tau = t - t_start
+            if tau >= segment.t3:
+                self._base += segment.p_final
+                position += segment.p_final
+                continue
+            p, v, a = segment.state_at(tau)
+            position += p
+            velocity += v
+            acceleration += a
+            active.append((t_start, segment))
+        if len(active) != len(self._segments):
+            self._segments = active
+        return position, velocity, acceleration
+
+    def position_at(self, t):
+        """Rounded reference position for a single instant
+
+        Args:
+            t: current time [s].
+        Returns:
+            int: rounded reference position [qc].
+        """
+        return int(round(self.state_at(t)[0]))
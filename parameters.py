@@ -0,0 +1,428 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# parameters of each group as (object name, subindex, size in bytes, signed)
+PARAMETERS = {
+    'motor': {'motor_type': ('MotorType', 0, 2, False),
+              'continuous_current_limit': ('Motor Data', 1, 2, False),
+              'output_current_limit': ('Motor Data', 2, 2, False),
+              'pole_pair_number': ('Motor Data', 3, 1, False),
+              'max_speed': ('Motor Data', 4, 2, False),
+              'thermal_time_constant': ('Motor Data', 5, 2, False)},
+    'sensor': {'pulse_number': ('Sensor Configuration', 1, 2, False),
+               'sensor_type': ('Sensor Configuration', 2, 2, False),
+               'polarity': ('Sensor Configuration', 4, 2, False)},
+    'gains': {'current_p': ('Current Control Parameter', 1, 2, True),
+              'current_i': ('Current Control Parameter', 2, 2, True),
+              'velocity_p': ('Speed Control Parameter', 1, 2, True),
+              'velocity_i': ('Speed Control Parameter', 2, 2, True),
+              'position_p': ('Position Control Parameter', 1, 2, True),
+              'position_i': ('Position Control Parameter', 2, 2, True),
+              'position_d': ('Position Control Parameter', 3, 2, True),
+              'velocity_feedforward': ('Position Control Parameter', 4, 2, False),
+              'acceleration_feedforward': ('Position Control Parameter', 5, 2, False)},
+    'limits': {'min_position': ('Software Position Limit', 1, 4, True),
+               'max_position': ('Software Position Limit', 2, 4, True),
+               'max_following_error': ('Max Following Error', 0, 4, False),
+               'max_profile_velocity': ('Max Profile Velocity', 0, 4, False),
+               'quick_stop_deceleration': ('QuickStop Deceleration', 0, 4, False),
+               'position_window': ('Position Window', 0, 4, False),
+               'position_window_time': ('Position Window Time', 0, 2, False)},
+    'communication': {'producer_heartbeat': ('Producer Heartbeat Time', 0, 2, False),
+                      'consumer_heartbeat': ('Consumer Heartbeat Time', 1, 4, False)},
+}
+
+# PDOs in group 'pdo' of profiles
+PDOS = ['rpdo1', 'rpdo2', 'rpdo3', 'rpdo4', 'tpdo1', 'tpdo2', 'tpdo3', 'tpdo4']
+
+_logger = logging.getLogger('PARAMETERS')
+
+
+def _read_value(epos, index, subindex, signed=False):
+    value = epos.read_object(index, subindex)
+    if value is None:
+        return None
+    return int.from_bytes(value, 'little', signed=signed)
+
+
+def _format_entry(index, subindex, bits):
+    return '0x{0:04X}:{1}:{2}'.format(index, subindex, bits)
+
+
+def _parse_entry(entry):
+    """Mapped object as tuple (index, subindex, bits) from 'index:subindex:bits' or a list
+    """
+    if isinstance(entry, str):
+        entry = entry.split(':')
+    return tuple(int(field, 0) if isinstance(field, str) else int(field) for field in entry)
+
+
+def _read_pdo(epos, name):
+    """Read configuration of a PDO as stored in profiles
+
+    Disabled PDOs are reported with an empty mapping, as applied by
+    :func:`epos.Epos.configure_tpdo` and :func:`epos.Epos.configure_rpdo`.
+    """
+    kind = 'Transmit' if name.startswith('t') else 'Receive'
+    number = int(name[-1])
+    parameter_index = epos.objectIndex['{0} PDO {1} Parameter'.format(kind, number)]
+    mapping_index = epos.objectIndex['{0} PDO {1} Mapping'.format(kind, number)]
+    cob_id = _read_value(epos, parameter_index, 1)
+    transmission_type = _read_value(epos, parameter_index, 2)
+    count = _read_value(epos, mapping_index, 0)
+    if cob_id is None or transmission_type is None or count is None:
+        return None
+    pdo = {'transmission_type': transmission_type}
+    if kind == 'Transmit':
+        pdo['inhibit_time'] = _read_value(epos, parameter_index, 3)
+        if pdo['inhibit_time'] is None:
+            return None
+    mapping = []
+    if not cob_id & 0x80000000:
+        for subindex in range(1, count + 1):
+            entry = _read_value(epos, mapping_index, subindex)
+            if entry is None:
+                return None
+            mapping.append(_format_entry(entry >> 16, (entry >> 8) & 0xFF, entry & 0xFF))
+    pdo['mapping'] = mapping
+    return pdo
+
+
+def _write_pdo(epos, name, pdo):
+    objects = [_parse_entry(entry) for entry in pdo.get('mapping', [])]
+    number = int(name[-1])
+    if name.startswith('t'):
+        return epos.configure_tpdo(number, objects,
+                                   transmission_type=pdo.get('transmission_type', 255),
+                                   inhibit_time=pdo.get('inhibit_time', 0))
+    return epos.configure_rpdo(number, objects,
+                               transmission_type=pdo.get('transmission_type', 255))
+
+
+def _same_pdo(current, desired):
+    if current is None:
+        return False
+    for key, value in desired.items():
+        if key == 'mapping':
+            if [_parse_entry(entry) for entry in value] != \
+                    [_parse_entry(entry) for entry in current['mapping']]:
+                return False
+        elif current.get(key) != value:
+            return False
+    return True
+
+
+def dump_parameters(epos, template=None):
+    """Read parameters of a device as a profile
+
+    A profile is a dictionary of groups, each a dictionary of parameter
+    values. Groups are those of :data:`PARAMETERS` and 'pdo', holding the
+    transmission type, inhibit time and mapping of each PDO, with mapped
+    objects written as 'index:subindex:bits'. PDOs use their default COB-ID.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        template (optional): a profile, only its groups and parameters are read. Default all.
+    Returns:
+        tuple: A tuple containing:
+
+        :profile: the parameters read, None if they could not be read.
+        :ok: A boolean if all requests went ok or not.
+    """
+    if template is None:
+        template = dict((group, dict.fromkeys(parameters))
+                        for group, parameters in PARAMETERS.items())
+        template['pdo'] = dict.fromkeys(PDOS)
+    profile = {}
+    for group, parameters in template.items():
+        values = {}
+        for name in parameters:
+            if group == 'pdo':
+                if name not in PDOS:
+                    epos.log_info('Unknown PDO: {0}'.format(name))
+                    return None, False
+                value = _read_pdo(epos, name)
+            else:
+                if name not in PARAMETERS.get(group, {}):
+                    epos.log_info('Unknown parameter: {0}.{1}'.format(group, name))
+                    return None, False
+                object_name, subindex, _, signed = PARAMETERS[group][name]
+                value = _read_value(epos, epos.objectIndex[object_name], subindex, signed)
+            if value is None:
+                epos.log_info('Failed to read {0}.{1}'.format(group, name))
+                return None, False
+            values[name] = value
+        profile[group] = values
+    return profile, True
+
+
+def diff_parameters(current, desired):
+    """Parameters that differ between two profiles
+
+    Only parameters present in the desired profile are compared.
+
+    Args:
+        current: profile read from device.
+        desired: profile to be applied.
+    Returns:
+        list: tuples (group, name, current value, desired value) of each difference.
+    """
+    changes = []
+    for group, parameters in desired.items():
+        for name, value in parameters.items():
+            old = current.get(group, {}).get(name)
+            if group == 'pdo':
+                if not _same_pdo(old, value):
+                    changes.append((group, name, old, value))
+            elif old != value:
+                changes.append((group, name, old, value))
+    return changes
+
+
+def apply_parameters(epos, profile, store=True, dry_run=False, restore_state=None):
+    """Write to a device only the parameters that changed
+
+    The parameters of the profile are read, compared and only those with
+    a different value are written. Parameters are stored in non volatile
+    memory only if something was written. PDOs are changed in
+    pre-operational state and the device then returns to restore_state.
+    By default, that is the state reported by its heartbeat before the
+    change, or operational if the device sends no heartbeats. Motor and
+    sensor parameters should be changed with the device disabled.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        profile: profile with the desired values, see :func:`dump_parameters`.
+        store (optional): store parameters after changes. Default True.
+        dry_run (optional): only compute the differences. Default False.
+        restore_state (optional): NMT state after PDO changes, see :func:`epos.Epos.change_nmt_state`.
+    Returns:
+        tuple: A tuple containing:
+
+        :changes: list of differences found, see :func:`diff_parameters`.
+        :ok: A boolean if all requests went ok or not.
+    """
+    current, ok = dump_parameters(epos, profile)
+    if not ok:
+        return None, False
+    changes = diff_parameters(current, profile)
+    if dry_run or not changes:
+        return changes, True
+    pdo_changes = [change for change in changes if change[0] == 'pdo']
+    if pdo_changes and restore_state is None:
+        restore_state, ok = epos.read_nmt_state()
+        if not ok:
+            restore_state = 'OPERATIONAL'
+    if pdo_changes and not epos.change_nmt_state('PRE-OPERATIONAL'):
+        return changes, False
+    ok = True
+    for group, name, _, value in changes:
+        if group == 'pdo':
+            written = _write_pdo(epos, name, value)
+        else:
+            object_name, subindex, size, signed = PARAMETERS[group][name]
+            written = epos.write_object(epos.objectIndex[object_name], subindex,
+                                        value.to_bytes(size, 'little', signed=signed))
+        if not written:
+            epos.log_info('Failed to write {0}.{1}'.format(group, name))
+            ok = False
+    if pdo_changes and restore_state != 'PRE-OPERATIONAL':
+        ok = epos.change_nmt_state(restore_state) and ok
+    if ok and store:
+        try:
+            epos.save_config()
+        except Exception as e:
+            epos.log_info('Failed to store parameters: {0}'.format(e))
+            ok = False
+    return changes, ok
+
+
+def _fleet_profile(profiles, node_id):
+    """Profile of a node in a fleet, falling back to 'default'
+    """
+    for key in (node_id, str(node_id), 'default'):
+        if key in profiles:
+            return profiles[key]
+    return None
+
+
+def dump_fleet(axes, template=None):
+    """Read parameters of several devices in parallel
+
+    Args:
+        axes: list of :class:`epos.Epos` devices.
+        template (optional): a profile, only its groups and parameters are read. Default all.
+    Returns:
+        dict: profile of each node ID, None for devices that failed.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(axes), 1)) as executor:
+        results = list(executor.map(lambda axis: dump_parameters(axis, template), axes))
+    return dict((axis.node.id, profile) for axis, (profile, _) in zip(axes, results))
+
+
+def apply_fleet(axes, profiles, store=True, dry_run=False, restore_state=None):
+    """Apply parameters to several devices in parallel
+
+    Args:
+        axes: list of :class:`epos.Epos` devices.
+        profiles: profile of each node ID, with key 'default' for the remaining.
+        store (optional): store parameters of devices that changed. Default True.
+        dry_run (optional): only compute the differences. Default False.
+        restore_state (optional): NMT state after PDO changes, see :func:`apply_parameters`.
+    Returns:
+        dict: tuple (changes, ok) of each node ID, see :func:`apply_parameters`.
+    """
+    def apply(axis):
+        profile = _fleet_profile(profiles, axis.node.id)
+        if profile is None:
+            return [], True
+        return apply_parameters(axis, profile, store=store, dry_run=dry_run,
+                                restore_state=restore_state)
+
+    with ThreadPoolExecutor(max_workers=max(len(axes), 1)) as executor:
+        results = list(executor.map(apply, axes))
+    return dict((axis.node.id, result) for axis, result in zip(axes, results))
+
+
+def _is_yaml(filename):
+    return os.path.splitext(filename)[1].lower() in ('.yaml', '.yml')
+
+
+def load_profile(filename):
+    """Load profiles from a JSON or YAML file, chosen by extension
+
+    Returns:
+        dict: profiles read or None if file could not be read.
+    """
+    try:
+        with open(filename, 'r') as f:
+            if _is_yaml(filename):
+                if yaml is None:
+                    _logger.info('PyYAML is needed to read {0}'.format(filename))
+                    return None
+                return yaml.safe_load(f)
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        _logger.info('Failed to load {0}: {1}'.format(filename, e))
+        return None
+
+
+def save_profile(profile, filename):
+    """Save profiles to a JSON or YAML file, chosen by extension
+
+    Returns:
+        bool: A boolean if all went ok or not.
+    """
+    if _is_yaml(filename) and yaml is None:
+        _logger.info('PyYAML is needed to write {0}'.format(filename))
+        return False
+    try:
+        with open(filename, 'w') as f:
+            if _is_yaml(filename):
+                yaml.safe_dump(profile, f, default_flow_style=False, sort_keys=False)
+            else:
+                json.dump(profile, f, indent=2)
+    except IOError as e:
+        _logger.info('Failed to save {0}: {1}'.format(filename, e))
+        return False
+    return True
+
+
+def main():
+    """Dump or apply parameters of all devices on a bus
+
+    Examples::
+
+        python parameters.py dump fleet.json
+        python parameters.py apply fleet.json --dry-run
+    """
+    import argparse
+    import canopen
+    from discovery import find_nodes
+    from epos import Epos
+
+    if (sys.version_info < (3, 0)):
+        print("Please use python version 3")
+        return
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description='Dump or apply parameters of EPOS devices')
+    parser.add_argument('command', choices=['dump', 'apply'], help='Action to perform')
+    parser.add_argument('file', help='JSON or YAML file of profiles')
+    parser.add_argument('--channel', '-c', action='store', default='can0',
+                        type=str, help='Channel to be used', dest='channel')
+    parser.add_argument('--bus', '-b', action='store',
+                        default='socketcan', type=str, help='Bus type', dest='bus')
+    parser.add_argument('--nodes', '-n', action='store', default=None, nargs='+',
+                        type=int, help='Node IDs, default all found on bus', dest='nodes')
+    parser.add_argument('--dry-run', action='store_true', help='Only show differences',
+                        dest='dry_run')
+    parser.add_argument('--no-store', action='store_false', help='Do not store changes',
+                        dest='store')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s.%(msecs)03d] [%(name)-20s]: %(levelname)-8s %(message)s',
+                        datefmt='%d-%m-%Y %H:%M:%S',
+                        level=logging.INFO)
+    network = canopen.Network()
+    network.connect(channel=args.channel, bustype=args.bus)
+    try:
+        node_ids = args.nodes if args.nodes else sorted(find_nodes(network))
+        axes = []
+        for node_id in node_ids:
+            epos = Epos(_network=network)
+            if epos.begin(node_id):
+                axes.append(epos)
+            else:
+                print('Failed to begin connection with node {0}'.format(node_id))
+        if args.command == 'dump':
+            profiles = dump_fleet(axes)
+            save_profile(dict((str(node_id), profile) for node_id, profile in profiles.items()),
+                         args.file)
+            print('Saved parameters of {0} node(s) to {1}'.format(len(profiles), args.file))
+            return
+        profiles = load_profile(args.file)
+        if profiles is None:
+            return
+        for node_id, (changes, ok) in sorted(apply_fleet(axes, profiles, store=args.store,
+                                                         dry_run=args.dry_run).items()):
+            print('Node {0}: {1} change(s){2}'.format(node_id, len(changes or []),
+                                                      '' if ok else ', FAILED'))
+            for group, name, old, new in changes or []:
+                print('    {0}.{1}: {2} -> {3}'.format(group, name, old, new))
+    finally:
+        network.disconnect()
+
+
+if __name__ == '__main__':
+    main()
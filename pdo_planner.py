@@ -0,0 +1,338 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+from epos import Epos
+
+# bit length of objects that can be mapped to PDOs, by (name, subindex), from EDS
+MAPPABLE = {
+    ('ControlWord', 0): 16, ('StatusWord', 0): 16,
+    ('Modes of Operation', 0): 8, ('Modes of Operation Display', 0): 8,
+    ('Position Demand Value', 0): 32, ('Position Actual Value', 0): 32,
+    ('Max Following Error', 0): 32, ('Velocity Sensor Actual Value', 0): 32,
+    ('Velocity Demand Value', 0): 32, ('Velocity Actual Value', 0): 32,
+    ('Current Actual Value', 0): 16, ('Target Position', 0): 32, ('Home Offset', 0): 32,
+    ('Profile Velocity', 0): 32, ('Profile Acceleration', 0): 32,
+    ('Profile Deceleration', 0): 32, ('QuickStop Deceleration', 0): 32,
+    ('Motion ProfileType', 0): 16, ('Homing Method', 0): 8,
+    ('Homing Speeds', 1): 32, ('Homing Speeds', 2): 32, ('Homing Acceleration', 0): 32,
+    ('Current Control Parameter', 1): 16, ('Current Control Parameter', 2): 16,
+    ('Speed Control Parameter', 1): 16, ('Speed Control Parameter', 2): 16,
+    ('Position Control Parameter', 1): 16, ('Position Control Parameter', 2): 16,
+    ('Position Control Parameter', 3): 16, ('Position Control Parameter', 4): 16,
+    ('Position Control Parameter', 5): 16, ('TargetVelocity', 0): 32,
+    ('Motor Data', 1): 16, ('Motor Data', 2): 16, ('Motor Data', 4): 16,
+    ('Encoder Counter', 0): 16, ('Encoder Counter at Index Pulse', 0): 16,
+    ('Hallsensor Pattern', 0): 16, ('Current Actual Value Averaged', 0): 16,
+    ('Velocity Actual Value Averaged', 0): 32, ('Trajectory Profile Time', 0): 32,
+    ('CurrentMode Setting Value', 0): 16, ('PositionMode Setting Value', 0): 32,
+    ('VelocityMode Setting Value', 0): 32, ('Digital Input Funtionalities', 1): 16,
+    ('Position Marker', 1): 32, ('Digital Output Funtionalities', 1): 16,
+    ('Analog Inputs', 1): 16, ('Analog Inputs', 2): 16,
+    ('Current Threshold for Homing Mode', 0): 16, ('Home Position', 0): 32,
+    ('Following Error Actual Value', 0): 16,
+}
+
+# mappable objects with signed data types, from EDS
+SIGNED = {
+    ('Modes of Operation', 0), ('Modes of Operation Display', 0),
+    ('Position Demand Value', 0), ('Position Actual Value', 0),
+    ('Velocity Sensor Actual Value', 0), ('Velocity Demand Value', 0),
+    ('Velocity Actual Value', 0), ('Current Actual Value', 0), ('Target Position', 0),
+    ('Home Offset', 0), ('Motion ProfileType', 0), ('Homing Method', 0),
+    ('Current Control Parameter', 1), ('Current Control Parameter', 2),
+    ('Speed Control Parameter', 1), ('Speed Control Parameter', 2),
+    ('Position Control Parameter', 1), ('Position Control Parameter', 2),
+    ('Position Control Parameter', 3), ('TargetVelocity', 0),
+    ('Current Actual Value Averaged', 0), ('Velocity Actual Value Averaged', 0),
+    ('CurrentMode Setting Value', 0), ('PositionMode Setting Value', 0),
+    ('VelocityMode Setting Value', 0), ('Position Marker', 1),
+    ('Analog Inputs', 1), ('Analog Inputs', 2), ('Home Position', 0),
+    ('Following Error Actual Value', 0),
+}
+
+# PDOs available in each direction of each node
+PDOS_PER_NODE = 4
+
+_logger = logging.getLogger('PDO_PLANNER')
+
+
+def frame_bits(n_bytes, extended=False):
+    """Length of a CAN data frame with worst case bit stuffing
+
+    Includes the 3 bits of interframe space.
+
+    Args:
+        n_bytes: number of data bytes, from 0 to 8.
+        extended (optional): 29 bit identifier (CAN 2.0B) instead of 11 bit. Default False.
+    Returns:
+        int: number of bits on the bus.
+    """
+    if extended:
+        return 67 + 8 * n_bytes + (54 + 8 * n_bytes - 1) // 4
+    return 47 + 8 * n_bytes + (34 + 8 * n_bytes - 1) // 4
+
+
+class PdoPlanner:
+    """Pack signals of several devices into PDOs and check bus load
+
+    Signals are objects of :attr:`epos.Epos.objectIndex`, sent by a device
+    ('transmit', mapped to a TPDO) or by the host ('receive', mapped to a
+    RPDO) at a given rate. For each node and direction, signals are first
+    packed by rate, largest first, in PDOs of up to 8 bytes. While more
+    PDOs than available are needed, the pair of PDOs whose merge adds the
+    least bus load is merged, sent at the highest of both rates.
+
+    With a SYNC rate, transmit PDOs whose rate divides it are synchronous,
+    sent every n SYNC messages, and receive PDOs are applied on SYNC. The
+    remaining transmit PDOs are event driven with an inhibit time that
+    limits them to their rate, and receive PDOs are applied on reception.
+
+    Load is computed with worst case bit stuffing for the rate of each PDO
+    and the SYNC messages, so it is an upper bound for event driven PDOs.
+    :func:`plan` rejects plans that need too many PDOs or exceed the
+    maximum load before anything is written to the devices.
+
+    Args:
+        bitrate (optional): bitrate of bus [bit/s]. Default 1000000.
+        sync_rate (optional): frequency of SYNC messages [Hz], None if not used.
+        max_load (optional): maximum fraction of bus used. Default 0.7.
+    """
+
+    def __init__(self, bitrate=1000000, sync_rate=None, max_load=0.7):
+        self.bitrate = bitrate
+        self.sync_rate = sync_rate
+        self.max_load = max_load
+        self.signals = []
+
+    def add_signal(self, node_id, name, rate, direction='transmit', subindex=0, bits=None):
+        """Add a signal to be mapped
+
+        Args:
+            node_id: node ID of device.
+            name: name of object, a key of :attr:`epos.Epos.objectIndex`.
+            rate: frequency of the signal [Hz].
+            direction (optional): 'transmit' from device or 'receive' by device. Default 'transmit'.
+            subindex (optional): subindex of object. Default 0.
+            bits (optional): bit length, needed only for objects not in :data:`MAPPABLE`.
+        """
+        self.signals.append({'node_id': node_id, 'name': name, 'subindex': subindex,
+                             'rate': rate, 'direction': direction, 'bits': bits})
+
+    def _load(self, rate, n_bytes):
+        return rate * frame_bits(n_bytes) / self.bitrate
+
+    def _pack(self, signals):
+        """Pack signals of one node and direction in at most PDOS_PER_NODE PDOs
+
+        Returns:
+            list: PDOs as dicts with rate, bits and signals, None if impossible.
+        """
+        pdos = []
+        for signal in sorted(signals, key=lambda s: (-s['rate'], -s['bits'])):
+            for pdo in pdos:
+                if pdo['rate'] == signal['rate'] and pdo['bits'] + signal['bits'] <= 64:
+                    break
+            else:
+                pdo = {'rate': signal['rate'], 'bits': 0, 'signals': []}
+                pdos.append(pdo)
+            pdo['bits'] += signal['bits']
+            pdo['signals'].append(signal)
+        while len(pdos) > PDOS_PER_NODE:
+            best = None
+            for i in range(len(pdos)):
+                for j in range(i + 1, len(pdos)):
+                    a, b = pdos[i], pdos[j]
+                    bits = a['bits'] + b['bits']
+                    if bits > 64:
+                        continue
+                    cost = self._load(max(a['rate'], b['rate']), (bits + 7) // 8) - \
+                        self._load(a['rate'], (a['bits'] + 7) // 8) - \
+                        self._load(b['rate'], (b['bits'] + 7) // 8)
+                    if best is None or cost < best[0]:
+                        best = (cost, i, j)
+            if best is None:
+                return None
+            _, i, j = best
+            merged = pdos.pop(j)
+            pdos[i] = {'rate': max(pdos[i]['rate'], merged['rate']),
+                       'bits': pdos[i]['bits'] + merged['bits'],
+                       'signals': pdos[i]['signals'] + merged['signals']}
+        return pdos
+
+    def _transmission(self, direction, rate):
+        """Transmission type, inhibit time [100us] and actual rate of a PDO
+        """
+        if self.sync_rate:
+            if direction == 'receive':
+                return 1, None, rate
+            ratio = self.sync_rate / rate
+            n = int(round(ratio))
+            if 1 <= n <= 240 and abs(ratio - n) < 1e-6 * ratio:
+                return n, None, self.sync_rate / n
+        if direction == 'receive':
+            return 255, None, rate
+        # inhibit time is UNSIGNED16, slower signals are not limited by it
+        return 255, min(int(1e4 / rate), 0xFFFF), rate
+
+    def plan(self):
+        """Compute the mapping of all signals
+
+        Returns:
+            tuple: A tuple containing:
+
+            :plan: dict with list 'pdos', total 'load' and list 'errors'. Each
+                PDO has node_id, direction ('tpdo' or 'rpdo'), number,
+                cob_id, objects as (index, subindex, bits), signal names,
+                rate, transmission_type, inhibit_time, bytes and load.
+            :ok: A boolean if plan is feasible.
+        """
+        errors = []
+        groups = {}
+        for signal in self.signals:
+            key = (signal['name'], signal['subindex'])
+            if signal['name'] not in Epos.objectIndex:
+                errors.append('Unknown object: {0}'.format(signal['name']))
+                continue
+            if signal['bits'] is None:
+                if key not in MAPPABLE:
+                    errors.append('Object can not be mapped: {0} sub {1}'.format(*key))
+                    continue
+                signal = dict(signal, bits=MAPPABLE[key])
+            if signal['direction'] not in ('transmit', 'receive'):
+                errors.append('Invalid direction: {0}'.format(signal['direction']))
+                continue
+            if signal['rate'] <= 0:
+                errors.append('Invalid rate for {0}: {1}'.format(signal['name'], signal['rate']))
+                continue
+            group = groups.setdefault((signal['node_id'], signal['direction']), [])
+            if any((s['name'], s['subindex']) == key for s in group):
+                errors.append('Duplicated signal on node {0}: {1}'.format(signal['node_id'],
+                                                                           signal['name']))
+                continue
+            group.append(signal)
+        pdos = []
+        for (node_id, direction), signals in sorted(groups.items()):
+            packed = self._pack(signals)
+            if packed is None:
+                errors.append('Signals of node {0} do not fit in {1} {2} PDOs'.format(
+                    node_id, PDOS_PER_NODE, direction))
+                continue
+            kind = 'tpdo' if direction == 'transmit' else 'rpdo'
+            base = 0x180 if direction == 'transmit' else 0x200
+            for number, pdo in enumerate(packed, start=1):
+                transmission_type, inhibit_time, rate = self._transmission(direction, pdo['rate'])
+                n_bytes = (pdo['bits'] + 7) // 8
+                pdos.append({'node_id': node_id,
+                             'direction': kind,
+                             'number': number,
+                             'cob_id': base + 0x100 * (number - 1) + node_id,
+                             'objects': [(Epos.objectIndex[s['name']], s['subindex'], s['bits'])
+                                         for s in pdo['signals']],
+                             'signals': [s['name'] if not s['subindex'] else
+                                         '{0} sub {1}'.format(s['name'], s['subindex'])
+                                         for s in pdo['signals']],
+                             'rate': rate,
+                             'transmission_type': transmission_type,
+                             'inhibit_time': inhibit_time,
+                             'bytes': n_bytes,
+                             'load': self._load(rate, n_bytes)})
+        load = sum(pdo['load'] for pdo in pdos)
+        if self.sync_rate:
+            load += self._load(self.sync_rate, 0)
+        if load > self.max_load:
+            errors.append('Bus load {0:.1%} exceeds maximum of {1:.1%}'.format(load, self.max_load))
+        return {'pdos': pdos, 'load': load, 'errors': errors}, not errors
+
+
+def apply_plan(plan, axes, disable_unused=True):
+    """Configure PDOs of devices as planned
+
+    Nothing is written if the plan has errors. Devices are left in
+    operational NMT state, even if configuring their PDOs fails.
+
+    Args:
+        plan: plan returned by :func:`PdoPlanner.plan`.
+        axes: list of :class:`epos.Epos` devices, at least those in plan.
+        disable_unused (optional): disable PDOs not used by plan. Default True.
+    Returns:
+        bool: A boolean if all requests went ok or not.
+    """
+    if plan['errors']:
+        for error in plan['errors']:
+            _logger.info(error)
+        return False
+    for epos in axes:
+        pdos = [pdo for pdo in plan['pdos'] if pdo['node_id'] == epos.node.id]
+        if not pdos and not disable_unused:
+            continue
+        if not epos.change_nmt_state('PRE-OPERATIONAL'):
+            return False
+        ok = _apply_node(epos, pdos, disable_unused)
+        if not epos.change_nmt_state('OPERATIONAL') or not ok:
+            return False
+    return True
+
+
+def _apply_node(epos, pdos, disable_unused):
+    """Configure PDOs of one device, in pre-operational state
+    """
+    for kind in ('tpdo', 'rpdo'):
+        for number in range(1, PDOS_PER_NODE + 1):
+            pdo = next((p for p in pdos if p['direction'] == kind and p['number'] == number),
+                       None)
+            if pdo is None:
+                if not disable_unused:
+                    continue
+                pdo = {'objects': [], 'transmission_type': 255, 'inhibit_time': None}
+            if kind == 'tpdo':
+                ok = epos.configure_tpdo(number, pdo['objects'],
+                                         transmission_type=pdo['transmission_type'],
+                                         inhibit_time=pdo['inhibit_time'] or 0)
+            else:
+                ok = epos.configure_rpdo(number, pdo['objects'],
+                                         transmission_type=pdo['transmission_type'])
+            if not ok:
+                epos.log_info('Failed to configure {0} {1}'.format(kind.upper(), number))
+                return False
+    return True
+
+
+def print_plan(plan):
+    """Print PDOs and bus load of a plan
+    """
+    print('--------------------------------------------------------------')
+    for pdo in plan['pdos']:
+        transmission = 'SYNC/{0}'.format(pdo['transmission_type']) \
+            if pdo['transmission_type'] <= 240 else 'event'
+        if pdo['inhibit_time']:
+            transmission += ' inhibit {0}x100us'.format(pdo['inhibit_time'])
+        print('Node {0} {1}{2} [0x{3:03X}] {4} bytes @ {5:g} Hz, {6}, load {7:.2%}'.format(
+            pdo['node_id'], pdo['direction'].upper(), pdo['number'], pdo['cob_id'],
+            pdo['bytes'], pdo['rate'], transmission, pdo['load']))
+        for name in pdo['signals']:
+            print('    {0}'.format(name))
+    print('Total bus load: {0:.2%}'.format(plan['load']))
+    for error in plan['errors']:
+        print('Error: {0}'.format(error))
+    print('--------------------------------------------------------------')
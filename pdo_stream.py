@@ -0,0 +1,369 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import struct
+import threading
+import time
+import numpy as np
+from telemetry import TelemetryBuffer
+
+# struct format for each size of mapped object, in bits
+_FORMATS = {(8, True): 'b', (8, False): 'B', (16, True): 'h', (16, False): 'H',
+            (32, True): 'i', (32, False): 'I'}
+
+
+class PdoStream:
+    """Stream a command to a device by RPDO with feedback by TPDO
+
+    The command object is mapped to a receive PDO and each value is sent as
+    a single CAN frame, packed with a precompiled ``struct.Struct``, without
+    any SDO request or reply. The feedback objects are mapped to a transmit
+    PDO sent by the device whenever they change, limited by the inhibit
+    time, and the latest values are kept in :attr:`feedback`.
+
+    Objects are described by tuples (name, bit length, signed), where name
+    is a key of :attr:`epos.Epos.objectIndex`.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        op_mode: operation mode used while streaming.
+        command: object receiving the command.
+        feedback: list of objects sent back by device.
+        rpdo (optional): number of RPDO used for command. Default 1.
+        tpdo (optional): number of TPDO used for feedback. Default 2.
+        inhibit_time (optional): minimum time between feedback TPDOs [100us]. Default 10.
+    """
+
+    def __init__(self, epos, op_mode, command, feedback, rpdo=1, tpdo=2, inhibit_time=10):
+        self.epos = epos
+        self.op_mode = op_mode
+        self.command = command
+        self.feedback_objects = feedback
+        self.rpdo = rpdo
+        self.tpdo = tpdo
+        self.inhibit_time = inhibit_time
+        self.logger = logging.getLogger('STREAM')
+        name, bits, signed = command
+        self._command_struct = struct.Struct('<' + _FORMATS[(bits, signed)])
+        self._feedback_struct = struct.Struct('<' + ''.join(
+            _FORMATS[(bits, signed)] for _, bits, signed in feedback))
+        self._cob_id = None
+        self._feedback_cob_id = None
+        # latest feedback values by name and time they were received
+        self.feedback = {}
+        self.feedback_time = None
+        self.telemetry = None
+        self.running = False
+
+    def _mapping(self, objects):
+        return [(self.epos.objectIndex[name], 0, bits) for name, bits, _ in objects]
+
+    def start(self):
+        """Configure PDOs and operation mode and start receiving feedback
+
+        Device is left in operational NMT state. It should be in operation
+        enabled state before commands are sent.
+
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        epos = self.epos
+        if not epos.change_nmt_state('PRE-OPERATIONAL'):
+            return False
+        if not epos.configure_rpdo(self.rpdo, self._mapping([self.command])):
+            self.logger.info('Failed to configure command RPDO')
+            return False
+        if not epos.configure_tpdo(self.tpdo, self._mapping(self.feedback_objects),
+                                   inhibit_time=self.inhibit_time):
+            self.logger.info('Failed to configure feedback TPDO')
+            return False
+        if epos._op_mode != self.op_mode and not epos.set_op_mode(self.op_mode):
+            self.logger.info('Failed to set operation mode {0}'.format(self.op_mode))
+            return False
+        self._cob_id = epos.rpdo_cob_id(self.rpdo)
+        self._feedback_cob_id = epos.tpdo_cob_id(self.tpdo)
+        epos.network.subscribe(self._feedback_cob_id, self._on_feedback)
+        self.running = True
+        return epos.change_nmt_state('OPERATIONAL')
+
+    def stop(self):
+        """Send a null command and stop receiving feedback
+        """
+        if not self.running:
+            return
+        # null command is never filtered by subclasses
+        PdoStream.send(self, 0)
+        self.epos.network.unsubscribe(self._feedback_cob_id, self._on_feedback)
+        self.running = False
+
+    def send(self, value):
+        """Send one command in a single RPDO frame
+
+        Args:
+            value: command value, in the units of the command object.
+        Returns:
+            int: the value sent.
+        """
+        value = int(value)
+        self.epos.network.send_message(self._cob_id, self._command_struct.pack(value))
+        return value
+
+    def _on_feedback(self, can_id, data, timestamp):
+        """Unpack feedback TPDO
+        """
+        values = self._feedback_struct.unpack_from(data)
+        self.feedback = dict(zip((name for name, _, _ in self.feedback_objects), values))
+        self.feedback_time = timestamp
+
+    def run(self, command, rate=500, duration=None, exit_flag=None):
+        """Stream commands at a fixed rate
+
+        Deadlines are absolute, so the rate does not drift with the time spent
+        on each cycle. On every cycle the command and the latest feedback are
+        stored in :attr:`telemetry`, a ring :class:`telemetry.TelemetryBuffer`.
+
+        Args:
+            command: function of time since start [s] returning the command.
+            rate (optional): frequency of commands [Hz]. Default 500.
+            duration (optional): time to stream [s], None to run until exit_flag is set.
+            exit_flag (optional): threading.Event() to stop streaming.
+        Returns:
+            dict: number of cycles, overruns and mean and max lateness of cycles [s].
+        """
+        if not self.running:
+            self.logger.info('Stream is not started')
+            return None
+        if exit_flag is None:
+            exit_flag = threading.Event()
+        columns = [('t', 'float64'), ('command', 'float64')]
+        columns.extend((name, 'float64') for name, _, _ in self.feedback_objects)
+        self.telemetry = TelemetryBuffer(columns, capacity=max(int(rate * 60), 1), ring=True)
+        late = TelemetryBuffer([('late', 'float64')], capacity=max(int(rate * 60), 1), ring=True)
+        names = [name for name, _, _ in self.feedback_objects]
+        period = 1.0 / rate
+        overruns = 0
+        cycles = 0
+        t0 = time.monotonic()
+        deadline = t0
+        while not exit_flag.is_set():
+            now = time.monotonic()
+            t = now - t0
+            if duration is not None and t >= duration:
+                break
+            late.append(now - deadline)
+            value = self.send(command(t))
+            feedback = self.feedback
+            self.telemetry.append(t, value, *(feedback.get(name, np.nan) for name in names))
+            cycles += 1
+            deadline += period
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            elif remaining < -period:
+                overruns += 1
+                deadline = time.monotonic()
+        lateness = late['late']
+        return {'cycles': cycles,
+                'overruns': overruns,
+                'mean_late': float(np.mean(lateness)) if cycles else 0.0,
+                'max_late': float(np.max(lateness)) if cycles else 0.0}
+
+
+class VelocityStream(PdoStream):
+    """Stream velocity commands for a traction axis
+
+    Two operation modes are available:
+
+    * **velocity** - Velocity Mode (-2), the command is written to
+      'VelocityMode Setting Value' (0x206B) and followed immediately.
+    * **profile velocity** - Profile Velocity Mode (3), the command is
+      written to 'TargetVelocity' (0x60FF) and reached with the profile
+      acceleration and deceleration of the device.
+
+    The feedback is 'Velocity Actual Value Averaged' (0x2028) and the
+    statusword. Commands and feedback are in rpm.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        mode (optional): 'velocity' or 'profile velocity'. Default 'velocity'.
+        rpdo (optional): number of RPDO used for command. Default 1.
+        tpdo (optional): number of TPDO used for feedback. Default 2.
+        inhibit_time (optional): minimum time between feedback TPDOs [100us]. Default 10.
+    """
+    modes = {'velocity': (-2, 'VelocityMode Setting Value'),
+             'profile velocity': (3, 'TargetVelocity')}
+
+    def __init__(self, epos, mode='velocity', rpdo=1, tpdo=2, inhibit_time=10):
+        if mode not in self.modes:
+            raise ValueError('Unknown velocity mode: {0}'.format(mode))
+        op_mode, name = self.modes[mode]
+        PdoStream.__init__(self, epos, op_mode, (name, 32, True),
+                           [('Velocity Actual Value Averaged', 32, True),
+                            ('StatusWord', 16, False)],
+                           rpdo=rpdo, tpdo=tpdo, inhibit_time=inhibit_time)
+        self.mode = mode
+
+    @property
+    def velocity(self):
+        """int: latest averaged velocity received [rpm] or None."""
+        return self.feedback.get('Velocity Actual Value Averaged')
+
+
+class CurrentLimiter:
+    """Limit current commands on the host
+
+    Three limits are applied to each command, in this order:
+
+    * **thermal** - the square of the current is filtered with the thermal
+      time constant of the winding, a first order I²t model. While it is
+      above the square of the continuous current, commands are limited to
+      the continuous current instead of the peak current.
+    * **peak** - commands are clamped to the peak current.
+    * **slew rate** - the change between consecutive commands is limited.
+
+    The limiter keeps only a few floats as state, so it can run on every
+    cycle of a fast loop.
+
+    Args:
+        peak_current: maximum current [mA].
+        continuous_current (optional): maximum continuous current [mA], None to disable thermal limit.
+        slew_rate (optional): maximum rate of change of current [mA/s], None to disable.
+        time_constant (optional): thermal time constant of winding [s]. Default 4.0.
+    """
+
+    def __init__(self, peak_current, continuous_current=None, slew_rate=None, time_constant=4.0):
+        self.peak_current = peak_current
+        self.continuous_current = continuous_current
+        self.slew_rate = slew_rate
+        self.time_constant = time_constant
+        self.reset()
+
+    def reset(self):
+        """Forget last command, thermal state and statistics
+        """
+        self.last = 0.0
+        # filtered square of current [mA²]
+        self.heat = 0.0
+        self.limited = 0
+
+    def limit(self, current, dt):
+        """Limit a current command
+
+        Args:
+            current: desired current [mA].
+            dt: time since last command [s].
+        Returns:
+            float: current to be applied [mA].
+        """
+        limit = self.peak_current
+        if self.continuous_current is not None:
+            # heat produced by the last command during dt
+            self.heat += (self.last * self.last - self.heat) * min(dt / self.time_constant, 1.0)
+            if self.heat >= self.continuous_current * self.continuous_current:
+                limit = self.continuous_current
+        value = min(max(current, -limit), limit)
+        if self.slew_rate is not None:
+            step = self.slew_rate * dt
+            value = min(max(value, self.last - step), self.last + step)
+        if value != current:
+            self.limited += 1
+        self.last = value
+        return value
+
+
+class CurrentStream(PdoStream):
+    """Stream current commands for a torque loop
+
+    The device runs in Current Mode (-3) and the command is written to
+    'CurrentMode Setting Value' (0x2030). The feedback is the actual
+    current (0x6078), the averaged current (0x2027) and the statusword.
+    Every command goes through a :class:`CurrentLimiter` before it is sent.
+    Commands and feedback are in mA.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        limiter (optional): a :class:`CurrentLimiter`. If None, one is created
+            on :func:`start` from the motor configuration of the device.
+        rpdo (optional): number of RPDO used for command. Default 1.
+        tpdo (optional): number of TPDO used for feedback. Default 2.
+        inhibit_time (optional): minimum time between feedback TPDOs [100us]. Default 10.
+    """
+
+    def __init__(self, epos, limiter=None, rpdo=1, tpdo=2, inhibit_time=10):
+        PdoStream.__init__(self, epos, -3, ('CurrentMode Setting Value', 16, True),
+                           [('Current Actual Value', 16, True),
+                            ('Current Actual Value Averaged', 16, True),
+                            ('StatusWord', 16, False)],
+                           rpdo=rpdo, tpdo=tpdo, inhibit_time=inhibit_time)
+        self.limiter = limiter
+        self._last_send = None
+
+    def start(self):
+        """Configure PDOs and operation mode and start receiving feedback
+
+        See :func:`PdoStream.start`.
+
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        if self.limiter is None:
+            motor_config, ok = self.epos.read_motor_config()
+            if not ok:
+                self.logger.info('Failed to read motor configuration for current limiter')
+                return False
+            self.limiter = CurrentLimiter(motor_config['maxCurrentLimit'],
+                                          motor_config['currentLimit'],
+                                          time_constant=motor_config['thermalTimeConstant'] * 0.1)
+        self._last_send = None
+        return PdoStream.start(self)
+
+    def stop(self):
+        """Send a null current and stop receiving feedback
+        """
+        PdoStream.stop(self)
+        self.limiter.last = 0.0
+        self._last_send = None
+
+    def send(self, value):
+        """Limit a current command and send it in a single RPDO frame
+
+        Args:
+            value: desired current [mA].
+        Returns:
+            int: the current sent [mA].
+        """
+        now = time.monotonic()
+        dt = now - self._last_send if self._last_send is not None else 0.0
+        self._last_send = now
+        return PdoStream.send(self, round(self.limiter.limit(value, dt)))
+
+    @property
+    def current(self):
+        """int: latest actual current received [mA] or None."""
+        return self.feedback.get('Current Actual Value')
+
+    @property
+    def current_averaged(self):
+        """int: latest averaged current received [mA] or None."""
+        return self.feedback.get('Current Actual Value Averaged')
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import math
+import os
+import threading
+import time
+
+# heartbeat state of an operational node
+_OPERATIONAL = b'\x05'
+
+
+class HeartbeatSupervisor:
+    """Mutual supervision of host and device by heartbeats
+
+    The device is configured to consume heartbeats of the host (0x1016), so
+    it goes to fault state by itself if the host stops, and to produce its
+    own heartbeats (0x1017). Node guarding (0x100C, 0x100D) is disabled, as
+    it should not be used together with heartbeats.
+
+    Host heartbeats are sent by a dedicated thread with absolute deadlines,
+    raised to real time priority when the system allows it. If a loop
+    timeout is given, heartbeats are only sent while the control loop calls
+    :func:`kick` in time, so a stalled loop, and not only a stalled
+    process, stops the device.
+
+    Heartbeats of the device are tracked with interval statistics and a
+    callback is called if they stop.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        host_id (optional): node ID used by host heartbeats. Default 127.
+        host_period (optional): time between host heartbeats [ms]. Default 50.
+        consumer_time (optional): time without host heartbeat before device faults [ms]. Default 150.
+        drive_period (optional): time between device heartbeats [ms]. Default 50.
+        loop_timeout (optional): maximum time between kicks of control loop [s], None to disable.
+        on_lost (optional): function on_lost(supervisor) called when device heartbeats stop.
+        priority (optional): SCHED_FIFO priority of producer thread. Default 50.
+    """
+
+    def __init__(self, epos, host_id=127, host_period=50, consumer_time=150, drive_period=50,
+                 loop_timeout=None, on_lost=None, priority=50):
+        self.epos = epos
+        self.host_id = host_id
+        self.host_period = host_period
+        self.consumer_time = consumer_time
+        self.drive_period = drive_period
+        self.loop_timeout = loop_timeout
+        self.on_lost = on_lost
+        self.priority = priority
+        self.logger = logging.getLogger('SUPERVISOR')
+        self.running = False
+        self.drive_lost = threading.Event()
+        self._exit_flag = threading.Event()
+        self._thread = None
+        self._last_kick = time.monotonic()
+        self._frame = _OPERATIONAL
+        self._cob_id = 0x700 + host_id
+        self._drive_cob_id = None
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        """Clear heartbeat statistics
+        """
+        self.drive_count = 0
+        self.drive_state = None
+        self._drive_last = None
+        self._interval_sum = 0.0
+        self._interval_sum2 = 0.0
+        self._interval_max = 0.0
+        self._drive_late = 0
+        self.host_sent = 0
+        self.host_skipped = 0
+        self._late_sum = 0.0
+        self._late_max = 0.0
+
+    def statistics(self):
+        """Statistics of host and device heartbeats
+
+        Lateness of a device heartbeat is the interval since the previous one
+        minus the configured period.
+
+        Returns:
+            dict: with keys 'drive' and 'host'. 'drive' holds number of
+            heartbeats, last NMT state code, mean, standard deviation and
+            maximum interval [s] and number of heartbeats later than half a
+            period. 'host' holds heartbeats sent, heartbeats skipped because
+            the loop stalled and mean and max lateness of producer thread [s].
+        """
+        intervals = self.drive_count - 1
+        mean = self._interval_sum / intervals if intervals > 0 else 0.0
+        variance = self._interval_sum2 / intervals - mean * mean if intervals > 0 else 0.0
+        return {'drive': {'count': self.drive_count,
+                          'state': self.drive_state,
+                          'mean_interval': mean,
+                          'std_interval': math.sqrt(max(variance, 0.0)),
+                          'max_interval': self._interval_max,
+                          'late': self._drive_late},
+                'host': {'sent': self.host_sent,
+                         'skipped': self.host_skipped,
+                         'mean_late': self._late_sum / self.host_sent if self.host_sent else 0.0,
+                         'max_late': self._late_max}}
+
+    def configure(self):
+        """Configure heartbeats of device and disable node guarding
+
+        Returns:
+            bool: A boolean if all went as expected or not.
+        """
+        epos = self.epos
+        if not epos.set_node_guarding(0, 0):
+            return False
+        if not epos.set_producer_heartbeat(self.drive_period):
+            self.logger.info('Failed to set producer heartbeat time')
+            return False
+        if not epos.set_consumer_heartbeat(self.host_id, self.consumer_time):
+            self.logger.info('Failed to set consumer heartbeat time')
+            return False
+        return True
+
+    def start(self):
+        """Start host heartbeats, then configure device to supervise them
+
+        Returns:
+            bool: A boolean if all went as expected or not.
+        """
+        if self.running:
+            return True
+        self._drive_cob_id = 0x700 + self.epos.node.id
+        self.drive_lost.clear()
+        self._last_kick = time.monotonic()
+        self.epos.network.subscribe(self._drive_cob_id, self._on_heartbeat)
+        self._exit_flag.clear()
+        self._thread = threading.Thread(name='HEARTBEAT', target=self._producer, daemon=True)
+        self._thread.start()
+        self.running = True
+        if not self.configure():
+            self.stop(disarm=False)
+            return False
+        return True
+
+    def stop(self, disarm=True):
+        """Stop host heartbeats
+
+        Args:
+            disarm (optional): disable supervision by device first, so it does not fault. Default True.
+        """
+        if not self.running:
+            return
+        if disarm and not self.epos.set_consumer_heartbeat(self.host_id, 0):
+            self.logger.info('Failed to disable consumer heartbeat, device will fault')
+        self._exit_flag.set()
+        self._thread.join()
+        self._thread = None
+        self.epos.network.unsubscribe(self._drive_cob_id, self._on_heartbeat)
+        self.running = False
+
+    def kick(self):
+        """Signal that the control loop is alive
+
+        Only needed if a loop timeout was given.
+        """
+        self._last_kick = time.monotonic()
+
+    def _on_heartbeat(self, can_id, data, timestamp):
+        self.drive_state = data[0]
+        if self._drive_last is not None:
+            interval = timestamp - self._drive_last
+            self._interval_sum += interval
+            self._interval_sum2 += interval * interval
+            if interval > self._interval_max:
+                self._interval_max = interval
+            if interval > 1.5e-3 * self.drive_period:
+                self._drive_late += 1
+        self._drive_last = timestamp
+        self.drive_count += 1
+
+    def _raise_priority(self):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        except (AttributeError, OSError) as e:
+            self.logger.debug('Heartbeat thread keeps normal priority: {0}'.format(e))
+
+    def _producer(self):
+        self._raise_priority()
+        period = self.host_period * 1e-3
+        # device is lost after missing two heartbeats
+        drive_timeout = 2.5e-3 * self.drive_period
+        started = time.time()
+        deadline = time.monotonic()
+        while not self._exit_flag.is_set():
+            now = time.monotonic()
+            late = now - deadline
+            if self.loop_timeout is not None and now - self._last_kick > self.loop_timeout:
+                self.host_skipped += 1
+            else:
+                self.epos.network.send_message(self._cob_id, self._frame)
+                self.host_sent += 1
+                self._late_sum += late
+                if late > self._late_max:
+                    self._late_max = late
+            last = self._drive_last if self._drive_last is not None else started
+            if self.drive_period and not self.drive_lost.is_set() and \
+                    time.time() - last > drive_timeout:
+                self.drive_lost.set()
+                self.logger.info('Heartbeats of device stopped')
+                if self.on_lost is not None:
+                    self.on_lost(self)
+            deadline += period
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                self._exit_flag.wait(remaining)
+            else:
+                deadline = time.monotonic()
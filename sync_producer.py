@@ -0,0 +1,408 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import math
+import os
+import threading
+import time
+from epos import Epos
+from pdo_planner import SIGNED
+
+_logger = logging.getLogger('SYNC')
+
+# object names by index, to name values of snapshots
+_OBJECT_NAMES = dict((index, name) for name, index in Epos.objectIndex.items())
+
+
+def _layout(objects):
+    """Name, byte offset, size and sign of each mapped object
+    """
+    layout = []
+    offset = 0
+    for index, subindex, bits in objects:
+        name = _OBJECT_NAMES.get(index, '0x{0:04X}'.format(index))
+        signed = (name, subindex) in SIGNED
+        if subindex != 0:
+            name = '{0} sub {1}'.format(name, subindex)
+        layout.append((name, offset, bits // 8, signed))
+        offset += bits // 8
+    return layout
+
+
+def configure_sync(epos, tpdos=None, rpdos=None, cycles=1, cob_id=0x80):
+    """Configure synchronous PDOs of a device
+
+    TPDOs are sampled and sent by the device every cycles SYNC messages and
+    RPDOs are applied on the SYNC following their reception, so all devices
+    sharing the SYNC sample and apply setpoints on the same edge. The
+    device is left in operational NMT state.
+
+    Args:
+        epos: a connected :class:`epos.Epos`.
+        tpdos (optional): dict with a list of tuples (index, subindex, bit length) by TPDO number.
+        rpdos (optional): dict with a list of tuples (index, subindex, bit length) by RPDO number.
+        cycles (optional): number of SYNC messages between TPDOs, from 1 to 240. Default 1.
+        cob_id (optional): COB-ID of SYNC messages. Default 0x80.
+    Returns:
+        bool: A boolean if all requests went ok or not.
+    """
+    if cycles < 1 or cycles > 240:
+        epos.log_info('Invalid number of SYNC cycles: {0}'.format(cycles))
+        return False
+    if not epos.change_nmt_state('PRE-OPERATIONAL'):
+        return False
+    if not epos.set_sync_cob_id(cob_id):
+        epos.log_info('Failed to set SYNC COB-ID')
+        return False
+    for pdo_number, objects in (tpdos or {}).items():
+        if not epos.configure_tpdo(pdo_number, objects, transmission_type=cycles):
+            epos.log_info('Failed to configure synchronous TPDO {0}'.format(pdo_number))
+            return False
+    for pdo_number, objects in (rpdos or {}).items():
+        if not epos.configure_rpdo(pdo_number, objects, transmission_type=1):
+            epos.log_info('Failed to configure synchronous RPDO {0}'.format(pdo_number))
+            return False
+    return epos.change_nmt_state('OPERATIONAL')
+
+
+class SyncProducer:
+    """SYNC producer of host with cycle snapshots of synchronous TPDOs
+
+    SYNC messages are sent by a dedicated thread at absolute deadlines,
+    raised to real time priority when the system allows it. The thread
+    sleeps until shortly before each deadline and spins for the rest, so
+    the jitter is not limited by the resolution of the sleep. Deadlines
+    missed by more than a period are skipped, keeping the phase of the
+    cycle.
+
+    Devices added with :func:`add_node` are configured by
+    :func:`configure_sync`. TPDOs they send in reply to a SYNC are
+    collected and, at the next SYNC, published as one snapshot of the
+    cycle, read with :func:`wait_cycle` or passed to on_cycle. Setpoints
+    sent with :func:`send_rpdo` during a cycle are applied by every device
+    on the next SYNC.
+
+    Exceptions raised by on_cycle or by sending a SYNC are logged and
+    counted in :func:`statistics`, and SYNC messages keep being sent, so
+    devices never hold a setpoint because of a failed cycle. If the
+    producer thread stops for any other reason, :attr:`running` is
+    cleared, :attr:`failed` is set and :func:`wait_cycle` returns at once.
+
+    EPOS has no synchronous window length object (0x1007), so the window
+    is supervised on the host. It counts the cycles where on_cycle did not
+    return within the window after SYNC.
+
+    Args:
+        network: a connected canopen.Network.
+        period: time between SYNC messages [s].
+        cob_id (optional): COB-ID of SYNC messages. Default 0x80.
+        window (optional): time after SYNC to send setpoints [s]. Default half the period.
+        on_cycle (optional): function on_cycle(cycle, snapshot) called after each SYNC.
+        spin (optional): time spent spinning before each deadline [s]. Default 0.0005.
+        priority (optional): SCHED_FIFO priority of producer thread. Default 50.
+    """
+
+    def __init__(self, network, period, cob_id=0x80, window=None, on_cycle=None,
+                 spin=0.0005, priority=50):
+        self.network = network
+        self.period = period
+        self.cob_id = cob_id
+        self.window = window if window is not None else period / 2
+        self.on_cycle = on_cycle
+        self.spin = spin
+        self.priority = priority
+        self.running = False
+        self.failed = threading.Event()
+        self.cycle = 0
+        self.snapshot = {}
+        self._exit_flag = threading.Event()
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._thread = None
+        # TPDO layouts by COB-ID and RPDO layouts by (node_id, pdo_number)
+        self._tpdos = {}
+        self._rpdos = {}
+        self._pending = {}
+        self._received = set()
+        self._sync_time = None
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        """Clear timing statistics
+        """
+        self.sent = 0
+        self.skipped = 0
+        self.window_overruns = 0
+        self.send_errors = 0
+        self.callback_errors = 0
+        self.incomplete = 0
+        self._late_sum = 0.0
+        self._late_sum2 = 0.0
+        self._late_max = 0.0
+        self._last_sent = None
+        self._interval_sum = 0.0
+        self._interval_sum2 = 0.0
+        self._interval_max = 0.0
+        self._response_count = 0
+        self._response_sum = 0.0
+        self._response_max = 0.0
+
+    def statistics(self):
+        """Timing statistics of SYNC messages and synchronous TPDOs
+
+        Lateness is the time a SYNC was sent after its deadline and jitter
+        the standard deviation of the interval between SYNC messages.
+        Response is the time from SYNC to the reception of each TPDO.
+
+        Returns:
+            dict: SYNC messages sent, deadlines skipped, mean, standard
+            deviation and maximum lateness [s], jitter, mean and maximum
+            interval [s], window overruns, incomplete snapshots, mean and
+            maximum response [s] and errors sending SYNC and in on_cycle.
+        """
+        sent = self.sent
+        late_mean = self._late_sum / sent if sent else 0.0
+        late_var = self._late_sum2 / sent - late_mean * late_mean if sent else 0.0
+        intervals = sent - 1
+        mean = self._interval_sum / intervals if intervals > 0 else 0.0
+        variance = self._interval_sum2 / intervals - mean * mean if intervals > 0 else 0.0
+        responses = self._response_count
+        return {'sent': sent,
+                'skipped': self.skipped,
+                'mean_late': late_mean,
+                'std_late': math.sqrt(max(late_var, 0.0)),
+                'max_late': self._late_max,
+                'jitter': math.sqrt(max(variance, 0.0)),
+                'mean_interval': mean,
+                'max_interval': self._interval_max,
+                'window_overruns': self.window_overruns,
+                'incomplete': self.incomplete,
+                'mean_response': self._response_sum / responses if responses else 0.0,
+                'max_response': self._response_max,
+                'send_errors': self.send_errors,
+                'callback_errors': self.callback_errors}
+
+    def add_node(self, epos, tpdos=None, rpdos=None, cycles=1):
+        """Configure synchronous PDOs of a device and collect its TPDOs
+
+        Args:
+            epos: a connected :class:`epos.Epos`.
+            tpdos (optional): dict with a list of tuples (index, subindex, bit length) by TPDO number.
+            rpdos (optional): dict with a list of tuples (index, subindex, bit length) by RPDO number.
+            cycles (optional): number of SYNC messages between TPDOs. Default 1.
+        Returns:
+            bool: A boolean if all requests went ok or not.
+        """
+        if not configure_sync(epos, tpdos, rpdos, cycles, self.cob_id):
+            return False
+        node_id = epos.node.id
+        for pdo_number, objects in (tpdos or {}).items():
+            cob_id = epos.tpdo_cob_id(pdo_number)
+            if cob_id not in self._tpdos:
+                self.network.subscribe(cob_id, self._on_tpdo)
+            self._tpdos[cob_id] = (node_id, _layout(objects), cycles)
+        for pdo_number, objects in (rpdos or {}).items():
+            self._rpdos[(node_id, pdo_number)] = (epos.rpdo_cob_id(pdo_number), objects)
+        return True
+
+    def remove_node(self, epos):
+        """Stop collecting TPDOs of a device
+
+        The PDOs of the device are left configured.
+        """
+        node_id = epos.node.id
+        for cob_id, (tpdo_node_id, _, _) in list(self._tpdos.items()):
+            if tpdo_node_id == node_id:
+                self.network.unsubscribe(cob_id, self._on_tpdo)
+                del self._tpdos[cob_id]
+        for key in [key for key in self._rpdos if key[0] == node_id]:
+            del self._rpdos[key]
+
+    def send_rpdo(self, node_id, pdo_number, *values):
+        """Send values of a synchronous RPDO, applied on next SYNC
+
+        Args:
+            node_id: node ID of device.
+            pdo_number: number of RPDO, as given to :func:`add_node`.
+            values: one value per mapped object, in order of mapping.
+        """
+        cob_id, objects = self._rpdos[(node_id, pdo_number)]
+        data = b''.join(int(value).to_bytes(bits // 8, 'little', signed=value < 0)
+                        for value, (_, _, bits) in zip(values, objects))
+        self.network.send_message(cob_id, data)
+
+    def _on_tpdo(self, can_id, data, timestamp):
+        entry = self._tpdos.get(can_id)
+        if entry is None:
+            return
+        node_id, layout, _ = entry
+        values = {name: int.from_bytes(data[offset:offset + size], 'little', signed=signed)
+                  for name, offset, size, signed in layout}
+        with self._lock:
+            self._pending.setdefault(node_id, {}).update(values)
+            self._received.add(can_id)
+            sync_time = self._sync_time
+        if sync_time is not None:
+            response = timestamp - sync_time
+            self._response_count += 1
+            self._response_sum += response
+            if response > self._response_max:
+                self._response_max = response
+
+    def wait_cycle(self, timeout=None):
+        """Wait for the snapshot of next cycle
+
+        Args:
+            timeout (optional): maximum time to wait [s].
+        Returns:
+            tuple: A tuple containing:
+
+            :cycle: number of cycle of snapshot, None on timeout or if producer failed.
+            :snapshot: dict with the values of each node ID, by object name.
+        """
+        with self._condition:
+            cycle = self.cycle
+            if not self._condition.wait_for(
+                    lambda: self.cycle != cycle or self.failed.is_set(), timeout) \
+                    or self.cycle == cycle:
+                return None, {}
+            return self.cycle - 1, self.snapshot
+
+    def start(self):
+        """Start sending SYNC messages
+
+        Returns:
+            bool: A boolean if all went as expected or not.
+        """
+        if self.running:
+            return True
+        if self.period <= 0:
+            _logger.info('Invalid SYNC period: {0}'.format(self.period))
+            return False
+        self._exit_flag.clear()
+        self.failed.clear()
+        self._thread = threading.Thread(name='SYNC', target=self._producer, daemon=True)
+        self._thread.start()
+        self.running = True
+        return True
+
+    def stop(self):
+        """Stop sending SYNC messages and collecting TPDOs
+        """
+        if self._thread is not None:
+            self._exit_flag.set()
+            self._thread.join()
+            self._thread = None
+            self.running = False
+        for cob_id in list(self._tpdos):
+            self.network.unsubscribe(cob_id, self._on_tpdo)
+        self._tpdos = {}
+
+    def _raise_priority(self):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        except (AttributeError, OSError) as e:
+            _logger.debug('SYNC thread keeps normal priority: {0}'.format(e))
+
+    def _publish(self):
+        """Make TPDOs received since previous SYNC the snapshot of its cycle
+        """
+        with self._lock:
+            snapshot = self._pending
+            received = self._received
+            self._pending = {}
+            self._received = set()
+        expected = [cob_id for cob_id, (_, _, cycles) in self._tpdos.items() if cycles == 1]
+        if self.sent > 1 and any(cob_id not in received for cob_id in expected):
+            self.incomplete += 1
+        with self._condition:
+            self.snapshot = snapshot
+            self.cycle += 1
+            self._condition.notify_all()
+        return snapshot
+
+    def _send_sync(self, late):
+        now = time.monotonic()
+        with self._lock:
+            self._sync_time = time.time()
+        try:
+            self.network.send_message(self.cob_id, b'')
+        except Exception as e:
+            self.send_errors += 1
+            _logger.info('Failed to send SYNC: {0}'.format(e))
+            return None
+        self.sent += 1
+        self._late_sum += late
+        self._late_sum2 += late * late
+        if late > self._late_max:
+            self._late_max = late
+        if self._last_sent is not None:
+            interval = now - self._last_sent
+            self._interval_sum += interval
+            self._interval_sum2 += interval * interval
+            if interval > self._interval_max:
+                self._interval_max = interval
+        self._last_sent = now
+        return now
+
+    def _producer(self):
+        try:
+            self._run()
+        except Exception as e:
+            _logger.info('SYNC producer stopped: {0}'.format(e))
+        finally:
+            if not self._exit_flag.is_set():
+                self.running = False
+                self.failed.set()
+                with self._condition:
+                    self._condition.notify_all()
+
+    def _run(self):
+        self._raise_priority()
+        period = self.period
+        deadline = time.monotonic() + period
+        while not self._exit_flag.is_set():
+            # sleep until shortly before deadline, then spin
+            remaining = deadline - time.monotonic() - self.spin
+            if remaining > 0 and self._exit_flag.wait(remaining):
+                break
+            while time.monotonic() < deadline:
+                pass
+            sent = self._send_sync(time.monotonic() - deadline)
+            if sent is not None:
+                snapshot = self._publish()
+                if self.on_cycle is not None:
+                    try:
+                        self.on_cycle(self.cycle - 1, snapshot)
+                    except Exception as e:
+                        self.callback_errors += 1
+                        _logger.info('Exception caught in on_cycle: {0}'.format(e))
+                    if time.monotonic() - sent > self.window:
+                        self.window_overruns += 1
+            deadline += period
+            late = time.monotonic() - deadline
+            if late > period:
+                missed = int(late // period)
+                self.skipped += missed
+                deadline += missed * period
@@ -0,0 +1,325 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import struct
+import time
+import numpy as np
+
+
+class TelemetryBuffer:
+    """Preallocated columnar storage for samples acquired in control loops
+
+    Each column is stored in its own preallocated NumPy array, so appending
+    a sample is a constant time operation. Two modes are available:
+
+    * **growable** (default) - when full, the capacity is doubled, which
+      gives an amortised constant cost per sample.
+    * **ring** - the capacity is fixed and the oldest samples are
+      overwritten. Every sample is written twice in a storage of twice the
+      capacity, so the last samples are always contiguous in memory.
+
+    In both modes :func:`column` returns a view without copying data, which
+    can be handed directly to matplotlib. Views of a growable buffer keep
+    pointing to the old storage after the buffer grows, so request them
+    again after appending.
+
+    Args:
+        columns: list of tuples (name, dtype) describing each column.
+        capacity (optional): initial number of samples. Default 1024.
+        ring (optional): use ring buffer semantics. Default False.
+    """
+
+    def __init__(self, columns, capacity=1024, ring=False):
+        if capacity < 1:
+            raise ValueError('Capacity must be positive: {0}'.format(capacity))
+        self.names = tuple(name for name, _ in columns)
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in columns}
+        self.capacity = capacity
+        self.ring = ring
+        size = 2 * capacity if ring else capacity
+        self._data = {name: np.zeros(size, dtype=self.dtypes[name])
+                      for name in self.names}
+        self._columns = [self._data[name] for name in self.names]
+        self._length = 0
+        self._head = 0
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def append(self, *values):
+        """Append one sample
+
+        Args:
+            values: one value per column, in the order of creation.
+        """
+        if len(values) != len(self._columns):
+            raise ValueError('Expected {0} values, got {1}'.format(
+                len(self._columns), len(values)))
+        if self.ring:
+            i = self._head
+            j = i + self.capacity
+            for column, value in zip(self._columns, values):
+                column[i] = value
+                column[j] = value
+            self._head = (i + 1) % self.capacity
+            if self._length < self.capacity:
+                self._length += 1
+        else:
+            if self._length == self.capacity:
+                self._grow()
+            i = self._length
+            for column, value in zip(self._columns, values):
+                column[i] = value
+            self._length += 1
+
+    def extend(self, *columns):
+        """Append several samples at once
+
+        Args:
+            columns: one array like per column, all with the same length.
+        """
+        columns = [np.asarray(column) for column in columns]
+        if len(columns) != len(self._columns):
+            raise ValueError('Expected {0} columns, got {1}'.format(
+                len(self._columns), len(columns)))
+        for row in zip(*columns):
+            self.append(*row)
+
+    def _grow(self):
+        """Double the capacity of a growable buffer
+        """
+        self.capacity = 2 * self.capacity
+        for name in self.names:
+            new_column = np.zeros(self.capacity, dtype=self.dtypes[name])
+            new_column[:self._length] = self._data[name][:self._length]
+            self._data[name] = new_column
+        self._columns = [self._data[name] for name in self.names]
+
+    def column(self, name):
+        """Get the stored samples of a column
+
+        Args:
+            name: name of the column.
+        Returns:
+            numpy.ndarray: a view with the samples, from oldest to newest.
+        """
+        data = self._data[name]
+        if self.ring:
+            end = self._head + self.capacity
+            return data[end - self._length:end]
+        return data[:self._length]
+
+    def last(self, name):
+        """Get the newest sample of a column
+
+        Args:
+            name: name of the column.
+        Returns:
+            the newest value or None if buffer is empty.
+        """
+        if not self._length:
+            return None
+        if self.ring:
+            return self._data[name][self._head + self.capacity - 1]
+        return self._data[name][self._length - 1]
+
+    def as_dict(self):
+        """Get all columns
+
+        Returns:
+            dict: a dictionary with a view for each column.
+        """
+        return {name: self.column(name) for name in self.names}
+
+    def clear(self):
+        """Discard all samples, keeping the allocated storage
+        """
+        self._length = 0
+        self._head = 0
+
+
+# Record written for each sample by TelemetryRecorder
+RECORD_DTYPE = np.dtype([('t', '<f8'), ('setpoint', '<i4'), ('position', '<i4'),
+                         ('velocity', '<i4'), ('current', '<i2'), ('statusword', '<u2')])
+
+
+class TelemetryRecorder:
+    """Stream fixed size telemetry records to a memory mapped file
+
+    The file is made of a header followed by the records. The header has the
+    following structure (little endian):
+
+    +--------+------+---------------------------------------------+
+    | Offset | Size | Description                                 |
+    +========+======+=============================================+
+    | 0      | 8    | magic, 'EPOSTLM' followed by a null byte    |
+    +--------+------+---------------------------------------------+
+    | 8      | 2    | file format version                         |
+    +--------+------+---------------------------------------------+
+    | 12     | 4    | header size, offset of first record         |
+    +--------+------+---------------------------------------------+
+    | 16     | 8    | number of committed records                 |
+    +--------+------+---------------------------------------------+
+    | 24     | 4    | size of json description                    |
+    +--------+------+---------------------------------------------+
+    | 28     | n    | json with record dtype and start time       |
+    +--------+------+---------------------------------------------+
+
+    The number of committed records is only updated after a record is
+    completely written, so the file can be opened with :func:`load` by
+    another process while it is being written. The file grows by chunks of
+    records to avoid remapping it on every sample.
+
+    Args:
+        filename: path of file to be created.
+        dtype (optional): numpy dtype of each record. Default RECORD_DTYPE.
+        chunk (optional): number of records added each time file grows.
+    """
+    MAGIC = b'EPOSTLM\x00'
+    VERSION = 1
+    # offset of number of committed records in header
+    _COUNT_OFFSET = 16
+    _ALIGNMENT = 64
+
+    def __init__(self, filename, dtype=RECORD_DTYPE, chunk=65536):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.chunk = chunk
+        self.count = 0
+        self.t0 = time.monotonic()
+        description = json.dumps({'descr': self.dtype.descr,
+                                  'start_time': time.time()}).encode('utf-8')
+        header_size = 28 + len(description)
+        self.header_size = header_size + (-header_size % self._ALIGNMENT)
+        with open(filename, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<HHIQI', self.VERSION, 0, self.header_size,
+                                0, len(description)))
+            f.write(description)
+            f.truncate(self.header_size)
+        self._count = np.memmap(filename, dtype='<u8', mode='r+',
+                                offset=self._COUNT_OFFSET, shape=(1,))
+        self.capacity = 0
+        self._records = None
+        self._grow()
+
+    def _grow(self):
+        """Extend the file by one chunk and map it again
+        """
+        if self._records is not None:
+            self._records.flush()
+            del self._records
+        self.capacity = self.capacity + self.chunk
+        with open(self.filename, 'r+b') as f:
+            f.truncate(self.header_size + self.capacity * self.dtype.itemsize)
+        self._records = np.memmap(self.filename, dtype=self.dtype, mode='r+',
+                                  offset=self.header_size, shape=(self.capacity,))
+
+    def record(self, setpoint=0, position=0, velocity=0, current=0, statusword=0, t=None):
+        """Write one record
+
+        Args:
+            setpoint: demanded position [qc].
+            position: actual position [qc].
+            velocity: actual velocity [rpm].
+            current: actual current [mA].
+            statusword: statusword of device.
+            t (optional): timestamp [s]. If None, the time elapsed since
+                the creation of recorder is used.
+        """
+        self.write(t if t is not None else time.monotonic() - self.t0,
+                   setpoint, position, velocity, current, statusword)
+
+    def write(self, *values):
+        """Write one record with a value for each field of dtype
+
+        Args:
+            values: one value per field of dtype, in order.
+        """
+        if self._records is None:
+            raise ValueError('Recorder is closed')
+        if self.count == self.capacity:
+            self._grow()
+        self._records[self.count] = values
+        self.count += 1
+        # commit only after record is complete
+        self._count[0] = self.count
+
+    def flush(self):
+        """Flush records and header to disk
+        """
+        if self._records is not None:
+            self._records.flush()
+            self._count.flush()
+
+    def close(self):
+        """Flush and close file, trimming the unused space at the end
+        """
+        if self._records is None:
+            return
+        self.flush()
+        del self._records
+        self._records = None
+        del self._count
+        with open(self.filename, 'r+b') as f:
+            f.truncate(self.header_size + self.count * self.dtype.itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def load(cls, filename):
+        """Open a recording file, even if is still being written
+
+        Args:
+            filename: path of recording file.
+        Returns:
+            tuple: A tuple containing:
+
+            :records: a read only memory mapped structured array with the committed records.
+            :info: a dictionary with the json description of file.
+        """
+        with open(filename, 'rb') as f:
+            header = f.read(28)
+            if len(header) < 28 or header[:8] != cls.MAGIC:
+                raise ValueError('Not a telemetry recording: {0}'.format(filename))
+            version, _, header_size, count, size = struct.unpack('<HHIQI', header[8:])
+            if version > cls.VERSION:
+                raise ValueError('Unsupported version: {0}'.format(version))
+            info = json.loads(f.read(size).decode('utf-8'))
+        dtype = np.dtype([tuple(field) for field in info['descr']])
+        if count == 0:
+            return np.zeros(0, dtype=dtype), info
+        records = np.memmap(filename, dtype=dtype, mode='r',
+                            offset=header_size, shape=(count,))
+        return records, info
@@ -0,0 +1,330 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import itertools
+import logging
+import os
+import numpy as np
+from telemetry import TelemetryBuffer
+
+# names used for columns of files without header
+default_names = ('time', 'position')
+
+
+def _read_header(f, delimiter):
+    """Check if first line of file is a header
+
+    Args:
+        f: file object positioned at the beginning.
+        delimiter: column delimiter.
+    Returns:
+        tuple: A tuple containing:
+
+        :names: list of column names if a header is present or None.
+        :first_line: first line of data if no header was found or None.
+    """
+    line = f.readline()
+    fields = [field.strip() for field in line.split(delimiter)]
+    try:
+        [float(field) for field in fields]
+    except ValueError:
+        return fields, None
+    return None, line
+
+
+def _column_names(n_columns, names=None):
+    """Build the list of names for a file without header
+    """
+    if names is None:
+        names = default_names
+    names = list(names[:n_columns])
+    names.extend('column{0}'.format(i) for i in range(len(names), n_columns))
+    return names
+
+
+def _parse_lines(lines, delimiter):
+    """Parse a list of text lines into a 2D float array
+    """
+    return np.loadtxt(lines, delimiter=delimiter, ndmin=2, dtype='float64')
+
+
+def cache_filename(filename):
+    """Name of the binary sidecar used to cache a parsed csv file
+
+    Args:
+        filename: path of csv file.
+    Returns:
+        str: path of binary sidecar.
+    """
+    return filename + '.npy'
+
+
+def load_csv(filename, delimiter=',', names=None, cache=True):
+    """Load a trajectory csv file in one pass
+
+    The file is parsed by NumPy into a structured array where each column is
+    accessed by its name, like ``data['time']``. If the first line is not
+    numeric it is used as header, otherwise the columns are named with
+    ``names`` or ``('time', 'position', 'column2', ...)``.
+
+    When cache is enabled, the parsed result is saved in a binary sidecar
+    next to the csv file (see :func:`cache_filename`). If the sidecar is
+    newer than the csv file, it is memory mapped instead, so large files
+    are available immediately and are not loaded into memory.
+
+    Args:
+        filename: path of csv file.
+        delimiter (optional): column delimiter. Default ','.
+        names (optional): names of columns for files without header.
+        cache (optional): use a binary sidecar to cache the result.
+    Returns:
+        numpy.ndarray: structured array with float64 columns.
+    """
+    logger = logging.getLogger('TRAJECTORY')
+    sidecar = cache_filename(filename)
+    if cache and os.path.isfile(sidecar) and \
+            os.path.getmtime(sidecar) >= os.path.getmtime(filename):
+        logger.debug('Using cached trajectory {0}'.format(sidecar))
+        return np.load(sidecar, mmap_mode='r')
+
+    with open(filename) as f:
+        header, first_line = _read_header(f, delimiter)
+        lines = f if first_line is None else itertools.chain([first_line], f)
+        lines = (line for line in lines if line.strip())
+        values = _parse_lines(lines, delimiter)
+    if header is None:
+        header = _column_names(values.shape[1], names)
+    data = np.zeros(values.shape[0], dtype=[(name, 'float64') for name in header])
+    for i, name in enumerate(header):
+        data[name] = values[:, i]
+
+    if cache:
+        try:
+            np.save(sidecar, data)
+        except OSError as e:
+            logger.info('Unable to cache trajectory: {0}'.format(e))
+    return data
+
+
+def iter_csv(filename, delimiter=',', chunk_size=4096, cache=True):
+    """Iterate over the rows of a trajectory csv file
+
+    The file is read and parsed in chunks of ``chunk_size`` lines, so memory
+    used is constant regardless of the length of the file and the first row
+    is available immediately. If a valid binary sidecar exists (see
+    :func:`load_csv`), rows are read from it instead.
+
+    Args:
+        filename: path of csv file.
+        delimiter (optional): column delimiter. Default ','.
+        chunk_size (optional): number of lines parsed at once.
+        cache (optional): use binary sidecar if available.
+    Yields:
+        tuple: values of each column of a row as floats.
+    """
+    sidecar = cache_filename(filename)
+    if cache and os.path.isfile(sidecar) and \
+            os.path.getmtime(sidecar) >= os.path.getmtime(filename):
+        data = np.load(sidecar, mmap_mode='r')
+        for start in range(0, data.shape[0], chunk_size):
+            for row in data[start:start + chunk_size].tolist():
+                yield row
+        return
+
+    with open(filename) as f:
+        _, first_line = _read_header(f, delimiter)
+        lines = f if first_line is None else itertools.chain([first_line], f)
+        lines = (line for line in lines if line.strip())
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            for row in _parse_lines(chunk, delimiter).tolist():
+                yield tuple(row)
+
+
+def schedule(t, position, period):
+    """Precompute a fixed rate schedule of setpoints
+
+    Resample a trajectory with a fixed period using linear interpolation,
+    to be used by loops with a fixed cycle time.
+
+    Args:
+        t: array of times of the trajectory [s].
+        position: array of positions of the trajectory.
+        period: sample period [s].
+    Returns:
+        tuple: A tuple containing:
+
+        :t: array of sampling times.
+        :position: array of rounded positions as int32.
+    """
+    t = np.asarray(t, dtype='float64')
+    t_schedule = np.arange(t[0], t[-1] + period / 2.0, period)
+    position = np.rint(np.interp(t_schedule, t, position)).astype('int32')
+    return t_schedule, position
+
+
+class TrajectoryPlayer:
+    """Time indexed playback of a trajectory
+
+    Instead of advancing one row per cycle, the row to be used is found
+    from the current time, so if the loop falls behind, playback catches
+    up by skipping rows instead of accumulating delay. Rows are pulled from
+    an iterator (see :func:`iter_csv`) in chunks and each lookup is made
+    with ``numpy.searchsorted`` inside the current chunk, so memory used is
+    constant.
+
+    The lag of each cycle, how far playback runs behind the trajectory, is
+    the time elapsed when the cycle finished minus the trajectory time of
+    the setpoint sent. It is stored with :func:`mark` and summarized by
+    :func:`report`. Count, mean and max cover the whole playback, while the
+    99th percentile is taken over the last lag_capacity cycles, so memory
+    used stays constant.
+
+    Args:
+        rows: iterable of rows, where the first two values are time and position.
+        chunk_size (optional): number of rows kept in memory.
+        interpolate (optional): interpolate position between rows. Default True.
+        lag_capacity (optional): number of last lags kept. Default 65536.
+    """
+
+    def __init__(self, rows, chunk_size=4096, interpolate=True, lag_capacity=65536):
+        self._rows = iter(rows)
+        self.chunk_size = max(chunk_size, 2)
+        self.interpolate = interpolate
+        self._t = np.zeros(0)
+        self._position = np.zeros(0)
+        # global index of first row of current chunk
+        self._offset = 0
+        self._exhausted = False
+        self.finished = False
+        self.row = -1
+        self.rows_skipped = 0
+        self.overrun = 0.0
+        # trajectory time of last setpoint
+        self.reference_t = None
+        self.cycles = 0
+        self._lag_sum = 0.0
+        self._lag_max = 0.0
+        self.lags = TelemetryBuffer([('t', 'float64'), ('lag', 'float64')],
+                                    capacity=lag_capacity, ring=True)
+        if not self._load_chunk():
+            raise ValueError('Trajectory has no rows')
+
+    def _load_chunk(self):
+        """Load next chunk of rows, keeping the last row of previous chunk
+
+        Returns:
+            bool: True if any new row was loaded.
+        """
+        rows = [row[:2] for row in itertools.islice(self._rows, self.chunk_size)]
+        if not rows:
+            self._exhausted = True
+            return False
+        values = np.array(rows, dtype='float64')
+        if len(self._t):
+            self._offset += len(self._t) - 1
+            self._t = np.concatenate((self._t[-1:], values[:, 0]))
+            self._position = np.concatenate((self._position[-1:], values[:, 1]))
+        else:
+            self._t = values[:, 0].copy()
+            self._position = values[:, 1].copy()
+        return True
+
+    def setpoint(self, t):
+        """Get the setpoint for a given instant
+
+        Args:
+            t: time [s] since start of playback.
+        Returns:
+            tuple: A tuple containing:
+
+            :position: rounded position to be sent.
+            :row: index of the row at or before t.
+        """
+        # catch up, loading chunks until t is inside the current one
+        while t >= self._t[-1] and not self._exhausted:
+            self._load_chunk()
+        i = int(np.searchsorted(self._t, t, side='right')) - 1
+        if i < 0:
+            # before first row
+            i = 0
+            position = self._position[0]
+            self.reference_t = float(self._t[0])
+        elif i >= len(self._t) - 1:
+            # at or after the last row loaded
+            i = len(self._t) - 1
+            position = self._position[i]
+            self.reference_t = float(self._t[i])
+            if self._exhausted and not self.finished:
+                self.finished = True
+                self.overrun = float(t - self._t[i])
+        elif self.interpolate:
+            ratio = (t - self._t[i]) / (self._t[i + 1] - self._t[i])
+            position = self._position[i] + ratio * (self._position[i + 1] - self._position[i])
+            self.reference_t = float(t)
+        else:
+            position = self._position[i]
+            self.reference_t = float(self._t[i])
+        row = self._offset + i
+        if row > self.row + 1 and self.row >= 0:
+            self.rows_skipped += row - self.row - 1
+        self.row = max(row, self.row)
+        return int(round(position)), row
+
+    def mark(self, t_done):
+        """Store the lag of the cycle of last setpoint
+
+        Args:
+            t_done: time since start of playback at which the cycle finished [s].
+        """
+        if self.reference_t is None:
+            return
+        lag = t_done - self.reference_t
+        self.cycles += 1
+        self._lag_sum += lag
+        self._lag_max = max(self._lag_max, lag)
+        self.lags.append(t_done, lag)
+
+    def report(self):
+        """Summary of playback
+
+        Returns:
+            dict: number of cycles, rows used, rows skipped, mean, max and
+            99th percentile of recent lag [s] and overrun after last row [s].
+        """
+        lag = self.lags['lag']
+        if self.cycles:
+            mean_lag = self._lag_sum / self.cycles
+            max_lag = self._lag_max
+            p99_lag = float(np.percentile(lag, 99))
+        else:
+            mean_lag = max_lag = p99_lag = 0.0
+        return {'cycles': self.cycles,
+                'rows': self.row + 1,
+                'rows_skipped': self.rows_skipped,
+                'mean_lag': mean_lag,
+                'max_lag': max_lag,
+                'p99_lag': p99_lag,
+                'overrun': self.overrun}
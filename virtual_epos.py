@@ -0,0 +1,451 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2018 Bruno Tibério
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+import time
+import can
+
+# NMT state codes as sent in heartbeat messages
+NMT_CODES = {'INITIALISING': 0x00, 'STOPPED': 0x04, 'OPERATIONAL': 0x05,
+             'PRE-OPERATIONAL': 0x7F}
+
+# statusword bits of each state of the device, bit 8 is offset current measured
+_STATE_BITS = {'switch on disabled': 0x0140, 'ready to switch on': 0x0121,
+               'switched on': 0x0123, 'operation enable': 0x0137,
+               'quick stop active': 0x0117, 'fault': 0x0108}
+_STATE_MASK = 0x016F
+
+# (index, subindex, size in bytes, value) of objects present by default
+_DEFAULTS = [
+    (0x1000, 0, 4, 0x00020192),  # device type
+    (0x1001, 0, 1, 0),           # error register
+    (0x1005, 0, 4, 0x80),        # COB-ID SYNC
+    (0x100C, 0, 2, 0),           # guard time
+    (0x100D, 0, 1, 0),           # life time factor
+    (0x1016, 0, 1, 1),           # consumer heartbeat time
+    (0x1016, 1, 4, 0),
+    (0x1017, 0, 2, 0),           # producer heartbeat time
+    (0x1018, 0, 1, 4),           # identity object
+    (0x1018, 1, 4, 0x000000FB),
+    (0x1018, 2, 4, 0x20000000),
+    (0x1018, 3, 4, 0x00010000),
+    (0x1018, 4, 4, 0),
+    (0x2003, 0, 1, 4),           # version numbers
+    (0x2003, 1, 2, 0x2036),
+    (0x2003, 2, 2, 0x6220),
+    (0x2003, 3, 2, 0),
+    (0x2003, 4, 2, 0),
+    (0x2004, 0, 8, 0),           # serial number
+    (0x6040, 0, 2, 0),           # controlword
+    (0x6041, 0, 2, 0x0140),      # statusword
+    (0x6060, 0, 1, 0),           # modes of operation
+    (0x6061, 0, 1, 0),           # modes of operation display
+]
+
+
+class VirtualEpos:
+    """Simulated EPOS device on a CAN bus
+
+    Answers the requests of :class:`epos.Epos` with no hardware, so streaming
+    loops, watchdogs and supervisors can be exercised and benchmarked on a
+    virtual bus. It implements:
+
+    * expedited SDO download and expedited or segmented SDO upload;
+    * NMT commands, boot-up message, heartbeat producer (0x1017) and
+      consumer (0x1016), which faults the device with a heartbeat error
+      when a monitored node stops;
+    * the device state machine driven by the controlword;
+    * receive and transmit PDOs configured by SDO, applied on reception or
+      on SYNC, with event driven transmission limited by the inhibit time.
+
+    Any object written by SDO is created if it does not exist. The behaviour
+    of the motor is left to a model, a function called periodically with the
+    device and the time step, which reads and writes objects with
+    :func:`get_value` and :func:`set_value`.
+
+    Args:
+        node_id (optional): node ID of device. Default 1.
+        channel (optional): name of CAN channel. Default 'virtual_epos'.
+        interface (optional): python-can interface. Default 'virtual'.
+        model (optional): function model(device, dt) run on every cycle.
+        rate (optional): frequency of cycles of device [Hz]. Default 1000.
+    """
+
+    def __init__(self, node_id=1, channel='virtual_epos', interface='virtual', model=None,
+                 rate=1000):
+        self.node_id = node_id
+        self.channel = channel
+        self.interface = interface
+        self.model = model
+        self.rate = rate
+        self.logger = logging.getLogger('VIRTUAL')
+        self.objects = {}
+        for index, subindex, size, value in _DEFAULTS:
+            self.objects[(index, subindex)] = bytearray(value.to_bytes(size, 'little'))
+        # PDOs start disabled, with default COB-IDs and no objects mapped
+        for n in range(4):
+            for parameter, mapping, base in ((0x1400, 0x1600, 0x200), (0x1800, 0x1A00, 0x180)):
+                cob_id = 0x80000000 | (base + 0x100 * n + node_id)
+                self.objects[(parameter + n, 1)] = bytearray(cob_id.to_bytes(4, 'little'))
+                self.objects[(parameter + n, 2)] = bytearray([255])
+                self.objects[(mapping + n, 0)] = bytearray([0])
+            self.objects[(0x1800 + n, 3)] = bytearray(2)
+        self.nmt_state = 'INITIALISING'
+        self.state = 'switch on disabled'
+        self._lock = threading.RLock()
+        self._upload = None
+        self._sync_count = {}
+        self._sync_rpdo = {}
+        self._tpdo_sent = {}
+        # time of last heartbeat of each node monitored
+        self._heartbeats = {}
+        self._exit_flag = threading.Event()
+        self._threads = []
+        self.bus = None
+        self.notifier = None
+
+    # --------------------------------------------------------------------------
+    # Object dictionary
+    # --------------------------------------------------------------------------
+
+    def get_value(self, index, subindex=0, signed=False):
+        """Read an object as an integer
+
+        Returns:
+            int: value of object or None if it does not exist.
+        """
+        with self._lock:
+            data = self.objects.get((index, subindex))
+            if data is None:
+                return None
+            return int.from_bytes(data, 'little', signed=signed)
+
+    def set_value(self, index, subindex, value, size=None, signed=False):
+        """Write an integer to an object
+
+        Args:
+            index: index of object.
+            subindex: subindex of object.
+            value: integer value.
+            size (optional): size in bytes, needed only if object does not exist.
+            signed (optional): if value is signed. Default False.
+        """
+        with self._lock:
+            if size is None:
+                size = len(self.objects[(index, subindex)])
+            self._write(index, subindex, value.to_bytes(size, 'little', signed=signed))
+
+    def _write(self, index, subindex, data):
+        """Store an object and apply its side effects
+        """
+        with self._lock:
+            self.objects[(index, subindex)] = bytearray(data)
+            if index == 0x6040:
+                self._controlword(int.from_bytes(data, 'little'))
+            elif index == 0x6060:
+                self.objects[(0x6061, 0)] = bytearray(data)
+
+    def _controlword(self, controlword):
+        """Change state of device following the controlword
+        """
+        state = self.state
+        if state == 'fault':
+            # only a rising edge of fault reset leaves the fault state
+            if controlword & 0x80:
+                state = 'switch on disabled'
+        elif not controlword & 0x02:
+            state = 'switch on disabled'
+        elif not controlword & 0x04:
+            if state == 'operation enable':
+                state = 'quick stop active'
+            else:
+                state = 'switch on disabled'
+        elif controlword & 0x0F == 0x06:
+            state = 'ready to switch on'
+        elif controlword & 0x0F == 0x07 and state != 'switch on disabled':
+            state = 'switched on'
+        elif controlword & 0x0F == 0x0F and state in ('switched on', 'operation enable',
+                                                       'quick stop active'):
+            state = 'operation enable'
+        self.set_state(state)
+
+    def set_state(self, state):
+        """Set state of device and update statusword
+
+        Args:
+            state: one of 'switch on disabled', 'ready to switch on',
+                'switched on', 'operation enable', 'quick stop active' or 'fault'.
+        """
+        with self._lock:
+            self.state = state
+            statusword = self.get_value(0x6041) & ~_STATE_MASK | _STATE_BITS[state]
+            self.objects[(0x6041, 0)] = bytearray(statusword.to_bytes(2, 'little'))
+
+    # --------------------------------------------------------------------------
+    # CAN communication
+    # --------------------------------------------------------------------------
+
+    def start(self):
+        """Connect to the bus, send boot-up message and start cycles
+        """
+        self.bus = can.Bus(interface=self.interface, channel=self.channel,
+                           receive_own_messages=False)
+        self.notifier = can.Notifier(self.bus, [self._on_message])
+        self._exit_flag.clear()
+        self._send(0x700 + self.node_id, [0])
+        self.nmt_state = 'PRE-OPERATIONAL'
+        self._threads = [threading.Thread(target=self._cycle_loop, daemon=True),
+                         threading.Thread(target=self._heartbeat_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop cycles and disconnect from the bus
+        """
+        self._exit_flag.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None
+        if self.bus is not None:
+            self.bus.shutdown()
+            self.bus = None
+
+    def _send(self, cob_id, data):
+        try:
+            self.bus.send(can.Message(arbitration_id=cob_id, data=bytes(data),
+                                      is_extended_id=False))
+        except can.CanError as e:
+            self.logger.info('Failed to send 0x{0:03X}: {1}'.format(cob_id, e))
+
+    def emcy(self, code, register=0, data=b''):
+        """Send an emergency message
+
+        Args:
+            code: emergency error code.
+            register (optional): error register. Default 0.
+            data (optional): manufacturer specific bytes, up to 5.
+        """
+        self._send(0x80 + self.node_id,
+                   code.to_bytes(2, 'little') + bytes([register]) + bytes(data).ljust(5, b'\0'))
+
+    def _on_message(self, msg):
+        cob_id = msg.arbitration_id
+        data = msg.data
+        if cob_id == 0:
+            if data[1] in (0, self.node_id):
+                self._nmt(data[0])
+        elif cob_id == 0x600 + self.node_id:
+            if self.nmt_state != 'INITIALISING':
+                self._sdo(data)
+        elif cob_id == self.get_value(0x1005) & 0x7FF:
+            self._sync()
+        elif 0x700 < cob_id < 0x780:
+            self._heartbeats[cob_id - 0x700] = time.monotonic()
+        elif self.nmt_state == 'OPERATIONAL':
+            self._rpdo(cob_id, data)
+
+    def _nmt(self, command):
+        if command == 0x01:
+            self.nmt_state = 'OPERATIONAL'
+        elif command == 0x02:
+            self.nmt_state = 'STOPPED'
+        elif command == 0x80:
+            self.nmt_state = 'PRE-OPERATIONAL'
+        elif command in (0x81, 0x82):
+            self._sync_rpdo.clear()
+            self._send(0x700 + self.node_id, [0])
+            self.nmt_state = 'PRE-OPERATIONAL'
+
+    def _sdo(self, data):
+        """Serve a SDO request
+        """
+        command = data[0] >> 5
+        index = int.from_bytes(data[1:3], 'little')
+        subindex = data[3]
+        reply = 0x580 + self.node_id
+        if command == 1:
+            # expedited download, size in bits 2-3 if bit 0 is set
+            if not data[0] & 0x02:
+                self._abort(index, subindex, 0x05040001)
+                return
+            size = 4 - ((data[0] >> 2) & 0x03) if data[0] & 0x01 else 4
+            self._write(index, subindex, data[4:4 + size])
+            self._send(reply, bytes([0x60]) + bytes(data[1:4]) + bytes(4))
+        elif command == 2:
+            with self._lock:
+                value = self.objects.get((index, subindex))
+                value = bytes(value) if value is not None else None
+            if value is None:
+                self._abort(index, subindex, 0x06020000)
+            elif len(value) <= 4:
+                header = 0x43 | ((4 - len(value)) << 2)
+                self._send(reply, bytes([header]) + bytes(data[1:4]) + value.ljust(4, b'\0'))
+            else:
+                self._upload = value
+                self._send(reply, bytes([0x41]) + bytes(data[1:4]) +
+                           len(value).to_bytes(4, 'little'))
+        elif command == 3 and self._upload is not None:
+            # upload segment, bit 4 is the toggle bit
+            segment, self._upload = self._upload[:7], self._upload[7:]
+            header = (data[0] & 0x10) | ((7 - len(segment)) << 1)
+            if not self._upload:
+                header |= 0x01
+                self._upload = None
+            self._send(reply, bytes([header]) + segment.ljust(7, b'\0'))
+        elif command != 4:
+            self._abort(index, subindex, 0x05040001)
+
+    def _abort(self, index, subindex, code):
+        self._send(0x580 + self.node_id, bytes([0x80]) + index.to_bytes(2, 'little') +
+                   bytes([subindex]) + code.to_bytes(4, 'little'))
+
+    def _mapping(self, mapping_index):
+        """Objects mapped in a PDO as tuples (index, subindex, bytes)
+        """
+        count = self.get_value(mapping_index, 0) or 0
+        objects = []
+        for subindex in range(1, count + 1):
+            entry = self.get_value(mapping_index, subindex)
+            objects.append((entry >> 16, (entry >> 8) & 0xFF, (entry & 0xFF) // 8))
+        return objects
+
+    def _rpdo(self, cob_id, data):
+        """Apply a received PDO mapped to this device
+        """
+        for n in range(4):
+            parameter = self.get_value(0x1400 + n, 1)
+            if parameter is None or parameter & 0x80000000 or parameter & 0x7FF != cob_id:
+                continue
+            if (self.get_value(0x1400 + n, 2) or 0) <= 240:
+                # synchronous, applied on next SYNC
+                self._sync_rpdo[n] = bytes(data)
+            else:
+                self._apply_rpdo(n, data)
+
+    def _apply_rpdo(self, n, data):
+        offset = 0
+        with self._lock:
+            for index, subindex, size in self._mapping(0x1600 + n):
+                self._write(index, subindex, data[offset:offset + size])
+                offset += size
+
+    def _tpdo_data(self, n):
+        with self._lock:
+            return b''.join(bytes(self.objects.get((index, subindex), bytes(size)))
+                            for index, subindex, size in self._mapping(0x1A00 + n))
+
+    def _tpdos(self):
+        """List of enabled transmit PDOs as tuples (n, COB-ID, transmission type)
+        """
+        tpdos = []
+        for n in range(4):
+            parameter = self.get_value(0x1800 + n, 1)
+            if parameter is None or parameter & 0x80000000:
+                continue
+            tpdos.append((n, parameter & 0x7FF, self.get_value(0x1800 + n, 2) or 0))
+        return tpdos
+
+    def _sync(self):
+        for n, data in list(self._sync_rpdo.items()):
+            self._apply_rpdo(n, data)
+        self._sync_rpdo.clear()
+        if self.nmt_state != 'OPERATIONAL':
+            return
+        for n, cob_id, transmission_type in self._tpdos():
+            if transmission_type < 1 or transmission_type > 240:
+                continue
+            count = self._sync_count.get(n, 0) + 1
+            if count >= transmission_type:
+                count = 0
+                self._send(cob_id, self._tpdo_data(n))
+            self._sync_count[n] = count
+
+    def _event_tpdos(self, now):
+        """Send event driven TPDOs that changed, limited by inhibit time
+        """
+        for n, cob_id, transmission_type in self._tpdos():
+            if transmission_type < 254:
+                continue
+            data = self._tpdo_data(n)
+            last_data, last_time = self._tpdo_sent.get(n, (None, 0.0))
+            inhibit = (self.get_value(0x1800 + n, 3) or 0) * 1e-4
+            timer = (self.get_value(0x1800 + n, 5) or 0) * 1e-3
+            if now - last_time < inhibit:
+                continue
+            if data != last_data or (timer and now - last_time >= timer):
+                self._send(cob_id, data)
+                self._tpdo_sent[n] = (data, now)
+
+    def _check_heartbeats(self, now):
+        """Fault device if a monitored node stopped sending heartbeats
+        """
+        for subindex in range(1, (self.get_value(0x1016, 0) or 0) + 1):
+            value = self.get_value(0x1016, subindex) or 0
+            node_id, period = (value >> 16) & 0x7F, value & 0xFFFF
+            last = self._heartbeats.get(node_id)
+            # monitoring starts with the first heartbeat received
+            if not period or last is None or now - last <= period * 1e-3:
+                continue
+            del self._heartbeats[node_id]
+            self.logger.info('Heartbeat of node {0} lost'.format(node_id))
+            with self._lock:
+                self.set_state('fault')
+                self.set_value(0x1001, 0, 0x11)
+            self.emcy(0x8130, 0x11)
+
+    def _cycle_loop(self):
+        period = 1.0 / self.rate
+        deadline = time.monotonic()
+        last = deadline
+        while not self._exit_flag.is_set():
+            now = time.monotonic()
+            if self.model is not None:
+                with self._lock:
+                    self.model(self, now - last)
+            last = now
+            self._check_heartbeats(now)
+            if self.nmt_state == 'OPERATIONAL':
+                self._event_tpdos(now)
+            deadline += period
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                deadline = time.monotonic()
+
+    def _heartbeat_loop(self):
+        deadline = time.monotonic()
+        while not self._exit_flag.is_set():
+            period = (self.get_value(0x1017) or 0) * 1e-3
+            if not period:
+                self._exit_flag.wait(0.01)
+                deadline = time.monotonic()
+                continue
+            deadline += period
+            if self._exit_flag.wait(max(deadline - time.monotonic(), 0)):
+                break
+            self._send(0x700 + self.node_id, [NMT_CODES[self.nmt_state]])